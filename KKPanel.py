@@ -2,7 +2,6 @@ import bpy, os, textwrap
 from bpy.types import PropertyGroup
 from bpy.props import (
     IntProperty,
-    FloatProperty,
     EnumProperty,
     BoolProperty,
     StringProperty
@@ -21,10 +20,6 @@ class PlaceholderProperties(PropertyGroup):
     #This will let the plugin track what objects belong to what character
     character_name: StringProperty(default='')
 
-    #this lets the plugin time various actions
-    total_timer : FloatProperty(default=0)
-    timer : FloatProperty(default=0)
-    
     bake_mult: IntProperty(
         min=1, max = 6,
         default=1,
@@ -394,6 +389,13 @@ class EXTRAS_PT_panel(bpy.types.Panel):
         split = row.split(align=True, factor=splitfac)
         split.label(text=t('mat_comb_switch'))
         split.operator('kkbp.matcombswitch', text = '', icon='FILE_REFRESH')
+
+        box = layout.box()
+        col = box.column(align=True)
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.label(text=t('pack_for_distribution'))
+        split.operator('kkbp.packtextures', text = '', icon='UGLYPACKAGE')
         
         #check https://ui.blender.org/icons/ for all icon names
 
@@ -52,6 +52,7 @@ def reg_unreg(register_bool):
     from .extras.matcombswitch import mat_comb_switch
     from .extras.resetmaterials import reset_materials
     from .extras.linkhair import link_hair
+    from .extras.packtextures import pack_textures
 
     from . KKPanel import PlaceholderProperties
     from . KKPanel import (
@@ -87,6 +88,7 @@ def reg_unreg(register_bool):
         InstallPIL,
         reset_materials,
         link_hair,
+        pack_textures,
 
         kkbp_import,
         modify_mesh,
@@ -113,8 +115,13 @@ def reg_unreg(register_bool):
 def register():
     reg_unreg(True)
     register_smc_types()
+    from .common import register_registry_handlers
+    register_registry_handlers()
 
 def unregister():
+    from .common import unregister_registry_handlers, unregister_log_timer
+    unregister_registry_handlers()
+    unregister_log_timer()
     reg_unreg(False)
     unregister_smc_types()
 
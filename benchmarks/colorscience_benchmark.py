@@ -0,0 +1,449 @@
+'''
+Microbenchmarks for importing/colorscience.py. This doesn't need Blender, run it with any python that has numpy:
+
+    python benchmarks/colorscience_benchmark.py --sizes 512 1024 2048 4096 8192 --output results.json
+
+The reference implementations in this file are what the golden tests in test_colorscience.py compare the vectorized code against.
+
+It saturates and darkens synthetic noise images of each size and reports the speed of every engine in megapixels per second
+and the peak memory numpy allocated while it ran (measured with tracemalloc in a separate run, so it doesn't slow down the timed runs).
+'''
+
+import os, sys, math, time, json, argparse, statistics, tracemalloc
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'importing'))
+import colorscience, pngio
+
+LUT_PATH = os.path.join(os.path.dirname(colorscience.__file__), 'Lut_TimeDay.png')
+#same default as the batch_rows preference
+BATCH_ROWS = 512
+#width and height of the synthetic images. 8192 x 8192 needs a few GB of memory, so it's only run when asked for
+SIZES = [512, 1024, 2048, 4096, 8192]
+#a few shadow colors to check the dark code with. The first one is the default shadow color of the importer
+SHADOW_COLORS = [
+    {'r': 0.764, 'g': 0.880, 'b': 1},
+    {'r': 0.5, 'g': 0.5, 'b': 0.5},
+    {'r': 1, 'g': 0.8, 'b': 0.6},
+    {'r': 0.0, 'g': 0.0, 'b': 0.0},
+]
+
+
+# %% Reference implementations
+# This is the scalar code the vectorized shader color functions replaced, kept as-is so the results can be compared
+
+class float4:
+    '''class to mimic part of float4 class in Unity
+    multiplying things per element according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L330
+    returning things like float.XZW as [Xposition = X, Yposition = Z, Zposition = W] according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L3056
+    using the variable order x, y, z, w according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L42'''
+    def __init__(self, x = None, y = None, z = None, w = None):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.w = w
+    def __mul__ (self, vector):
+        #if a float4, multiply piece by piece, else multiply full vector
+        if type(vector) in [float, int]:
+            vector = float4(vector, vector, vector, vector)
+        x = self.x * vector.x if self.get('x') != None else None
+        y = self.y * vector.y if self.get('y') != None else None
+        z = self.z * vector.z if self.get('z') != None else None
+        w = self.w * vector.w if self.get('w') != None else None
+        return float4(x,y,z,w)
+    __rmul__ = __mul__
+    def __add__ (self, vector):
+        #if a float4, add piece by piece, else add full vector
+        if type(vector) in [float, int]:
+            vector = float4(vector, vector, vector, vector)
+        x = self.x + vector.x if self.get('x') != None else None
+        y = self.y + vector.y if self.get('y') != None else None
+        z = self.z + vector.z if self.get('z') != None else None
+        w = self.w + vector.w if self.get('w') != None else None
+        return float4(x,y,z,w)
+    __radd__ = __add__
+    def __sub__ (self, vector):
+        #if a float4, subtract piece by piece, else subtract full vector
+        if type(vector) in [float, int]:
+            vector = float4(vector, vector, vector, vector)
+        x = self.x - vector.x if self.get('x') != None else None
+        y = self.y - vector.y if self.get('y') != None else None
+        z = self.z - vector.z if self.get('z') != None else None
+        w = self.w - vector.w if self.get('w') != None else None
+        return float4(x,y,z,w)
+    __rsub__ = __sub__
+    def __gt__ (self, vector):
+        #if a float4, compare piece by piece, else compare full vector
+        if type(vector) in [float, int]:
+            vector = float4(vector, vector, vector, vector)
+        x = self.x > vector.x if self.get('x') != None else None
+        y = self.y > vector.y if self.get('y') != None else None
+        z = self.z > vector.z if self.get('z') != None else None
+        w = self.w > vector.w if self.get('w') != None else None
+        return float4(x,y,z,w)
+    def __neg__ (self):
+        x = -self.x if self.get('x') != None else None
+        y = -self.y if self.get('y') != None else None
+        z = -self.z if self.get('z') != None else None
+        w = -self.w if self.get('w') != None else None
+        return float4(x,y,z,w)
+    def frac(self):
+        x = self.x - math.floor (self.x) if self.get('x') != None else None
+        y = self.y - math.floor (self.y) if self.get('y') != None else None
+        z = self.z - math.floor (self.z) if self.get('z') != None else None
+        w = self.w - math.floor (self.w) if self.get('w') != None else None
+        return float4(x,y,z,w)
+    def abs(self):
+        x = abs(self.x) if self.get('x') != None else None
+        y = abs(self.y) if self.get('y') != None else None
+        z = abs(self.z) if self.get('z') != None else None
+        w = abs(self.w) if self.get('w') != None else None
+        return float4(x,y,z,w)
+    def clamp(self):
+        x = (0 if self.x < 0 else 1 if self.x > 1 else self.x) if self.get('x') != None else None
+        y = (0 if self.y < 0 else 1 if self.y > 1 else self.y) if self.get('y') != None else None
+        z = (0 if self.z < 0 else 1 if self.z > 1 else self.z) if self.get('z') != None else None
+        w = (0 if self.w < 0 else 1 if self.w > 1 else self.w) if self.get('w') != None else None
+        return float4(x,y,z,w)
+    saturate = clamp
+    def get(self, var):
+        if hasattr(self, var):
+            return getattr(self, var)
+        else:
+            return None
+    def __str__(self):
+        return str([self.x, self.y, self.z, self.w])
+    __repr__ = __str__
+
+
+def MapValuesMain(color): #-> float4
+    '''mapvaluesmain function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPDiffuse.cginc'''
+    t0 = color;
+    tb30 = t0.y>=t0.z;
+    t30 = 1 if tb30 else float(0.0);
+    t1 = float4(t0.z, t0.y, t0.z, t0.w);
+    t2 = float4(t0.y - t1.x,  t0.z - t1.y);
+    t1.z = float(-1.0);
+    t1.w = float(0.666666687);
+    t2.z = float(1.0);
+    t2.w = float(-1.0);
+    t1 = float4(t30, t30, t30, t30) * float4(t2.x, t2.y, t2.w, t2.z) + float4(t1.x, t1.y, t1.w, t1.z);
+    tb30 = t0.x>=t1.x;
+    t30 = 1 if tb30 else 0.0;
+    t2.z = t1.w;
+    t1.w = t0.x;
+    t2 = float4(t1.w, t1.y, t2.z, t1.x)
+    t2 = (-t1) + t2;
+    t1 = float4(t30, t30, t30, t30) * t2 + t1;
+    t30 = min(t1.y, t1.w);
+    t30 = (-t30) + t1.x;
+    t2.x = t30 * 6.0 + 1.00000001e-10;
+    t11 = (-t1.y) + t1.w;
+    t11 = t11 / t2.x;
+    t11 = t11 + t1.z;
+    t1.x = t1.x + 1.00000001e-10;
+    t30 = t30 / t1.x;
+    t30 = t30 * 0.660000026;
+    #w component isn't used anymore so ignore
+    t2 = float4(t11, t11, t11).abs() + float4(-0.0799999982, -0.413333356, 0.25333333)
+    t2 = t2.frac()
+    t2 = (-t2) * float4(2.0, 2.0, 2.0) + float4(1.0, 1.0, 1.0);
+    t2 = t2.abs() * float4(3.0, 3.0, 3.0) + float4(-1.0, -1.0, -1.0);
+    t2 = t2.clamp()
+    t2 = t2 + float4(-1.0, -1.0, -1.0);
+    t2 = float4(t30, t30, t30) * t2 + float4(1.0, 1.0, 1.0);
+    return float4(t2.x, t2.y, t2.z, 1);
+
+
+def skin_dark_color(color) -> dict[str, float]:
+    '''Takes a 1.0 max rgba dict and returns a 1.0 max rgba dict. skin is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPSkinFrag.cginc '''
+    diffuse = float4(color['r'], color['g'], color['b'], 1)
+    shadingAdjustment = MapValuesMain(diffuse);
+
+    diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
+    diffuseShaded = -diffuseShaded * 2 + 1;
+
+    compTest = 0.555555582 < shadingAdjustment;
+    shadingAdjustment *= 1.79999995;
+    diffuseShaded = -diffuseShaded * 0.7225 + 1;
+    hlslcc_movcTemp = shadingAdjustment;
+    hlslcc_movcTemp.x = diffuseShaded.x if (compTest.x) else shadingAdjustment.x; #370
+    hlslcc_movcTemp.y = diffuseShaded.y if (compTest.y) else shadingAdjustment.y; #371
+    hlslcc_movcTemp.z = diffuseShaded.z if (compTest.z) else shadingAdjustment.z; #372
+    shadingAdjustment = (hlslcc_movcTemp).saturate(); #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
+
+    finalDiffuse = diffuse * shadingAdjustment;
+
+    bodyShine = float4(1.0656, 1.0656, 1.0656, 1);
+    finalDiffuse *= bodyShine;
+    fudge_factor = float4(0.02, 0.05, 0, 0) #result is slightly off but it looks consistently off so add a fudge factor
+    finalDiffuse += fudge_factor
+
+    return {'r':finalDiffuse.x, 'g':finalDiffuse.y, 'b':finalDiffuse.z, 'a':1}
+
+
+def ShadeAdjustItem(col, _ShadowColor): #-> float4
+    '''#shadeadjust function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/KKPItemDiffuse.cginc .
+    lines with comments at the end have been translated from C# to python. lines without comments at the end have been copied verbatim from the C# source'''
+    #start at line 63
+    t0 = col
+    t1 = float4(t0.y, t0.z, None, t0.x) * float4(_ShadowColor.y, _ShadowColor.z, None, _ShadowColor.x) #line 65
+    t2 = float4(t1.y, t1.x) #66
+    t3 = float4(t0.y, t0.z) * float4(_ShadowColor.y, _ShadowColor.z) + (-float4(t2.x, t2.y)); #67
+    tb30 = t2.y >= t1.y;
+    t30 = 1 if tb30 else 0;
+    t2 = float4(t2.x, t2.y, -1.0, 0.666666687); #70-71
+    t3 = float4(t3.x, t3.y, 1.0, -1); #72-73
+    t2 = (t30) * t3 + t2;
+    tb30 = t1.w >= t2.x;
+    t30 = 1 if tb30 else float(0.0);
+    t1 = float4(t2.x, t2.y, t2.w, t1.w) #77
+    t2 = float4(t1.w, t1.y, t2.z, t1.x) #78
+    t2 = (-t1) + t2;
+    t1 = (t30) * t2 + t1;
+    t30 = min(t1.y, t1.w);
+    t30 = (-t30) + t1.x;
+    t2.x = t30 * 6.0 + 1.00000001e-10;
+    t11 = (-t1.y) + t1.w;
+    t11 = t11 / t2.x;
+    t11 = t11 + t1.z;
+    t1.x = t1.x + 1.00000001e-10;
+    t30 = t30 / t1.x;
+    t30 = t30 * 0.5;
+    #the w component of t1 is no longer used, so ignore it
+    t1 = abs((t11)) + float4(0.0, -0.333333343, 0.333333343, 1); #90
+    t1 = t1.frac(); #91
+    t1 = -t1 * 2 + 1; #92
+    t1 = t1.abs() * 3 + (-1) #93
+    t1 = t1.clamp() #94
+    t1 = t1 + (-1); #95
+    t1 = (t30) * t1 + 1; #96
+    return float4(t1.x, t1.y, t1.z, 1) #97
+
+
+def clothes_dark_color(color: dict, shadow_color: dict) -> dict[str, float]:
+    '''Takes a 1.0 max rgba dict and returns a 1.0 max rgba dict.
+    clothes is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/MainItemPlus.shader
+    This was stripped down to just the shadow portion, and to remove all constants'''
+    diffuse = float4(color['r'],color['g'],color['b'],1) #maintex color
+    _ShadowColor = float4(shadow_color['r'],shadow_color['g'],shadow_color['b'],1) #the shadow color from material editor
+
+    #start at line 344 because the other one is for outlines
+    shadingAdjustment = ShadeAdjustItem(diffuse, _ShadowColor)
+
+    #skip to line 352
+    diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
+    diffuseShaded = -diffuseShaded * 2 + 1;
+
+    compTest = 0.555555582 < shadingAdjustment;
+    shadingAdjustment *= 1.79999995;
+    diffuseShaded = -diffuseShaded * 0.7225 + 1; #invertfinalambient shadow is a constant 0.7225, so don't calc it
+
+    hlslcc_movcTemp = shadingAdjustment;
+    hlslcc_movcTemp.x = diffuseShaded.x if (compTest.x) else shadingAdjustment.x; #370
+    hlslcc_movcTemp.y = diffuseShaded.y if (compTest.y) else shadingAdjustment.y; #371
+    hlslcc_movcTemp.z = diffuseShaded.z if (compTest.z) else shadingAdjustment.z; #372
+    shadingAdjustment = (hlslcc_movcTemp).saturate(); #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
+
+    diffuseShadow = diffuse * shadingAdjustment;
+
+    # lightCol is constant [1.0656, 1.0656, 1.0656, 1] calculated from the custom ambient of [0.666, 0.666, 0.666, 1] and sun light color [0.666, 0.666, 0.666, 1],
+    # so ambientCol always results in lightCol after the max function
+    ambientCol = float4(1.0656, 1.0656, 1.0656, 1);
+    diffuseShadow = diffuseShadow * ambientCol;
+
+    return {'r':diffuseShadow.x, 'g':diffuseShadow.y, 'b':diffuseShadow.z, 'a':1}
+
+
+def saturate_color(color: dict, lut_pixels: numpy.ndarray) -> list[float]:
+    '''The scalar version of colorscience.saturate_colors. Accepts a 0-1 float rgba color dict and returns a 0-1 float rgba list'''
+    width, height = 1,1
+    image_pixels = numpy.array([color['r'], color['g'], color['b'], 1],dtype=colorscience.np_number_precision).reshape(height, width, 4)
+
+    # Find the XY coordinates of the LUT image needed to saturate each pixel
+    coord = image_pixels[:, :, :3] * colorscience.coord_scale + colorscience.coord_offset
+    coord_frac, coord_floor = numpy.modf(coord)
+    coord_bot = coord[:, :, :2] + numpy.tile(coord_floor[:, :, 2].reshape(height, width, 1), (1, 1, 2)) * colorscience.texel_height_X0
+    coord_top = numpy.clip(coord_bot + colorscience.texel_height_X0, 0, 1)
+
+    lutcol_bot = colorscience.bilinear_interpolation(lut_pixels, coord_bot)
+    lutcol_top = colorscience.bilinear_interpolation(lut_pixels, coord_top)
+    lutcol_bot = colorscience.srgb_to_linear(lutcol_bot)
+    lutcol_top = colorscience.srgb_to_linear(lutcol_top)
+    lut_colors = lutcol_bot * (1 - coord_frac[:, :, 2].reshape(height, width, 1)) + lutcol_top * coord_frac[:, :, 2].reshape(height, width, 1)
+    image_pixels[:, :, :3] = lut_colors[:,:,:3]
+
+    return image_pixels.flatten().tolist()[0:4]
+
+
+def create_dark_pixels(image_array: numpy.ndarray, shadow_color: dict) -> numpy.ndarray:
+    '''The original dark maintex kernel. colorscience.darken_pixels has to give bit identical results'''
+    np_number_precision = colorscience.np_number_precision
+    diffuse = image_array #maintex color
+    _ShadowColor = numpy.asarray([shadow_color['r'],shadow_color['g'],shadow_color['b'], 1],dtype=np_number_precision) #the shadow color from material editor
+
+    x=0;y=1;z=2;w=3;
+    t0 = diffuse
+    t1 = t0[:, [y, z, z, x]] * _ShadowColor[[y,z,z,x]]
+    t2 = t1[:, [y,x]]
+    t3 = t0[:, [y,z]] * _ShadowColor[[y,z]] + (-t2)
+    tb30 = t2[:, [y]] >= t1[:, [y]]
+    t30 = tb30.astype(int)
+    t2 = numpy.hstack((t2[:, [x,y]], numpy.full((t2.shape[0], 1), -1, t2.dtype), numpy.full((t2.shape[0], 1), 0.666666687, t2.dtype)))
+    t3 = numpy.hstack((t3[:, [x,y]], numpy.full((t3.shape[0], 1),  1, t3.dtype), numpy.full((t3.shape[0], 1), -1,          t3.dtype)))
+    t2 = t30 * t3 + t2
+    tb30 = t1[:, [w]] >= t1[:, [x]]
+    t30 = tb30.astype(int)
+    t1 = numpy.hstack((t2[:, [x, y, w]], t1[:, [w]]))
+    t2 = numpy.hstack((t1[:, [w, y]], t2[:, [z]], t1[:, [x]]))
+    t2 = -t1 + t2
+    t1 = t30 * t2 + t1
+    t30 = numpy.minimum(t1[:, [y]], t1[:, [w]])
+    t30 = -t30 + t1[:, [x]]
+    t2[:, [x]] = t30 * 6 + 1.00000001e-10
+    t11 = -t1[:, [y]] + t1[:, [w]]
+    t11 = t11 / t2[:, [x]];
+    t11 = t11 + t1[:, [z]];
+    t1[:, [x]] = t1[:, [x]] + 1.00000001e-10;
+    t30 = t30 / t1[:, [x]];
+    t30 = t30 * 0.5;
+    t1 = numpy.absolute(t11) + numpy.asarray([0.0, -0.333333343, 0.333333343, 1]); #90
+    t1 = t1 - numpy.floor(t1)
+    t1 = -t1 * 2 + 1
+    t1 = numpy.absolute(t1) * 3 + (-1)
+    t1 = numpy.clip(t1, 0, 1)
+    t1 = t1 + (-1); #95
+    t1 = (t30) * t1 + 1; #96
+
+    shadingAdjustment = t1
+
+    diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
+    diffuseShaded = -diffuseShaded * 2 + 1;
+
+    compTest = 0.555555582 < shadingAdjustment;
+    shadingAdjustment *= 1.79999995;
+    diffuseShaded = -diffuseShaded * 0.7225 + 1;
+
+    hlslcc_movcTemp = shadingAdjustment;
+    hlslcc_movcTemp[:, [x]] = numpy.select(condlist=[compTest[:, [x]], numpy.invert(compTest[:, [x]])], choicelist=[diffuseShaded[:, [x]], shadingAdjustment[:, [x]]])
+    hlslcc_movcTemp[:, [y]] = numpy.select(condlist=[compTest[:, [y]], numpy.invert(compTest[:, [y]])], choicelist=[diffuseShaded[:, [y]], shadingAdjustment[:, [y]]])
+    hlslcc_movcTemp[:, [z]] = numpy.select(condlist=[compTest[:, [z]], numpy.invert(compTest[:, [z]])], choicelist=[diffuseShaded[:, [z]], shadingAdjustment[:, [z]]])
+    shadingAdjustment = numpy.clip(hlslcc_movcTemp, 0, 1)
+
+    diffuseShadow = diffuse * shadingAdjustment;
+    ambientCol = numpy.asarray([1.0656, 1.0656, 1.0656, 1],dtype=np_number_precision);
+    diffuseShadow = diffuseShadow * ambientCol;
+    return diffuseShadow
+
+
+# %% Inputs
+
+def load_lut() -> numpy.ndarray:
+    '''Reads the day LUT the same way Blender would give it to the importer'''
+    return pngio.read_png(LUT_PATH)
+
+
+def noise_image(width: int, height: int, seed: int = 0) -> numpy.ndarray:
+    '''Returns a (height, width, 4) float32 array of random 8 bit colors'''
+    random = numpy.random.default_rng(seed)
+    pixels = random.integers(0, 256, (height, width, 4), dtype=numpy.uint8).astype(colorscience.np_number_precision)
+    pixels /= 255
+    return pixels
+
+
+def palette_image(width: int, height: int, colors: int = 64, seed: int = 0) -> numpy.ndarray:
+    '''Returns a (height, width, 4) float32 array that only uses a few 8 bit colors, like a color mask'''
+    random = numpy.random.default_rng(seed)
+    palette = random.integers(0, 256, (colors, 4), dtype=numpy.uint8).astype(colorscience.np_number_precision) / 255
+    return palette[random.integers(0, colors, (height, width))]
+
+
+def quantize(pixels: numpy.ndarray) -> numpy.ndarray:
+    '''Rounds 0-1 floats to the 8 bit values they are saved as'''
+    return (numpy.clip(pixels, 0, 1) * 255 + 0.5).astype(numpy.uint8)
+
+
+# %% Benchmarks
+
+def in_batches(function, batch_rows: int):
+    '''Runs function on every batch of rows of an image, like the importer does'''
+    def run(image: numpy.ndarray):
+        for start_row in range(0, image.shape[0], batch_rows):
+            function(image[start_row:start_row + batch_rows])
+    return run
+
+
+def make_engines(lut_pixels: numpy.ndarray, lut_cube: numpy.ndarray, lut_table: numpy.ndarray = None, batch_rows: int = BATCH_ROWS) -> dict:
+    '''Returns engine name: (function that works on a whole image in batches, function that makes a fitting image).
+    The table engine is only included if lut_table is given'''
+    engines = {
+        'strip': (in_batches(lambda rows: colorscience.saturate_pixels_strip(lut_pixels, rows), batch_rows), noise_image),
+        'cube': (in_batches(lambda rows: colorscience.apply_lut_cube(lut_cube, rows), batch_rows), noise_image),
+        'palette': (in_batches(lambda rows: colorscience.saturate_palette(rows, lut_pixels, lut_cube), batch_rows), palette_image),
+        'dark': (in_batches(lambda rows: colorscience.darken_pixels(rows, SHADOW_COLORS[0]), batch_rows), noise_image),
+    }
+    if lut_table is not None:
+        engines['table'] = (in_batches(lambda rows: colorscience.apply_lut_table(lut_table, rows), batch_rows), noise_image)
+    return engines
+
+
+def peak_memory(function, image: numpy.ndarray) -> int:
+    '''Returns the peak bytes numpy allocated while function worked on a copy of image. The copy isn't counted'''
+    pixels = image.copy()
+    tracemalloc.start()
+    function(pixels)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def measure(function, image: numpy.ndarray, repeat: int) -> tuple[float, int]:
+    '''Returns the median seconds of function(image copy) and the peak bytes numpy allocated during one more run'''
+    times = []
+    for _ in range(repeat):
+        pixels = image.copy()
+        start = time.perf_counter()
+        function(pixels)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), peak_memory(function, image)
+
+
+def run_benchmarks(lut_pixels: numpy.ndarray, arguments: argparse.Namespace) -> list[dict]:
+    lut_cube = colorscience.build_lut_cube(lut_pixels)
+    lut_table = colorscience.build_lut_table(lut_pixels) if arguments.table else None
+    engines = make_engines(lut_pixels, lut_cube, lut_table, arguments.batch_rows)
+
+    results = []
+    print('{:<10} {:>6} {:>10} {:>12} {:>14}'.format('engine', 'size', 'MPix/s', 'peak MB', 'peak B/pixel'))
+    for size in arguments.sizes:
+        for engine, (function, make_image) in engines.items():
+            image = make_image(size, size)
+            seconds, peak = measure(function, image, arguments.repeat)
+            del image
+            megapixels = size * size / 1e6
+            results.append({'engine': engine, 'size': size, 'seconds': seconds, 'mpix_per_second': megapixels / seconds, 'peak_mb': peak / 2**20})
+            print('{:<10} {:>6} {:>10.1f} {:>12.1f} {:>14.1f}'.format(engine, size, megapixels / seconds, peak / 2**20, peak / (size * size)))
+    return results
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='colorscience_benchmark.py', description='Benchmarks the KKBP saturation and dark texture code')
+    parser.add_argument('--table', action='store_true', help='also benchmark the 24 bit LUT table. Building it takes a while')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES[:-1], help='width and height of the synthetic images')
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help='rows saturated at once, like the batch_rows preference')
+    parser.add_argument('--repeat', type=int, default=3, help='the median time of all runs is reported')
+    parser.add_argument('--output', help='file to save the benchmark results to')
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    lut_pixels = load_lut()
+    results = run_benchmarks(lut_pixels, arguments)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({'numpy': numpy.__version__, 'batch_rows': arguments.batch_rows, 'results': results}, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+'''
+Headless benchmark for the KKBP plugin. Run it with Blender, for example:
+
+    blender --background --factory-startup --python benchmarks/kkbp_benchmark.py -- --textures 16 --size 2048 --output results.json
+    blender --background --factory-startup --python benchmarks/kkbp_benchmark.py -- --baseline results.json
+
+The plugin folder is copied to a temporary folder and enabled as the "kkbp" add-on, so the benchmark doesn't need the plugin to be installed.
+The timings and memory come from the plugin's own tracer, which saves a memory summary json to the traces folder of the export folder.
+Trace saving is turned on in the preferences of the copied add-on.
+
+Synthetic mode (the default) writes a fake export folder with a KK_MaterialDataComplete.json and _MT textures,
+and builds a stand-in character in Blender: an armature, a body and an outfit with one quad for every synthetic material.
+It then runs the material import stages on it the way kkbp.modifymaterial does: reading the json files, replacing the outfit materials
+with the KK General template, load_images, linking the textures, create_dark_textures and the json colors.
+The steps before that (importing the .pmx file and fixing the armature) need the full Koikatsu armature and the mmd_tools add-on,
+so they are only timed in full mode. With --bake the synthetic materials are baked with kkbp.bakematerials, and with --atlas the material atlas is made too,
+so the bake and atlas stages get a baseline without a real export folder.
+
+Full mode (--export) imports a real export folder with kkbp.kkbpimport, then optionally bakes (--bake) and makes the material atlas (--atlas).
+The mmd_tools add-on has to be installed for the Blender version that runs the benchmark. Baking uses EEVEE, which needs a working OpenGL context.
+
+Comparing against a baseline flags every stage that got slower or used more memory than the threshold allows, and exits with code 1 if any did.
+'''
+
+import bpy, addon_utils, sys, os, json, time, glob, shutil, inspect, tempfile, argparse, platform, statistics
+import numpy
+
+ADDON_NAME = 'kkbp'
+CHARACTER_NAME = 'Benchmark'
+#stages faster than this are too noisy to be compared against the baseline
+MIN_COMPARED_SECONDS = 0.05
+
+
+def parse_arguments() -> argparse.Namespace:
+    arguments = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(prog='kkbp_benchmark.py', description='Times the KKBP import and records its peak memory')
+    parser.add_argument('--textures', type=int, default=16, help='number of synthetic _MT textures')
+    parser.add_argument('--size', type=int, default=1024, help='width and height of the synthetic textures')
+    parser.add_argument('--colors', type=int, default=64, help='number of colors in each synthetic texture. 0 fills the textures with noise')
+    parser.add_argument('--materials', type=int, default=200, help='number of materials in the synthetic KK_MaterialDataComplete.json')
+    parser.add_argument('--runs', type=int, default=3, help='the median time of all runs is reported')
+    parser.add_argument('--numpy-memory', action='store_true', help='also record the numpy high-water mark of the texture stages. This slows them down')
+    parser.add_argument('--texture-cache', action='store_true', help='leave the texture cache on. It is turned off by default so every run converts the textures')
+    parser.add_argument('--export', help='a real export folder to import instead of the synthetic one')
+    parser.add_argument('--bake', action='store_true', help='also bake the materials after the import')
+    parser.add_argument('--atlas', action='store_true', help='also create the material atlas while baking. Needs --bake')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed slowdown or memory increase compared to the baseline, 0.15 is 15%%')
+    parser.add_argument('--keep-fixture', action='store_true', help='don\'t delete the synthetic export folder')
+    return parser.parse_args(arguments)
+
+
+def enable_addon(work_dir: str, arguments: argparse.Namespace):
+    '''Copies the plugin to work_dir/kkbp and enables it'''
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    shutil.copytree(plugin_dir, os.path.join(work_dir, ADDON_NAME), ignore=shutil.ignore_patterns('.git', 'wiki', 'benchmarks', '__pycache__'))
+    sys.path.insert(0, work_dir)
+    if not addon_utils.enable(ADDON_NAME, default_set=True):
+        raise RuntimeError('The plugin could not be enabled')
+    #the timings are read from the traces, which aren't saved by default
+    bpy.context.preferences.addons[ADDON_NAME].preferences.save_traces = True
+    bpy.context.preferences.addons[ADDON_NAME].preferences.trace_numpy_memory = arguments.numpy_memory
+
+
+def create_fixture(export_dir: str, arguments: argparse.Namespace):
+    '''Writes a synthetic export folder with a material json and _MT textures'''
+    from kkbp.importing import pngio
+    random = numpy.random.default_rng(0)
+    outfit_dir = os.path.join(export_dir, 'Outfit 00')
+    for folder in (outfit_dir, os.path.join(export_dir, 'saturated_files'), os.path.join(export_dir, 'dark_files')):
+        os.makedirs(folder, exist_ok=True)
+
+    materials = []
+    for index in range(arguments.materials):
+        prop_names = ['_Color ', '_Color2 ', '_Color3 ', '_Color1_2 ', '_Color2_2 ', '_Color3_2 ', '_ShadowColor ']
+        colors = [dict(zip('rgba', (float(value) for value in random.random(4)))) for name in prop_names]
+        materials.append({
+            'SMRName': 'o_synthetic_{:04}'.format(index // 4),
+            'MaterialInformation': [{'MaterialName': 'synthetic_{:04}'.format(index), 'ShaderName': 'Shader Forge/main_item', 'ShaderPropNames': prop_names, 'ShaderPropColorValues': colors}],
+            })
+    with open(os.path.join(export_dir, 'KK_MaterialDataComplete.json'), 'w') as json_file:
+        json.dump(materials, json_file)
+
+    size = arguments.size
+    for index in range(arguments.textures):
+        if arguments.colors:
+            #exported textures are mostly flat areas of a few colors
+            palette = random.random((arguments.colors, 4), dtype=numpy.float32)
+            palette[:, 3] = 1
+            blocks = random.integers(0, arguments.colors, (size // 16 + 1, size // 16 + 1))
+            pixels = palette[blocks.repeat(16, 0).repeat(16, 1)[:size, :size]]
+        else:
+            pixels = random.random((size, size, 4), dtype=numpy.float32)
+        pngio.write_png(os.path.join(outfit_dir if index % 2 else export_dir, 'synthetic_{:04}_MT_CT.png'.format(index)), pixels)
+
+
+class MaterialStages:
+    '''Lets the modify_material stages run without the operator. Attributes are read from the modify_material class'''
+    def __getattr__(self, name):
+        from kkbp.importing.modifymaterial import modify_material
+        value = getattr(modify_material, name)
+        if inspect.isfunction(value) and not isinstance(inspect.getattr_static(modify_material, name), staticmethod):
+            return value.__get__(self)
+        return value
+
+
+def reset_scene(export_dir: str):
+    '''Starts from an empty file and removes everything the last run made so the next run does the same work'''
+    bpy.ops.wm.read_homefile(use_empty=True)
+    from kkbp import common as c
+    bpy.context.scene.kkbp.import_dir = os.path.join(export_dir, '')
+    c.json_file_manager.clear_cache()
+    for folder in ('saturated_files', 'dark_files', 'baked_files', 'atlas_files'):
+        for file in glob.glob(os.path.join(export_dir, folder, '*')):
+            os.remove(file)
+
+
+def create_character(arguments: argparse.Namespace):
+    '''Builds a stand-in for an imported character: an armature with a body and an outfit in the character collection.
+    The outfit has one quad with its own UV square for every synthetic material that has a texture, so every material can be baked'''
+    scene = bpy.context.scene
+    scene.kkbp.character_name = CHARACTER_NAME
+    collection = bpy.data.collections.new(CHARACTER_NAME)
+    scene.collection.children.link(collection)
+    bpy.context.view_layer.active_layer_collection = bpy.context.view_layer.layer_collection.children[CHARACTER_NAME]
+
+    armature = bpy.data.objects.new('Armature ' + CHARACTER_NAME, bpy.data.armatures.new('Armature ' + CHARACTER_NAME))
+    body = bpy.data.objects.new('Body ' + CHARACTER_NAME, bpy.data.meshes.new('Body ' + CHARACTER_NAME))
+    body.data.from_pydata([(-1, -1, 0), (0, -1, 0), (0, 0, 0), (-1, 0, 0)], [], [(0, 1, 2, 3)])
+    body.data.uv_layers.new(name='uv_main')
+
+    count = min(arguments.textures, arguments.materials)
+    vertices = [(index * 1.1 + x, y, 0) for index in range(count) for x, y in ((0, 0), (1, 0), (1, 1), (0, 1))]
+    mesh = bpy.data.meshes.new('Outfit 00 ' + CHARACTER_NAME)
+    mesh.from_pydata(vertices, [], [tuple(range(index * 4, index * 4 + 4)) for index in range(count)])
+    uv_main = mesh.uv_layers.new(name='uv_main')
+    for loop in mesh.loops:
+        uv_main.data[loop.index].uv = ((0, 0), (1, 0), (1, 1), (0, 1))[loop.vertex_index % 4]
+    for index in range(count):
+        #the material names match the synthetic json, so the textures and colors are found by id like in a real import
+        mesh.materials.append(bpy.data.materials.new('synthetic_{:04}'.format(index)))
+        mesh.polygons[index].material_index = index
+    outfit = bpy.data.objects.new('Outfit 00 ' + CHARACTER_NAME, mesh)
+
+    for obj, role in ((armature, 'armature'), (body, 'body'), (outfit, 'outfit')):
+        collection.objects.link(obj)
+        obj[role] = True
+        obj['name'] = CHARACTER_NAME
+        if obj is not armature:
+            obj.parent = armature
+    outfit['id'] = '00'
+
+
+def run_synthetic(export_dir: str, arguments: argparse.Namespace):
+    '''Runs the material import stages on a stand-in character in the synthetic export folder, then bakes it if that was requested'''
+    from kkbp import common as c
+    from kkbp.importing.modifymaterial import modify_material
+    reset_scene(export_dir)
+    modify_material.use_texture_cache = arguments.texture_cache
+    create_character(arguments)
+
+    with c.tracer.span('benchmark'):
+        c.reset_timer()
+        c.json_file_manager.init()
+        c.print_timer('json_cold')
+        c.json_file_manager.init()
+        c.print_timer('json_cached')
+
+        #the outfit templates have to exist before load_images, because it makes the dark maintexes of the materials that use them
+        c.import_from_library_file('Material', ['KK General', 'KK Eyeline kage', 'KK Simple'], use_fake_user=True)
+        kage = bpy.data.materials['KK Eyeline kage'].copy()
+        kage.name = 'KK Eyeline kage ' + CHARACTER_NAME
+        c.print_timer('import_templates')
+
+        stages = MaterialStages()
+        try:
+            stages.replace_materials_for_outfits()
+            stages.load_images()
+            stages.link_textures_for_clothes()
+            stages.create_dark_textures()
+            stages.load_json_colors()
+        finally:
+            #the process pool of the process backend is shared by load_images and create_dark_textures, like in the operator
+            stages.close_process_pool()
+
+    if arguments.bake:
+        bake(arguments)
+
+
+def bake(arguments: argparse.Namespace):
+    '''Bakes the materials of the character, and makes the material atlas if --atlas was given.
+    The operators report their errors instead of raising them, so a cancelled bake stops the benchmark here'''
+    bpy.context.scene.kkbp.use_atlas = arguments.atlas
+    if bpy.ops.kkbp.bakematerials() != {'FINISHED'}:
+        raise RuntimeError('Baking the materials failed, see the KKBP Log')
+
+
+def run_full(export_dir: str, arguments: argparse.Namespace):
+    '''Imports a real export folder, then bakes and atlases it if those were requested'''
+    from kkbp.importing.modifymaterial import modify_material
+    reset_scene(export_dir)
+    modify_material.use_texture_cache = arguments.texture_cache
+    bpy.ops.kkbp.kkbpimport(filepath=os.path.join(export_dir, 'model.pmx'))
+    if arguments.bake:
+        bake(arguments)
+
+
+def read_memory_summaries(export_dir: str, since: float) -> list[dict]:
+    '''Returns the memory summaries the tracer saved after since'''
+    summaries = []
+    for path in sorted(glob.glob(os.path.join(export_dir, 'traces', '* memory.json')), key=os.path.getmtime):
+        if os.path.getmtime(path) >= since:
+            with open(path) as summary_file:
+                summaries.append(json.load(summary_file))
+    return summaries
+
+
+def collect_run(summaries: list[dict]) -> dict[str, dict]:
+    '''Turns the memory summaries of a run into {stage path: {seconds, peak_rss_mb}}. Stages that ran more than once are added together'''
+    metrics = {}
+    for summary in summaries:
+        root = next((stage['name'] for stage in summary['stages'] if stage['depth'] == 0), 'trace')
+        for stage in summary['stages']:
+            key = root if stage['depth'] == 0 else '{}/{}'.format(root, stage['name'])
+            metric = metrics.setdefault(key, {'seconds': 0.0, 'peak_rss_mb': 0.0})
+            metric['seconds'] += stage['seconds']
+            metric['peak_rss_mb'] = max(metric['peak_rss_mb'], stage['peak_rss_mb'])
+        for numpy_peak in summary['numpy_high_water']:
+            key = '{}/{} numpy'.format(root, numpy_peak['name'])
+            metric = metrics.setdefault(key, {'numpy_peak_mb': 0.0})
+            metric['numpy_peak_mb'] = max(metric['numpy_peak_mb'], numpy_peak['peak_mb'])
+    return metrics
+
+
+def combine_runs(runs: list[dict[str, dict]]) -> dict[str, dict]:
+    '''Uses the median time and the highest memory of every stage across the runs'''
+    combined = {}
+    for key in dict.fromkeys(key for run in runs for key in run):
+        values = [run[key] for run in runs if key in run]
+        combined[key] = {name: (round(statistics.median(value[name] for value in values), 3) if name == 'seconds' else max(value[name] for value in values)) for name in values[0]}
+    return combined
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    '''Returns a line for every stage that is slower or uses more memory than the baseline allows'''
+    regressions = []
+    for key, metric in results['stages'].items():
+        if (base := baseline.get('stages', {}).get(key)) is None:
+            continue
+        for name, value in metric.items():
+            base_value = base.get(name)
+            if not base_value or (name == 'seconds' and base_value < MIN_COMPARED_SECONDS):
+                continue
+            if value > base_value * (1 + threshold):
+                regressions.append('{}: {} went from {} to {} (+{:.0%})'.format(key, name, base_value, value, value / base_value - 1))
+    return regressions
+
+
+def main():
+    arguments = parse_arguments()
+    work_dir = tempfile.mkdtemp(prefix='kkbp_benchmark_')
+    try:
+        enable_addon(work_dir, arguments)
+        if arguments.export:
+            export_dir = os.path.abspath(arguments.export)
+            if not hasattr(bpy.ops.mmd_tools, 'import_model'):
+                addon_utils.enable('mmd_tools', default_set=True)
+        else:
+            export_dir = os.path.join(work_dir, 'export')
+            create_fixture(export_dir, arguments)
+
+        runs = []
+        for run in range(arguments.runs):
+            since = time.time()
+            if arguments.export:
+                run_full(export_dir, arguments)
+            else:
+                run_synthetic(export_dir, arguments)
+            runs.append(collect_run(read_memory_summaries(export_dir, since)))
+            print('KKBP benchmark run {} / {} finished in {:.1f} seconds'.format(run + 1, arguments.runs, time.time() - since))
+
+        results = {
+            'blender': bpy.app.version_string,
+            'platform': platform.platform(),
+            'mode': 'full' if arguments.export else 'synthetic',
+            'fixture': {'textures': arguments.textures, 'size': arguments.size, 'colors': arguments.colors, 'materials': arguments.materials} if not arguments.export else {'export': export_dir},
+            'bake': arguments.bake,
+            'atlas': arguments.bake and arguments.atlas,
+            'runs': arguments.runs,
+            'stages': combine_runs(runs),
+            }
+        results['peak_rss_mb'] = max((metric.get('peak_rss_mb', 0) for metric in results['stages'].values()), default=0)
+        print(json.dumps(results, indent=1))
+        if arguments.output:
+            with open(arguments.output, 'w') as output_file:
+                json.dump(results, output_file, indent=1)
+
+        regressions = []
+        if arguments.baseline:
+            with open(arguments.baseline) as baseline_file:
+                regressions = compare(results, json.load(baseline_file), arguments.threshold)
+            for regression in regressions:
+                print('REGRESSION ' + regression)
+            if not regressions:
+                print('No regressions compared to {}'.format(arguments.baseline))
+    finally:
+        if not arguments.keep_fixture:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print('The synthetic export folder was kept at {}'.format(work_dir))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
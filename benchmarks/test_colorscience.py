@@ -0,0 +1,126 @@
+'''
+Golden tests for importing/colorscience.py. They don't need Blender, run them with any python that has numpy and pytest:
+
+    python -m pytest benchmarks
+
+The vectorized shader colors are compared against the scalar float4 code they replaced, the palette, LUT cube and LUT table engines against the LUT strip,
+and the dark texture kernel has to be bit identical to the original kernel once it is saved as float32.
+The reference implementations live in colorscience_benchmark.py, which is also the timing harness.
+If pytest-benchmark is installed, every engine is also timed on each image size and the speed in megapixels per second
+and the peak memory numpy allocated are added to the extra info of the results. The sizes from 4096 x 4096 up are marked slow
+and only run with -m slow, or with -m "" to run everything:
+
+    python -m pytest benchmarks -m "" --benchmark-json results.json
+'''
+
+import numpy, pytest
+
+from colorscience_benchmark import (colorscience, SHADOW_COLORS, SIZES, skin_dark_color, clothes_dark_color, saturate_color,
+    create_dark_pixels, load_lut, noise_image, palette_image, quantize, make_engines, peak_memory)
+
+
+@pytest.fixture(scope='module')
+def lut_pixels() -> numpy.ndarray:
+    return load_lut()
+
+
+@pytest.fixture(scope='module')
+def lut_cube(lut_pixels) -> numpy.ndarray:
+    return colorscience.build_lut_cube(lut_pixels)
+
+
+@pytest.fixture(scope='module')
+def lut_table(lut_pixels) -> numpy.ndarray:
+    '''Building the table takes a few seconds, so it's only built once for every test that needs it'''
+    return colorscience.build_lut_table(lut_pixels)
+
+
+@pytest.fixture(scope='module')
+def colors() -> numpy.ndarray:
+    '''Random colors and a few edge cases'''
+    colors = numpy.random.default_rng(1).random((2000, 4))
+    colors[:10, :3] = [[0, 0, 0], [1, 1, 1], [1, 0, 0], [0, 1, 0], [0, 0, 1], [0.5, 0.5, 0.5], [1, 1, 0], [0, 1, 1], [1, 0, 1], [0.2, 0.2, 0.21]]
+    return colors
+
+
+@pytest.fixture(scope='module')
+def image() -> numpy.ndarray:
+    return noise_image(256, 256, seed=2)
+
+
+@pytest.fixture(scope='module')
+def strip(image, lut_pixels) -> numpy.ndarray:
+    '''The noise image saturated with the LUT strip, which every other engine is compared against'''
+    strip = image.copy()
+    colorscience.saturate_pixels_strip(lut_pixels, strip)
+    return strip
+
+
+def as_dicts(colors: numpy.ndarray) -> list[dict]:
+    return [{'r': r, 'g': g, 'b': b} for r, g, b in colors[:, :3].tolist()]
+
+
+def test_skin_dark_colors(colors):
+    reference = numpy.array([[color[k] for k in 'rgb'] for color in map(skin_dark_color, as_dicts(colors))])
+    assert numpy.abs(colorscience.skin_dark_colors(colors) - reference).max() <= 1e-12
+
+
+@pytest.mark.parametrize('shadow_color', SHADOW_COLORS)
+def test_clothes_dark_colors(colors, shadow_color):
+    shadow_colors = numpy.tile([shadow_color['r'], shadow_color['g'], shadow_color['b']], (len(colors), 1))
+    reference = numpy.array([[color[k] for k in 'rgb'] for color in (clothes_dark_color(color, shadow_color) for color in as_dicts(colors))])
+    assert numpy.abs(colorscience.clothes_dark_colors(colors, shadow_colors) - reference).max() <= 1e-12
+
+
+def test_saturate_colors(colors, lut_pixels):
+    reference = numpy.array([saturate_color(color, lut_pixels) for color in as_dicts(colors)])
+    assert numpy.abs(colorscience.saturate_colors(colors, lut_pixels) - reference).max() <= 1e-6
+
+
+@pytest.mark.parametrize('shadow_color', SHADOW_COLORS)
+def test_darken_pixels_is_bit_identical(image, shadow_color):
+    pixels = image.reshape(-1, 4)
+    dark = pixels.copy()
+    colorscience.darken_pixels(dark, shadow_color)
+    reference = create_dark_pixels(pixels.copy(), shadow_color).astype(colorscience.np_number_precision)
+    assert numpy.array_equal(dark.view(numpy.uint32), reference.view(numpy.uint32))
+
+
+def test_saturate_palette(lut_pixels):
+    palette = palette_image(256, 256, seed=3)
+    palette_strip = palette.copy()
+    colorscience.saturate_pixels_strip(lut_pixels, palette_strip)
+    result = palette.copy()
+    assert colorscience.saturate_palette(result, lut_pixels), 'saturate_palette refused a 64 color image'
+    assert numpy.array_equal(result, palette_strip)
+
+
+def test_apply_lut_cube(image, strip, lut_cube):
+    cube = image.copy()
+    colorscience.apply_lut_cube(lut_cube, cube)
+    assert numpy.abs(cube - strip).max() <= colorscience.LUT_CUBE_TOLERANCE
+
+
+def test_apply_lut_table(image, strip, lut_table):
+    '''The table is exact once the result is saved as 8 bits'''
+    table = image.copy()
+    colorscience.apply_lut_table(lut_table, table)
+    assert numpy.array_equal(quantize(table), quantize(strip))
+
+
+# %% Timings
+
+@pytest.mark.parametrize('size', [pytest.param(size, marks=pytest.mark.slow) if size >= 4096 else size for size in SIZES])
+@pytest.mark.parametrize('engine', ['strip', 'cube', 'table', 'palette', 'dark'])
+def test_benchmark(request, lut_pixels, lut_cube, engine, size):
+    pytest.importorskip('pytest_benchmark')
+    benchmark = request.getfixturevalue('benchmark')
+    lut_table = request.getfixturevalue('lut_table') if engine == 'table' else None
+    function, make_image = make_engines(lut_pixels, lut_cube, lut_table)[engine]
+    image = make_image(size, size)
+    #every round works on a fresh copy, because the engines work in place
+    benchmark.pedantic(function, setup=lambda: ((image.copy(),), {}), rounds=5 if size < 4096 else 2)
+    benchmark.extra_info['megapixels'] = size * size / 1e6
+    benchmark.extra_info['mpix_per_second'] = size * size / 1e6 / benchmark.stats.stats.median
+    #measured in a separate run, so tracemalloc doesn't slow down the timed rounds
+    benchmark.extra_info['peak_mb'] = peak_memory(function, image) / 2**20
@@ -1,20 +1,38 @@
-import bpy, json, datetime, traceback
+import bpy, os, sys, json, time, pickle, hashlib, datetime, traceback, threading, functools, contextlib, tracemalloc, logging, logging.handlers
+from bpy.app.handlers import persistent
 from pathlib import Path
 
 
 class JsonFileManager:
     '''
     Manages json files to avoid loading files repeatedly. The instance is declared at the bottom of the file
+    The parsed (and indexed) json files are also pickled into the kkbp_json_cache folder inside of the Blender user data folder.
+    They aren't kept in the import directory, because export folders are shared and loading a pickle someone else made can run code.
+    Each pickle stores the size, modification time and hash of its json file, so it is ignored once the exporter rewrites that file
     '''
 
+    # bump this if the pickled structures change
+    cache_version = 1
+
     def __init__(self):
         self.json_files = {}
         self.smr_materials_data = {}
         self.materials_data = {}
+        self.material_colors = {}  # material name: list of (shader property name, color) in file order
+        self.shadow_colors = {}  # material name: shadow color
+        self.shader_names = {}  # material name: shader name
+        self.color_index = {}  # (material name, property): color or None, filled the first time a property is asked for
+        self.texture_data = None  # texture name: offset and scale from KK_TextureData.json, built the first time a texture is asked for
 
     def clear(self):
         self.json_files.clear()
         self.smr_materials_data.clear()
+        self.materials_data.clear()
+        self.material_colors.clear()
+        self.shadow_colors.clear()
+        self.shader_names.clear()
+        self.color_index.clear()
+        self.texture_data = None
 
     def init(self):
         '''
@@ -25,19 +43,99 @@ class JsonFileManager:
         for file in Path(bpy.context.scene.kkbp.import_dir).glob('*.json'):
             self.json_files[file.name] = str(file)
 
-        raw_data = self.get_json_file('KK_MaterialDataComplete.json')
+        if path := self.json_files.get('KK_MaterialDataComplete.json'):
+            self.json_files['KK_MaterialDataComplete.json'], self.smr_materials_data, self.materials_data, self.material_colors, self.shadow_colors, self.shader_names = self.load_cached(path, self.index_material_data)
 
+    def index_material_data(self, raw_data: list) -> tuple:
+        '''Sorts the material information in MaterialDataComplete.json by SMR and by material, and indexes the colors of every material'''
+        smr_materials_data = {}
+        materials_data = {}
+        material_colors = {}
+        shadow_colors = {}
+        shader_names = {}
         for item in raw_data:
             if material_infos := item['MaterialInformation']:
-                if (smr_data := self.smr_materials_data.get(item['SMRName'])) is None:
+                if (smr_data := smr_materials_data.get(item['SMRName'])) is None:
                     smr_data = []
-                    self.smr_materials_data[item['SMRName']] = smr_data
+                    smr_materials_data[item['SMRName']] = smr_data
                 smr_data.append(item)
                 for material_info in material_infos:
-                    if (materials := self.materials_data.get(material_info['MaterialName'])) is None:
+                    if (materials := materials_data.get(material_info['MaterialName'])) is None:
                         materials = []
-                        self.materials_data[material_info['MaterialName']] = materials
+                        materials_data[material_info['MaterialName']] = materials
+                        material_colors[material_info['MaterialName']] = []
+                        shader_names[material_info['MaterialName']] = material_info.get('ShaderName')
                     materials.append(material_info)
+                    material_colors[material_info['MaterialName']].extend(zip(material_info['ShaderPropNames'], material_info['ShaderPropColorValues']))
+
+        #key names are not consistent, so the shadow color is any property with shadowcolor in its name
+        for material_name, colors in material_colors.items():
+            for prop_name, prop_color in colors:
+                if '_shadowcolor' in prop_name.lower():
+                    shadow_colors[material_name] = prop_color
+                    break
+        return raw_data, smr_materials_data, materials_data, material_colors, shadow_colors, shader_names
+
+    def load_cached(self, path: str, build = None):
+        '''
+        Parses the json file at path and returns build(json data), or the json data if build is None.
+        The result is pickled into the json cache folder, and the pickle is used instead while the file is unchanged
+        '''
+        cache_path = self.get_cache_path(path)
+        stat = os.stat(path)
+        file_hash = None
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                cached = pickle.load(cache_file)
+            if cached['version'] == self.cache_version and cached['size'] == stat.st_size:
+                if cached['mtime'] == stat.st_mtime_ns:
+                    return cached['data']
+                #the file was touched, so only trust the pickle if the contents are the same
+                if cached['hash'] == (file_hash := self.hash_file(path)):
+                    return cached['data']
+        except Exception:
+            #missing, old or unreadable pickle
+            pass
+
+        with open(path, 'rb') as json_file:
+            contents = json_file.read()
+        data = json.loads(contents)
+        data = build(data) if build else data
+        cached = {
+            'version': self.cache_version,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': file_hash or hashlib.blake2b(contents).hexdigest(),
+            'data': data,
+            }
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + '.tmp', 'wb') as cache_file:
+                pickle.dump(cached, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            #the cache folder might not be writable. The cache is only a speedup, so ignore it
+            pass
+        return data
+
+    @staticmethod
+    def get_cache_path(path: str) -> str:
+        '''Returns the path of the pickle for the json file at path. It's named after a hash of the full path of the json file'''
+        name = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=16).hexdigest()
+        return os.path.join(bpy.utils.user_resource('DATAFILES', path='kkbp_json_cache'), name + '.pickle')
+
+    def clear_cache(self):
+        '''Deletes the pickles of every json file in the import directory'''
+        for file in Path(bpy.context.scene.kkbp.import_dir).glob('*.json'):
+            try:
+                os.remove(self.get_cache_path(str(file)))
+            except OSError:
+                pass
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        with open(path, 'rb') as file:
+            return hashlib.blake2b(file.read()).hexdigest()
 
     def get_json_file(self, filename: str) -> json:
         '''
@@ -45,7 +143,7 @@ class JsonFileManager:
         '''
         if json_data := self.json_files.get(filename):  # Returns None if the file is not found (will likely cause an error)
             if isinstance(json_data, str):
-                json_data = self.json_files[filename] = json.load(open(json_data))
+                json_data = self.json_files[filename] = self.load_cached(json_data)
             return json_data
 
     def get_material_info_by_smr(self, smr_name: str) -> list[dict]:
@@ -54,15 +152,18 @@ class JsonFileManager:
     def get_materials_info(self) -> dict[str, list[dict]]:
         return self.smr_materials_data
 
+    def find_color(self, material_id: str, color: str) -> dict[str, float]:
+        '''Returns the first color of the material with the id material_id whose property name contains color, or None.
+        This is a substring match, so "_Color " will not match "_Color2 ". Each answer is only searched for once'''
+        if (key := (material_id, color)) not in self.color_index:
+            self.color_index[key] = next((prop_color for prop_name, prop_color in self.material_colors.get(material_id, ()) if color in prop_name), None)
+        return self.color_index[key]
+
     def get_color(self, material_name: str, color: str) -> dict[str: float]:
         '''Find the material material_name and return an RGBA dict list of the desired color ranging from 0-1'''
         if material_name := bpy.data.materials[material_name].get('id'):
-            material_colors = self.materials_data.get(material_name)
-            for material_color in material_colors:
-                color_dict = zip(material_color['ShaderPropNames'], material_color['ShaderPropColorValues'])
-                for pair in color_dict:
-                    if color in pair[0]:
-                        return pair[1]
+            if (material_color := self.find_color(material_name, color)) is not None:
+                return material_color
         kklog(f"Couldn't find {color} for {material_name}", 'warn')
         return {'r': 1, 'g': 1, 'b': 1, 'a': 1}
 
@@ -70,16 +171,185 @@ class JsonFileManager:
         '''Find the material material_name and return an RGBA float list ranging from 0-1'''
         # get original name
         if material_name := bpy.data.materials[material_name].get('id'):
-            material_colors = self.materials_data.get(material_name)
-            for material_color in material_colors:
-                color_dict = zip(material_color['ShaderPropNames'], material_color['ShaderPropColorValues'])
-                for pair in color_dict:
-                    if '_shadowcolor' in pair[0].lower():
-                        return pair[1]
+            if (shadow_color := self.shadow_colors.get(material_name)) is not None:
+                return shadow_color
         # return a default color if not found
         kklog(f'Couldn\'t find shadow color for {material_name}', 'warn')
         return {'r': 0.764, 'g': 0.880, 'b': 1}
 
+    def get_texture_data(self, texture_name: str) -> dict:
+        '''Returns the KK_TextureData.json entry with the offset and scale of this texture, or None'''
+        if self.texture_data is None:
+            self.texture_data = {}
+            for texture_data in self.get_json_file('KK_TextureData.json') or []:
+                #keep the first entry if a texture is listed more than once
+                self.texture_data.setdefault(texture_data['textureName'], texture_data)
+        return self.texture_data.get(texture_name)
+
+    def get_shader_name(self, material_name: str) -> str:
+        '''Returns the shader name of the material with the id material_name, or None'''
+        return self.shader_names.get(material_name)
+
+
+
+class ObjectRegistry:
+    '''
+    Indexes the KKBP objects by role and character name, so the get_* functions below don't scan bpy.data.objects every time.
+    Only object names are stored, because python references to Blender objects become invalid after an undo.
+    The importer adds each object to the index right after it tags it, like MaterialRegistry.
+    The index is rebuilt on the next lookup after an undo or a file load, at the end of every import stage (print_timer)
+    and when the number of objects changes. Lookups also check that the objects they return still exist, still belong to the character
+    and are still tagged, and rebuild the index if they aren't, so renamed, deleted and untagged objects are noticed without a handler.
+    The instance is declared at the bottom of the file
+    '''
+
+    # role: the object type the role is limited to, or None for any type. 'empty' is every empty object of a character
+    roles = {
+        'body': None,
+        'armature': None,
+        'rig': None,
+        'tears': None,
+        'gag': None,
+        'tongue': None,
+        'hair': 'MESH',
+        'outfit': 'MESH',
+        'alt': 'MESH',
+        'hitbox': 'MESH',
+        }
+
+    def __init__(self):
+        self.index = None  # (role, character name): list of object names in bpy.data.objects order
+        self.object_count = 0
+
+    def invalidate(self):
+        self.index = None
+
+    def __roles__(self, o: bpy.types.Object) -> list[str]:
+        '''Returns every role the object is tagged with'''
+        roles = ['empty'] if o.type == 'EMPTY' else []
+        return roles + [role for role, object_type in self.roles.items() if o.get(role) and (object_type is None or o.type == object_type)]
+
+    def build(self):
+        self.index = {}
+        for o in bpy.data.objects:
+            if (character := o.get('name')) is None:
+                continue
+            for role in self.__roles__(o):
+                self.index.setdefault((role, character), []).append(o.name)
+        self.object_count = len(bpy.data.objects)
+
+    def add(self, o: bpy.types.Object):
+        '''Indexes an object that was just tagged with the character name and its roles, or moves it to the roles it's tagged with now'''
+        if self.index is None or self.object_count != len(bpy.data.objects):
+            #the next lookup rebuilds the index anyway
+            return
+        for names in self.index.values():
+            if o.name in names:
+                names.remove(o.name)
+        if (character := o.get('name')) is None:
+            return
+        for role in self.__roles__(o):
+            names = self.index.setdefault((role, character), [])
+            names.append(o.name)
+            names.sort(key=bpy.data.objects.find)
+
+    def get(self, role: str, character: str = None) -> list[bpy.types.Object]:
+        '''Returns every object with this role that belongs to character (the current character if not given)'''
+        character = bpy.context.scene.kkbp.character_name if character is None else character
+        if self.index is None or self.object_count != len(bpy.data.objects):
+            self.build()
+        objects = [bpy.data.objects.get(name) for name in self.index.get((role, character), ())]
+        if all(o and o.get('name') == character and (role == 'empty' or o.get(role)) for o in objects):
+            return objects
+        #something was renamed, deleted or untagged without the registry noticing
+        self.build()
+        return [bpy.data.objects.get(name) for name in self.index.get((role, character), ())]
+
+    def get_first(self, role: str, character: str = None) -> bpy.types.Object:
+        objects = self.get(role, character)
+        return objects[0] if objects else None
+
+
+class MaterialRegistry:
+    '''
+    Indexes the body, hair and outfit template materials by role, character name and the id of the original material.
+    The importer adds each template copy when it is created in the replace_materials_for_* functions,
+    so lookups don't get slower as the .blend collects materials from other characters.
+    Like ObjectRegistry only names are stored. The index is rebuilt with a single scan of bpy.data.materials
+    if it was invalidated by an undo or a file load, or if a material it returns was renamed, deleted or untagged.
+    The instance is declared at the bottom of the file
+    '''
+
+    roles = ('body', 'hair', 'outfit')
+
+    def __init__(self):
+        self.index = None  # (role, character name): {original material id: list of material names}
+
+    def invalidate(self):
+        self.index = None
+
+    def build(self):
+        self.index = {}
+        for m in bpy.data.materials:
+            if (character := m.get('name')) is None:
+                continue
+            for role in self.roles:
+                if m.get(role):
+                    self.index.setdefault((role, character), {}).setdefault(m.get('id'), []).append(m.name)
+
+    def add(self, material: bpy.types.Material, role: str):
+        '''Adds a template material that has already been tagged with the role, character name and id'''
+        if self.index is None:
+            self.build()
+            return
+        names = self.index.setdefault((role, material['name']), {}).setdefault(material.get('id'), [])
+        if material.name not in names:
+            names.append(material.name)
+
+    def __lookup__(self, role: str, character: str, material_id) -> list[bpy.types.Material]:
+        ids = self.index.get((role, character), {})
+        names = ids.get(material_id, ()) if material_id is not None else [name for names in ids.values() for name in names]
+        return [bpy.data.materials.get(name) for name in names]
+
+    def get(self, role: str, character: str = None, material_id: str = None) -> list[bpy.types.Material]:
+        '''Returns every material with this role that belongs to character (the current character if not given).
+        If material_id is given, only the materials made from the original material with that id are returned'''
+        character = bpy.context.scene.kkbp.character_name if character is None else character
+        if self.index is None:
+            self.build()
+        materials = self.__lookup__(role, character, material_id)
+        if all(m and m.get('name') == character and m.get(role) for m in materials):
+            return materials
+        #something was renamed, deleted or untagged without the registry noticing
+        self.build()
+        return self.__lookup__(role, character, material_id)
+
+
+@persistent
+def invalidate_registries(*args):
+    '''Handler for undo_post, redo_post and load_post. Other changes are caught by the checks in the registries themselves,
+    because objects and materials show up in the depsgraph every time a value is set on them'''
+    material_registry.invalidate()
+    object_registry.invalidate()
+
+
+registry_handlers = ('undo_post', 'redo_post', 'load_post')
+
+def register_registry_handlers():
+    for handler in registry_handlers:
+        if invalidate_registries not in getattr(bpy.app.handlers, handler):
+            getattr(bpy.app.handlers, handler).append(invalidate_registries)
+
+
+def unregister_registry_handlers():
+    for handler in registry_handlers:
+        if invalidate_registries in getattr(bpy.app.handlers, handler):
+            getattr(bpy.app.handlers, handler).remove(invalidate_registries)
+
+
+def unregister_log_timer():
+    if bpy.app.timers.is_registered(flush_log):
+        bpy.app.timers.unregister(flush_log)
 
 
 def toggle_console():
@@ -90,21 +360,104 @@ def toggle_console():
         return  # only available on windows so it might error out for other platforms
 
 
+class KKBPLogger:
+    '''
+    Buffers the log messages so the KKBP Log text is written once per batch instead of once per message.
+    Writing to a text block on every message gets slow when a loop logs thousands of lines.
+    Messages below the threshold set in the addon preferences are dropped before they are formatted or printed.
+    The buffer is written to the text at the end of every import stage (print_timer), on errors, when it gets large,
+    and from a timer once Blender is idle so messages from operators that don't have stages still show up.
+    If enabled in the preferences, messages are also written to a rotating log file as they come in.
+    The instance is declared at the bottom of the file
+    '''
+
+    levels = {'debug': 10, 'info': 20, 'warn': 30, 'error': 40}
+    prefixes = {'warn': 'Warning:        ', 'error': '\nError:          '}
+    max_buffered_lines = 2000
+    log_file_size = 5 * 1024 * 1024
+    log_file_count = 3
+
+    def __init__(self):
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.threshold = None
+        self.file_logger = logging.getLogger('kkbp')
+        self.file_logger.propagate = False
+        self.file_logger.setLevel(logging.DEBUG)
+        self.file_handler = None
+
+    def configure(self):
+        '''Reads the log level and log file settings from the addon preferences'''
+        try:
+            preferences = bpy.context.preferences.addons[__package__].preferences
+            self.threshold = self.levels.get(preferences.log_level.lower(), self.levels['info'])
+            log_to_file = preferences.log_to_file
+        except (AttributeError, KeyError):
+            self.threshold = self.levels['info']
+            log_to_file = False
+        if log_to_file and not self.file_handler:
+            try:
+                log_path = os.path.join(bpy.utils.user_resource('DATAFILES', path='kkbp_logs', create=True), 'kkbp.log')
+                self.file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=self.log_file_size, backupCount=self.log_file_count, encoding='utf-8')
+                self.file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(message)s'))
+                self.file_logger.addHandler(self.file_handler)
+            except OSError:
+                self.file_handler = None
+        elif not log_to_file and self.file_handler:
+            self.file_logger.removeHandler(self.file_handler)
+            self.file_handler.close()
+            self.file_handler = None
+
+    def log(self, log_text, type = ''):
+        level = type if type in self.levels else 'info'
+        if self.threshold is None:
+            self.configure()
+        if self.levels[level] < self.threshold:
+            return
+        log_text = self.prefixes.get(level, '') + str(log_text)
+        print(log_text)
+        if self.file_handler:
+            self.file_logger.log(self.levels[level], log_text.strip())
+        with self.lock:
+            self.buffer.append(log_text)
+            buffered_lines = len(self.buffer)
+        #bpy can only be used from the main thread. Messages from other threads wait for the next flush
+        if threading.current_thread() is not threading.main_thread():
+            return
+        if level == 'error' or buffered_lines >= self.max_buffered_lines:
+            self.flush()
+        elif not bpy.app.timers.is_registered(flush_log):
+            #also registered again if the timer was lost while lines were waiting, like when loading a file clears the timers
+            bpy.app.timers.register(flush_log, first_interval=0.5)
+
+    def flush(self):
+        '''Writes every buffered message to the KKBP Log text. Must be called from the main thread'''
+        with self.lock:
+            if not self.buffer:
+                return
+            log_text = '\n'.join(self.buffer) + '\n'
+            self.buffer.clear()
+        if not bpy.data.texts.get('KKBP Log'):
+            bpy.data.texts.new(name='KKBP Log')
+            if bpy.data.screens.get('Scripting'):
+                for area in bpy.data.screens['Scripting'].areas:
+                    if area.type == 'TEXT_EDITOR':
+                        area.spaces[0].text = bpy.data.texts['KKBP Log']
+                        bpy.data.texts['KKBP Log'].write('====    KKBP Log    ====\n')
+        bpy.data.texts['KKBP Log'].write(log_text)
+        if self.file_handler:
+            self.file_handler.flush()
+
+
+def flush_log():
+    '''Timer callback that writes the buffered log messages once Blender is idle'''
+    kkbp_logger.flush()
+    return None
+
+
 def kklog(log_text: str, type=''):
-    '''Log to the KKBP Log text in the scripting tab. Also prints to console. type can be error or warn'''
-    if not bpy.data.texts.get('KKBP Log'):
-        bpy.data.texts.new(name='KKBP Log')
-        if bpy.data.screens.get('Scripting'):
-            for area in bpy.data.screens['Scripting'].areas:
-                if area.type == 'TEXT_EDITOR':
-                    area.spaces[0].text = bpy.data.texts['KKBP Log']
-                    bpy.data.texts['KKBP Log'].write('====    KKBP Log    ====\n')
-    if type == 'error':
-        log_text = '\nError:          ' + str(log_text)
-    elif type == 'warn':
-        log_text = 'Warning:        ' + str(log_text)
-    bpy.data.texts['KKBP Log'].write(str(log_text) + '\n')
-    print(str(log_text))
+    '''Log to the KKBP Log text in the scripting tab. Also prints to console. type can be debug, error or warn'''
+    kkbp_logger.log(log_text, type)
 
 
 def set_viewport_shading(type='MATERIAL'):
@@ -117,74 +470,57 @@ def set_viewport_shading(type='MATERIAL'):
 
 def get_hairs() -> list[bpy.types.Object]:
     '''Returns a list of all the hair objects for this import'''
-    hairs = [o for o in bpy.data.objects if
-             o.type == 'MESH' and o.get('hair') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return hairs
+    return object_registry.get('hair')
 
 
 def get_outfits() -> list[bpy.types.Object]:
     '''Returns a list of all the outfit objects for this import'''
-    outfits = [o for o in bpy.data.objects if
-               o.type == 'MESH' and o.get('outfit') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return outfits
+    return object_registry.get('outfit')
 
 
 def get_alts() -> list[bpy.types.Object]:
     '''Returns a list of all the alternate outfit objects for this import'''
-    alts = [o for o in bpy.data.objects if
-            o.type == 'MESH' and o.get('alt') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return alts
+    return object_registry.get('alt')
 
 
 def get_hitboxes() -> list[bpy.types.Object]:
     '''Returns a list of all the hitbox objects for this import'''
-    hits = [o for o in bpy.data.objects if
-            o.type == 'MESH' and o.get('hitbox') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return hits
+    return object_registry.get('hitbox')
 
 
 def get_body() -> bpy.types.Object:
     '''Returns the body object for this import'''
-    bodies = [o for o in bpy.data.objects if o.get('body') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return bodies[0] if bodies else None
+    return object_registry.get_first('body')
 
 
 def get_armature() -> bpy.types.Object:
     '''Returns the armature object for this import'''
-    arms = [o for o in bpy.data.objects if o.get('armature') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return arms[0] if arms else None
+    return object_registry.get_first('armature')
 
 
 def get_rig() -> bpy.types.Object:
     '''Returns the rigify armature object for this import'''
-    arms = [o for o in bpy.data.objects if o.get('rig') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return arms[0] if arms else None
+    return object_registry.get_first('rig')
 
 
 def get_empties() -> list[bpy.types.Object]:
     '''Returns a list of all empty objects for this import'''
-    empties = [o for o in bpy.data.objects if
-               o.type == 'EMPTY' and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return empties
+    return object_registry.get('empty')
 
 
 def get_tears() -> bpy.types.Object:
     '''Returns the tears object for this import'''
-    tears = [o for o in bpy.data.objects if o.get('tears') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return tears[0] if tears else None
+    return object_registry.get_first('tears')
 
 
 def get_gags() -> bpy.types.Object:
     '''Returns the gag eyes object for this import'''
-    gags = [o for o in bpy.data.objects if o.get('gag') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return gags[0] if gags else None
+    return object_registry.get_first('gag')
 
 
 def get_tongue() -> bpy.types.Object:
     '''Returns the rigged tongue object for this import'''
-    tongues = [o for o in bpy.data.objects if
-               o.get('tongue') and o.get('name') == bpy.context.scene.kkbp.character_name]
-    return tongues[0] if tongues else None
+    return object_registry.get_first('tongue')
 
 
 def get_all_objects() -> list[bpy.types.Object]:
@@ -238,79 +574,302 @@ def get_material_names(smr_name: str) -> list[str] | None:
 
 def get_shader_name(material_name: str) -> str:
     '''Returns the shader name for this material'''
-    material_data = json_file_manager.get_json_file('KK_MaterialDataComplete.json')
-    material_infos = [m['MaterialInformation'] for m in material_data if m.get('MaterialInformation')]
-    shaders = []
-    for material_info in material_infos:
-        shaders.extend([m.get('ShaderName') for m in material_info if m.get('MaterialName') == material_name])
-    return shaders[0] if shaders else None
+    return json_file_manager.get_shader_name(material_name)
 
 
 def get_color(material_name: str, color: str) -> dict[float]:
     '''Find the material material_name and return an RGBA dict list of the specified color ranging from 0-1. If material_name contains a space and the character name, it will be filtered out.'''
-    material_name = bpy.data.materials[material_name].get('id')
-    if material_name:
-        material_data = json_file_manager.get_json_file('KK_MaterialDataComplete.json')
-        material_infos = [m['MaterialInformation'] for m in material_data if m.get('MaterialInformation')]
-        # get all the colors
-        material_colors = []
-        for material_info in material_infos:
-            material_colors.extend([m for m in material_info if m.get('MaterialName') == material_name])
-        for material_color in material_colors:
-            # then zip them and find the shadow color
-            color_dict = zip(material_color['ShaderPropNames'], material_color['ShaderPropColorValues'])
-            # key names are not consistent, so look through all of them
-            for pair in color_dict:
-                if color in pair[0]:
-                    return pair[1]
-    kklog(f"Couldn't find {color} for {material_name}", 'warn')
-    return {'r': 1, 'g': 1, 'b': 1, 'a': 1}
+    return json_file_manager.get_color(material_name, color)
 
 
 def get_body_materials() -> list[bpy.types.Material]:
     '''Returns a list of all the body materials'''
-    materials = [m for m in bpy.data.materials if
-                 m.get('body') and m.get('name') == bpy.context.scene.kkbp.character_name]
-    return materials
+    return material_registry.get('body')
 
 
 def get_hair_materials() -> list[bpy.types.Material]:
-    '''Returns a list of all the body materials'''
-    materials = [m for m in bpy.data.materials if
-                 m.get('hair') and m.get('name') == bpy.context.scene.kkbp.character_name]
-    return materials
+    '''Returns a list of all the hair materials'''
+    return material_registry.get('hair')
 
 
 def get_outfit_materials() -> list[bpy.types.Material]:
     '''Returns a list of all the outfit materials'''
-    materials = [m for m in bpy.data.materials if
-                 m.get('outfit') and m.get('name') == bpy.context.scene.kkbp.character_name]
-    return materials
+    return material_registry.get('outfit')
+
+
+def get_memory_usage() -> tuple[int, int]:
+    '''Returns the current and peak resident memory of this Blender process in bytes.
+    The current memory is 0 on platforms where it can't be read without extra modules'''
+    try:
+        if sys.platform.startswith('linux'):
+            current = peak = 0
+            with open('/proc/self/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        current = int(line.split()[1]) * 1024
+                    elif line.startswith('VmHWM:'):
+                        peak = int(line.split()[1]) * 1024
+            return current, peak
+        if sys.platform == 'win32':
+            import ctypes, ctypes.wintypes
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [('cb', ctypes.wintypes.DWORD), ('PageFaultCount', ctypes.wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+            get_process_memory_info.argtypes = [ctypes.wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), ctypes.wintypes.DWORD]
+            get_process_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        import resource
+        #macOS reports the peak in bytes
+        return 0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (OSError, AttributeError, ValueError, ImportError):
+        return 0, 0
+
+
+class SpanTracer:
+    '''
+    Records how long each part of the plugin takes as nested spans, using time.perf_counter_ns.
+    The first span opened on the main thread starts a trace. Every span opened inside of it, on any thread, is recorded
+    with the id of the thread that ran it, so the saturation workers show up next to the import stages.
+    print_timer records a span for the stage that just finished, from the last time the timer was reset until now.
+    If trace saving is enabled in the preferences, the trace is saved when the first span closes in the Chrome trace event format
+    to the traces folder inside of the export folder. Only the newest traces are kept.
+    The file can be opened with chrome://tracing or https://ui.perfetto.dev
+    The resident memory of Blender is sampled at the start and end of every span and stage on the main thread.
+    Those samples, and the numpy high-water marks recorded by track_numpy_memory if enabled in the preferences, are also saved to a memory summary json next to the trace.
+    The peak memory reported by the OS can't be reset, so a stage needed more memory than every stage before it when peak_grew is true.
+    The instance is declared at the bottom of the file
+    '''
+
+    def __init__(self):
+        self.events = []
+        self.thread_names = {}
+        self.stages = []
+        self.numpy_peaks = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.recording = False
+        self.save_traces = False
+        self.trace_count = 10
+        self.trace_numpy_memory = False
+        self.trace_start = self.mark_time = time.perf_counter_ns()
+        self.mark_memory = (0, 0)
+
+    def __stack__(self) -> list:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def add_span(self, name: str, start: int, end: int, pid: int = None, tid: int = None, thread_name: str = None, args: dict = None):
+        '''Records a span that was timed elsewhere, like in a worker process. start and end are perf_counter_ns values'''
+        if not self.recording:
+            return
+        pid = os.getpid() if pid is None else pid
+        tid = threading.get_native_id() if tid is None else tid
+        event = {'name': name, 'cat': 'kkbp', 'ph': 'X', 'ts': (start - self.trace_start) / 1000, 'dur': (end - start) / 1000, 'pid': pid, 'tid': tid}
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.events.append(event)
+            if (pid, tid) not in self.thread_names:
+                self.thread_names[(pid, tid)] = thread_name or threading.current_thread().name
+
+    def start(self, name: str):
+        stack = self.__stack__()
+        main_thread = threading.current_thread() is threading.main_thread()
+        if not stack and not self.recording and main_thread:
+            with self.lock:
+                self.events = []
+                self.thread_names = {}
+                self.stages = []
+                self.numpy_peaks = {}
+            self.configure()
+            self.trace_start = time.perf_counter_ns()
+            self.recording = True
+        #the stages timed with print_timer and the memory samples are on the main thread
+        memory = get_memory_usage() if main_thread else None
+        stack.append((name, time.perf_counter_ns(), memory))
+        if main_thread:
+            self.mark_time = time.perf_counter_ns()
+            self.mark_memory = memory
+
+    def finish(self):
+        name, start, start_memory = self.__stack__().pop()
+        end = time.perf_counter_ns()
+        if threading.current_thread() is not threading.main_thread():
+            self.add_span(name, start, end)
+            return
+        self.add_stage(name, start, end, start_memory, len(self.__stack__()))
+        self.mark_time = end
+        if not self.__stack__() and self.recording:
+            self.recording = False
+            if self.save_traces and get_import_path():
+                folder = os.path.join(get_import_path(), 'traces')
+                path = os.path.join(folder, '{} {}'.format(name, datetime.datetime.now().strftime('%Y-%m-%d %H-%M-%S')))
+                self.save(path + '.json')
+                self.save_memory_summary(path + ' memory.json')
+                self.remove_old_traces(folder)
+
+    def configure(self):
+        '''Reads the trace settings from the addon preferences'''
+        try:
+            preferences = bpy.context.preferences.addons[__package__].preferences
+            self.save_traces = preferences.save_traces
+            self.trace_count = preferences.trace_count
+            self.trace_numpy_memory = preferences.trace_numpy_memory
+        except (AttributeError, KeyError):
+            self.save_traces = False
+            self.trace_numpy_memory = False
+
+    def remove_old_traces(self, folder: str):
+        '''Deletes every trace and memory summary in folder except the newest trace_count traces'''
+        try:
+            traces = [os.path.join(folder, file) for file in os.listdir(folder) if file.endswith('.json') and not file.endswith(' memory.json')]
+            traces.sort(key=os.path.getmtime, reverse=True)
+            for trace in traces[self.trace_count:]:
+                for path in (trace, trace[:-len('.json')] + ' memory.json'):
+                    if os.path.isfile(path):
+                        os.remove(path)
+        except OSError:
+            kklog('Could not delete the old traces in {}'.format(folder), 'warn')
+
+    def add_stage(self, name: str, start: int, end: int, start_memory: tuple[int, int], depth: int):
+        '''Records a main thread span along with the memory used before and after it'''
+        if not self.recording:
+            return
+        end_memory = self.mark_memory = get_memory_usage()
+        mb = 1024 * 1024
+        stage = {
+            'name': name,
+            'depth': depth,
+            'seconds': round((end - start) / 1e9, 3),
+            'rss_start_mb': round(start_memory[0] / mb, 1),
+            'rss_end_mb': round(end_memory[0] / mb, 1),
+            'peak_rss_mb': round(end_memory[1] / mb, 1),
+            'peak_grew': end_memory[1] > start_memory[1],
+            }
+        self.stages.append(stage)
+        self.add_span(name, start, end, args = {key: stage[key] for key in ('rss_start_mb', 'rss_end_mb', 'peak_rss_mb')})
+        with self.lock:
+            self.events.append({'name': 'memory', 'ph': 'C', 'ts': (end - self.trace_start) / 1000, 'pid': os.getpid(),
+                                'args': {'rss_mb': stage['rss_end_mb'], 'peak_rss_mb': stage['peak_rss_mb']}})
+
+    def add_numpy_peak(self, name: str, peak: int):
+        '''Records the most memory numpy and python allocated at once while name ran'''
+        if not self.recording:
+            return
+        with self.lock:
+            calls, highest = self.numpy_peaks.get(name, (0, 0))
+            self.numpy_peaks[name] = (calls + 1, max(highest, peak))
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.finish()
+
+    def mark(self, name: str) -> float:
+        '''Records a span named name from the last mark until now and returns its length in seconds'''
+        now = time.perf_counter_ns()
+        self.add_stage(name, self.mark_time, now, self.mark_memory, len(self.__stack__()))
+        start, self.mark_time = self.mark_time, now
+        return (now - start) / 1e9
+
+    def reset(self):
+        self.mark_time = time.perf_counter_ns()
+        self.mark_memory = get_memory_usage() if self.recording else (0, 0)
+
+    def elapsed(self) -> float:
+        '''Returns the seconds since the current trace started, or since the last trace started if none is running'''
+        return (time.perf_counter_ns() - self.trace_start) / 1e9
+
+    def save(self, path: str):
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}} for (pid, tid), thread_name in thread_names.items())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as trace_file:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+        except OSError:
+            kklog('Could not save the trace file to {}'.format(path), 'warn')
+
+    def save_memory_summary(self, path: str):
+        mb = 1024 * 1024
+        with self.lock:
+            summary = {
+                'stages': list(self.stages),
+                'numpy_high_water': [{'name': name, 'calls': calls, 'peak_mb': round(peak / mb, 1)} for name, (calls, peak) in self.numpy_peaks.items()],
+                'peak_rss_mb': max((stage['peak_rss_mb'] for stage in self.stages), default=0),
+                }
+        try:
+            with open(path, 'w', encoding='utf-8') as summary_file:
+                json.dump(summary, summary_file, indent=1)
+        except OSError:
+            kklog('Could not save the memory summary to {}'.format(path), 'warn')
+
+
+def traced(name: str):
+    '''Decorator that records every call of the function as a span'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def track_numpy_memory(name: str):
+    '''Decorator that records the highest amount of memory numpy and python allocated during each call of the function.
+    numpy reports its buffers to tracemalloc, so this includes every temporary array.
+    tracemalloc slows down python code, so this only runs while a trace is recording and trace_numpy_memory is enabled in the preferences'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            #a nested call would reset the peak of the outer one
+            if not tracer.recording or not tracer.trace_numpy_memory or tracemalloc.is_tracing():
+                return function(*args, **kwargs)
+            tracemalloc.start()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.add_numpy_peak(name, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        return wrapper
+    return decorator
 
 
 def initialize_timer():
-    bpy.context.scene.kkbp.total_timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
-    bpy.context.scene.kkbp.timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
+    tracer.reset()
 
 
 def reset_timer():
-    bpy.context.scene.kkbp.timer = datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6
+    tracer.reset()
 
 
 def print_timer(operation_name: str):
-    '''Prints the time between now and the last operation that was timed'''
-    kklog('{} operation took {} seconds'.format(
-        operation_name, 
-        abs(round(((datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6) - bpy.context.scene.kkbp.timer),
-        3))))
-    reset_timer()
+    '''Prints the time between now and the last operation that was timed, and records it in the trace'''
+    kklog('{} operation took {} seconds'.format(operation_name, round(tracer.mark(operation_name), 3)))
+    #objects are usually renamed, separated or tagged between stages
+    object_registry.invalidate()
+    kkbp_logger.flush()
+    kkbp_logger.configure()
 
 
 def handle_error(error_causer: bpy.types.Operator, error: Exception):
     kklog(
         'Unknown python error occurred. \n          Make sure the default model imports correctly before troubleshooting on this model!\n\n\n',
         type='error')
-    kklog(traceback.format_exc())
+    kklog(traceback.format_exc(), type='error')
     error_causer.report({'ERROR'}, traceback.format_exc())
 
 
@@ -434,3 +993,7 @@ def import_from_library_file(category, list_of_items, use_fake_user=False):
 
 
 json_file_manager = JsonFileManager()
+kkbp_logger = KKBPLogger()
+tracer = SpanTracer()
+object_registry = ObjectRegistry()
+material_registry = MaterialRegistry()
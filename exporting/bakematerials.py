@@ -13,13 +13,10 @@
 # - material combiner code taken from https://github.com/Grim-es/material-combiner-addon/
 
 
-import bpy, os, traceback, time, pathlib, subprocess
+import bpy, os, traceback, time, pathlib
 from .. import common as c
 from ..interface.dictionary_en import t
-
-def print_memory_usage(stri):
-    run = subprocess.run('wmic OS get FreePhysicalMemory', capture_output=True)
-    c.kklog((stri, '\n   mem usage ', 16000 - int(run.stdout.split(b'\r')[2].split(b'\n')[1])/1000))
+from ..importing.texturestore import texture_store
 
 #setup and return a camera
 def setup_camera():
@@ -131,6 +128,7 @@ def sanitizeMaterialName(text: str) -> str:
             text = text.replace(ch,'')
     return text
 
+@c.traced('bake_pass')
 def bake_pass(folderpath: str, bake_type: str):
     '''Folds the body / clothes / hair down to a UV rectangle
     Places a filler plane right below it to fill in the rest of the image
@@ -266,7 +264,7 @@ def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
     for file in files:
         try:
             image = bpy.data.images.load(filepath=str(file))
-            image.pack()
+            texture_store.store_image(image)
             #if there was an older version of this image, get rid of it
             if image.name[-4:] == '.001':
                 if bpy.data.images.get(image.name[:-4]):
@@ -342,6 +340,7 @@ def replace_all_baked_materials(folderpath: str, bake_object: bpy.types.Object):
                         mat.material.use_fake_user = True
                         replace_mat()
 
+@c.traced('create_material_atlas')
 def create_material_atlas(folderpath: str):
     '''Merges all the finalized material png files into a single atlas file, copies the current model and applies the atlas to the copy'''
     # https://blender.stackexchange.com/questions/127403/change-active-collection
@@ -551,6 +550,7 @@ class bake_materials(bpy.types.Operator):
     bl_description = t('bake_mats_tt')
     bl_options = {'REGISTER', 'UNDO'}
         
+    @c.traced('bake_materials')
     def execute(self, context):
         try:
             #just use the pmx folder for the baked files
@@ -318,6 +318,7 @@ class export_prep(bpy.types.Operator):
     bl_description = t('export_prep_tt')
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.traced('export_prep')
     def execute(self, context):
         scene = context.scene.kkbp
         prep_type = scene.prep_dropdown
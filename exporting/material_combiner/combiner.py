@@ -10,6 +10,7 @@ class Combiner(bpy.types.Operator):
     bl_description = 'Combine materials'
     bl_options = {'UNDO', 'INTERNAL'}
 
+    @c.traced('combine_materials')
     def execute(self, context: bpy.types.Context) -> Set[str]:
         #from invoke
         scn = context.scene
@@ -86,7 +86,7 @@ def merge_weights(armature, parenting_list):
 
         for index, bone in enumerate(parenting_list):
             parent = parenting_list[bone]
-            kklog('Merging bone: {}     object {} / {}, bone {} / {}'.format(bone, mindex, len(meshes), index, len(parenting_list)))
+            kklog('Merging bone: {}     object {} / {}, bone {} / {}'.format(bone, mindex, len(meshes), index, len(parenting_list)), 'debug')
             if not mesh.vertex_groups.get(bone):
                 continue
             if not mesh.vertex_groups.get(parent):
@@ -442,6 +442,7 @@ class anim_asset_lib(bpy.types.Operator):
     mats_uv = None
     structure = None
     
+    @c.traced('animation_asset_library')
     def execute(self, context):        
         main(self.directory)
         return {'FINISHED'}
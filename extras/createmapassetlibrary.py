@@ -340,6 +340,7 @@ class map_asset_lib(bpy.types.Operator):
     mats_uv = None
     structure = None
     
+    @c.traced('map_asset_library')
     def execute(self, context):        
         main(self.directory)
         return {'FINISHED'}
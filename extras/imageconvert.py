@@ -1,7 +1,9 @@
-from pathlib import Path
-import bpy
+import bpy, os
 from .. import common as c
 from ..importing.modifymaterial import modify_material
+from ..importing.texturestore import texture_store
+from ..importing import colorscience
+from ..importing.pixelbuffer import read_pixels, write_pixels
 
 class image_convert(bpy.types.Operator):
     bl_idname = "kkbp.imageconvert"
@@ -22,17 +24,21 @@ class image_convert(bpy.types.Operator):
         else:
             lut_choice = 'Lut_TimeSunset.png'
 
+        lut_path = os.path.join(os.path.dirname(colorscience.__file__), lut_choice)
+        if not os.path.isfile(lut_path):
+            c.kklog('The LUT image {} could not be found in the addon folder'.format(lut_choice), type='error')
+            return {'CANCELLED'}
+
         image = context.space_data.image
         image.reload()
         image.colorspace_settings.name = 'sRGB'
-        
-        # Use code from importcolors to convert the current image
-        modify_material.load_luts(lut_choice, lut_choice)
-        # Need to run image_to_KK twice for the first image due to a weird bug
-        modify_material.image_to_KK(image, lut_choice)
 
-        new_pixels, width, height = modify_material.image_to_KK(image, lut_choice)
-        image.pixels = new_pixels
+        # Use the same saturation code as the importer to convert the current image
+        lut_image = bpy.data.images.load(lut_path, check_existing=True)
+        lut_pixels = read_pixels(lut_image)
+        image_pixels = read_pixels(image)
+        colorscience.saturate_pixels(image_pixels, lut_pixels, is_8bit = not image.is_float)
+        write_pixels(image, image_pixels)
         #image.save()
 
         return {'FINISHED'}
@@ -50,8 +56,9 @@ class image_dark_convert(bpy.types.Operator):
         image = context.space_data.image
         material_name = image.name[:-10]
         try:
-            shadow_color = [body['KKBP shadow colors'][material_name]['r'], body['KKBP shadow colors'][material_name]['g'], body['KKBP shadow colors'][material_name]['b']]
+            shadow_color = {'r':body['KKBP shadow colors'][material_name]['r'], 'g':body['KKBP shadow colors'][material_name]['g'], 'b':body['KKBP shadow colors'][material_name]['b']}
             darktex = modify_material.create_darktex(bpy.data.images[image.name], shadow_color)
+            texture_store.store_image(darktex)
             material_name = 'KK ' + image.name[:-10]
             bpy.data.materials[material_name].node_tree.nodes['Gentex'].node_tree.nodes['Darktex'].image = darktex
             bpy.data.materials[material_name].node_tree.nodes['Shader'].node_tree.nodes['colorsDark'].inputs['Use dark maintex?'].default_value = 1
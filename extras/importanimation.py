@@ -305,6 +305,7 @@ class anim_import(bpy.types.Operator):
     filepath : bpy.props.StringProperty(maxlen=1024, default='', options={'HIDDEN'})
     filter_glob : bpy.props.StringProperty(default='*.fbx', options={'HIDDEN'})
     
+    @c.traced('import_animation')
     def execute(self, context):        
         main(self.filepath)
         return {'FINISHED'}
@@ -2,6 +2,7 @@ import bpy, os, time, glob
 from pathlib import Path
 from bpy.props import StringProperty
 from ..importing.modifymaterial import modify_material
+from ..importing.texturestore import texture_store
 from .. import common as c
 from subprocess import Popen, PIPE
 from ..interface.dictionary_en import t
@@ -51,7 +52,7 @@ def import_studio_objects(directory):
         #pack certain images for later
         if '_md-DXT' in str(image) or '_mc-DXT' in str(image) or '_t-DXT' in str(image):
             bpy.data.images.load(filepath=str(image))
-            bpy.data.images[image.name].pack()
+            texture_store.store_image(bpy.data.images[image.name])
         
         #save the images in this directory for later
         conversion_image_list.append(image.name)
@@ -118,7 +119,7 @@ def import_studio_objects(directory):
                                 image.colorspace_settings.name = 'sRGB'
                                 image.save_render(bpy.path.abspath(new_path))
                                 bpy.data.images.load(filepath=bpy.path.abspath(new_path))
-                                bpy.data.images[new_image_name].pack()
+                                texture_store.store_image(bpy.data.images[new_image_name])
                                 node.image = bpy.data.images[new_image_name]
                         
                     #if two objects have the same material, and the material was already operated on, skip it
@@ -291,6 +292,7 @@ def import_studio_objects(directory):
                             bpy.context.scene.kkbp.import_dir = directory + 'saturated_files'
                             darktex = modify_material.create_darktex(bpy.data.images[image.name], [.764, .880, 1]) #create the darktex now and load it in later
                             bpy.context.scene.kkbp.import_dir = original_path
+                            texture_store.store_image(darktex)
 
                             image_load('Gentex', 'Darktex', darktex.name)
                             material_slot.material.node_tree.nodes['Shader'].node_tree.nodes['colorsDark'].inputs['Use dark maintex?'].default_value = 1
@@ -401,6 +403,7 @@ class import_studio(bpy.types.Operator):
     mats_uv = None
     structure = None
     
+    @c.traced('import_studio')
     def execute(self, context):        
         import_studio_objects(self.directory)
         c.toggle_console()
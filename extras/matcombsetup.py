@@ -8,6 +8,7 @@ class mat_comb_setup(bpy.types.Operator):
     bl_description = t('mat_comb_tt')
     bl_options = {'REGISTER', 'UNDO'}
 
+    @c.traced('material_combiner_setup')
     def execute(self, context):
         def recurLayerCollection(layerColl, collName):
             found = None
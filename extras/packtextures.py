@@ -0,0 +1,20 @@
+import bpy
+from ..interface.dictionary_en import t
+from .. import common as c
+from ..importing.texturestore import texture_store
+
+class pack_textures(bpy.types.Operator):
+    bl_idname = "kkbp.packtextures"
+    bl_label = "Pack textures for distribution"
+    bl_description = t('pack_for_distribution_tt')
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        try:
+            #pack every texture at once, so the .blend file can be shared without the texture store
+            packed = texture_store.pack_all()
+            c.kklog('Packed {} textures into the .blend file'.format(packed))
+            return {'FINISHED'}
+        except Exception as error:
+            c.handle_error(self, error)
+            return {"CANCELLED"}
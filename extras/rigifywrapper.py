@@ -12,6 +12,7 @@ class rigify_convert(bpy.types.Operator):
     bl_description = t('rigify_convert_tt')
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.traced('rigify_convert')
     def execute(self, context):
         try:
             bpy.context.scene.kkbp.armature_dropdown = 'B'
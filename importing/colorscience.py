@@ -0,0 +1,641 @@
+'''
+Texture saturation math for the KKBP importer.
+Nothing in this file uses bpy, so every function here works on plain numpy arrays.
+
+The reference saturation samples the 1024 x 32 Lut_TimeDay.png strip with two bilinear lookups per pixel (see saturate_pixels_strip).
+The LUT cube engine samples that reference path once on a regular RGB lattice and caches the result to disk,
+so saturating a pixel only takes a single trilinear lookup afterwards (see apply_lut_cube).
+
+Measured against the reference path on every 8 bit input color, the 65 x 65 x 65 cube stays within
+LUT_CUBE_TOLERANCE of the reference (the max absolute difference is about 3.1 / 255 in the 0-1 range).
+The mean difference is about 0.05 / 255, so the saturated textures are visually identical.
+
+Every _MT texture is 8 bits per channel, so there are only 2^24 possible input colors.
+The LUT table engine runs the reference path on all of them once and caches the uint8 results as a 48 MB memory mapped .npy file,
+so saturating an 8 bit image becomes a single gather (see apply_lut_table). The output is identical to the 8 bit PNG the reference path saves.
+'''
+
+import os, time, hashlib, threading, numpy
+from multiprocessing import shared_memory
+try:
+    from . import pngio
+except ImportError:
+    #worker processes import this file as a top level module
+    import pngio
+
+#  numpy's precision
+np_number_precision = numpy.float32
+
+#constants to ensure bot and top are within the 32 x 1024 dimensions of the lut
+coord_scale = numpy.array([0.0302734375, 0.96875, 31.0], dtype=np_number_precision)
+coord_offset = numpy.array([0.5 / 1024, 0.5 / 32, 0.0], dtype=np_number_precision)
+texel_height_X0 = numpy.array([1 / 32, 0], dtype=np_number_precision)
+
+#number of lattice points per axis of the LUT cube
+LUT_CUBE_SIZE = 65
+#max absolute difference between the LUT cube engine and the reference strip path
+LUT_CUBE_TOLERANCE = 4 / 255
+#bump this whenever the output of the cube changes so old cache files are ignored
+LUT_CUBE_VERSION = 1
+#same as above but for the 24 bit LUT table
+LUT_TABLE_VERSION = 1
+#bump these whenever the saturated or dark output changes so old textures in the texture cache are ignored
+SATURATION_VERSION = 1
+DARK_VERSION = 1
+#Textures with only a few colors (color masks, flat accessories) are saturated one color at a time instead of one pixel at a time.
+#A sample of the pixels is checked first so textures with a lot of colors fall back to the normal path quickly
+PALETTE_SAMPLE_SIZE = 1 << 16
+PALETTE_SAMPLE_COLORS = 1 << 12
+PALETTE_MAX_COLORS = 1 << 16
+#how many colors of the LUT table are run through the reference path at once while building it
+LUT_TABLE_CHUNK = 1 << 20
+
+
+def bilinear_interpolation(lut_pixels: numpy.ndarray, coords: numpy.ndarray) -> numpy.ndarray:
+    h, w, _ = lut_pixels.shape
+    x = coords[:, :, 0] * (w - 1)
+    # Fudge x coordinates based on x position. subtract -0.5 if at x position 0 and add 0.5 if at x position 1024 of the LUT.
+    # this helps with some kind of overflow / underflow issue where it reads from the next LUT square when it's not supposed to
+    x = x + (x / 1024 - 0.5)
+    y = coords[:, :, 1] * (h - 1)
+    # Get integer and fractional parts of each coordinate.
+    # Also make sure each coordinate is clipped to the LUT image bounds
+    x0 = numpy.clip(numpy.floor(x).astype(int), 0, w - 1)
+    x1 = numpy.clip(x0 + 1, 0, w - 1)
+    y0 = numpy.clip(numpy.floor(y).astype(int), 0, h - 1)
+    y1 = numpy.clip(y0 + 1, 0, h - 1)
+    x_frac = x - x0
+    y_frac = y - y0
+    # Get the pixel values at four corners of this coordinate
+    f00 = lut_pixels[y0, x0]
+    f01 = lut_pixels[y1, x0]
+    f10 = lut_pixels[y0, x1]
+    f11 = lut_pixels[y1, x1]
+    del x0
+    del x1
+    del y0
+    del y1
+    # Perform the bilinear interpolation using the fractional part of each coordinate
+    # This will ensure the LUT can provide the correct color every single time, even if that color isn't found in the LUT itself
+    # If this isn't performed, the resulting image will look very blocky because it will snap to colors only found in the LUT.
+    lut_col_bot = f00 * (1 - y_frac)[:, :, numpy.newaxis] + f01 * y_frac[:, :, numpy.newaxis]
+    lut_col_top = f10 * (1 - y_frac)[:, :, numpy.newaxis] + f11 * y_frac[:, :, numpy.newaxis]
+    interpolated_colors = lut_col_bot * (1 - x_frac)[:, :, numpy.newaxis] + lut_col_top * x_frac[:, :, numpy.newaxis]
+    return interpolated_colors
+
+
+def saturate_pixels_strip(lut_pixels: numpy.ndarray, slice_image: numpy.ndarray):
+    '''The Secret Sauce. Saturates a (rows, columns, 4) pixel array in place using the LUT strip to match the in-game look.'''
+    # Find the XY coordinates of the LUT image needed to saturate each pixel
+    coord = slice_image[:, :, :3] * coord_scale + coord_offset
+    coord_frac, coord_floor = numpy.modf(coord)
+    coord_frac_z = coord_frac[:, :, 2:3]
+    del coord_frac  # free temporary variables after they're used
+    coord_bot = coord[:, :, :2] + coord_floor[:, :, 2:3] * texel_height_X0
+    del coord
+    del coord_floor
+
+    #use those XY coordinates to find the saturated version of the color from the LUT image
+    lutcol_bot = bilinear_interpolation(lut_pixels, coord_bot)
+
+    lut_colors = lutcol_bot * (1 - coord_frac_z)
+    del lutcol_bot
+    coord_top = numpy.clip(coord_bot + texel_height_X0, 0, 1)
+    lutcol_top = bilinear_interpolation(lut_pixels, coord_top)
+    lut_colors += lutcol_top * coord_frac_z
+    del lutcol_top
+    del coord_top
+    slice_image[:, :, :3] = lut_colors[:,:,:3]
+
+
+def lut_digest(lut_pixels: numpy.ndarray) -> str:
+    '''Returns a short hash of the LUT pixels. Used to name cache files so editing the LUT image invalidates them'''
+    return hashlib.sha1(numpy.ascontiguousarray(lut_pixels, dtype=np_number_precision).tobytes()).hexdigest()[:16]
+
+
+def build_lut_cube(lut_pixels: numpy.ndarray, size: int = LUT_CUBE_SIZE) -> numpy.ndarray:
+    '''Samples the reference strip path on a size x size x size RGB lattice.
+    Returns a (3, size, size, size) array holding one plane per output channel, indexed as [channel, blue, green, red]'''
+    lattice = numpy.linspace(0, 1, size, dtype=np_number_precision)
+    blue, green, red = numpy.meshgrid(lattice, lattice, lattice, indexing='ij')
+    pixels = numpy.stack((red, green, blue, numpy.ones_like(red)), axis=-1).reshape(size * size, size, 4)
+    del red, green, blue
+    saturate_pixels_strip(lut_pixels, pixels)
+    return numpy.ascontiguousarray(numpy.moveaxis(pixels[:, :, :3].reshape(size, size, size, 3), -1, 0))
+
+
+def load_lut_cube(lut_pixels: numpy.ndarray, cache_dir: str, size: int = LUT_CUBE_SIZE) -> numpy.ndarray:
+    '''Returns the LUT cube for this LUT. The cube is read from cache_dir if it was built before, otherwise it is built and saved to cache_dir.
+    The cache filename contains a hash of the LUT pixels, so editing the LUT image will build a new cube'''
+    cache_file = os.path.join(cache_dir, f'lut_cube_{size}_v{LUT_CUBE_VERSION}_{lut_digest(lut_pixels)}.npy')
+    try:
+        lut_cube = numpy.load(cache_file)
+        if lut_cube.shape == (3, size, size, size):
+            return lut_cube
+    except (OSError, ValueError):
+        pass
+    lut_cube = build_lut_cube(lut_pixels, size)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        #save to a temp file first so other imports never read a half written cube
+        temp_file = cache_file + '.tmp.npy'
+        numpy.save(temp_file, lut_cube)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        #the addon folder is read only. The cube will be rebuilt next time
+        pass
+    return lut_cube
+
+
+def build_lut_table(lut_pixels: numpy.ndarray, lut_table: numpy.ndarray = None) -> numpy.ndarray:
+    '''Runs every 8 bit RGB color through the reference strip path.
+    Returns a (2^24, 3) uint8 array indexed by (red << 16) | (green << 8) | blue. If lut_table is given, the results are written into it'''
+    if lut_table is None:
+        lut_table = numpy.empty((1 << 24, 3), dtype=numpy.uint8)
+    for start in range(0, 1 << 24, LUT_TABLE_CHUNK):
+        index = numpy.arange(start, start + LUT_TABLE_CHUNK, dtype=numpy.uint32)
+        pixels = numpy.ones((LUT_TABLE_CHUNK, 1, 4), dtype=np_number_precision)
+        pixels[:, 0, 0] = (index >> 16) & 255
+        pixels[:, 0, 1] = (index >> 8) & 255
+        pixels[:, 0, 2] = index & 255
+        pixels[:, 0, :3] /= np_number_precision(255)
+        saturate_pixels_strip(lut_pixels, pixels)
+        colors = numpy.clip(pixels[:, 0, :3], 0, 1)
+        colors *= 255
+        colors += 0.5
+        lut_table[start:start + LUT_TABLE_CHUNK] = colors
+    return lut_table
+
+
+def load_lut_table(lut_pixels: numpy.ndarray, cache_dir: str) -> numpy.ndarray:
+    '''Returns the 24 bit LUT table for this LUT as a read only memory map of the cache file in cache_dir.
+    The table is built and saved first if it does not exist yet. If cache_dir is read only, the table is kept in memory instead'''
+    cache_file = os.path.join(cache_dir, f'lut_table_v{LUT_TABLE_VERSION}_{lut_digest(lut_pixels)}.npy')
+    try:
+        lut_table = numpy.load(cache_file, mmap_mode='r')
+        if lut_table.shape == (1 << 24, 3) and lut_table.dtype == numpy.uint8:
+            return lut_table
+    except (OSError, ValueError):
+        pass
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        #build straight into a temp file so the full table never has to be held in memory twice
+        temp_file = cache_file + '.tmp.npy'
+        lut_table = numpy.lib.format.open_memmap(temp_file, mode='w+', dtype=numpy.uint8, shape=(1 << 24, 3))
+        build_lut_table(lut_pixels, lut_table)
+        lut_table.flush()
+        del lut_table
+        os.replace(temp_file, cache_file)
+        return numpy.load(cache_file, mmap_mode='r')
+    except OSError:
+        return build_lut_table(lut_pixels)
+
+
+def apply_lut_table(lut_table: numpy.ndarray, slice_image: numpy.ndarray):
+    '''Saturates a (rows, columns, 4) pixel array of an 8 bit image in place with a single lookup into the 24 bit LUT table per pixel'''
+    quantized = numpy.clip(slice_image[:, :, :3], 0, 1)
+    quantized *= 255
+    quantized += 0.5
+    quantized = quantized.astype(numpy.uint32)
+    index = quantized[:, :, 0] << 16
+    index |= quantized[:, :, 1] << 8
+    index |= quantized[:, :, 2]
+    del quantized
+    numpy.divide(lut_table[index], np_number_precision(255), out=slice_image[:, :, :3], casting='unsafe')
+
+
+def __lerp__(a: numpy.ndarray, b: numpy.ndarray, t: numpy.ndarray) -> numpy.ndarray:
+    '''a + (b - a) * t, reusing the memory of b'''
+    b -= a
+    b *= t
+    b += a
+    return b
+
+
+def apply_lut_cube(lut_cube: numpy.ndarray, slice_image: numpy.ndarray):
+    '''Saturates a (rows, columns, 4) pixel array in place with a single trilinear lookup into the LUT cube per pixel'''
+    size = lut_cube.shape[1]
+    # Find the lattice cell of each pixel. The cell index is clamped so the top corner of the cell is still inside the cube
+    coord = numpy.clip(slice_image[:, :, :3], 0, 1)
+    coord *= np_number_precision(size - 1)
+    index = coord.astype(numpy.intp)
+    numpy.minimum(index, size - 2, out=index)
+    coord -= index
+    frac_r = coord[:, :, 0]
+    frac_g = coord[:, :, 1]
+    frac_b = coord[:, :, 2]
+    base = index[:, :, 2] * size
+    base += index[:, :, 1]
+    base *= size
+    base += index[:, :, 0]
+    del index
+
+    # Offsetting the flattened plane instead of the index array avoids creating an index array for every corner
+    step_g = size
+    step_b = size * size
+    for channel, plane in enumerate(lut_cube.reshape(3, -1)):
+        bot_near = __lerp__(plane.take(base), plane[1:].take(base), frac_r)
+        bot_far  = __lerp__(plane[step_g:].take(base), plane[step_g + 1:].take(base), frac_r)
+        top_near = __lerp__(plane[step_b:].take(base), plane[step_b + 1:].take(base), frac_r)
+        top_far  = __lerp__(plane[step_b + step_g:].take(base), plane[step_b + step_g + 1:].take(base), frac_r)
+        bot = __lerp__(bot_near, bot_far, frac_g)
+        top = __lerp__(top_near, top_far, frac_g)
+        slice_image[:, :, channel] = __lerp__(bot, top, frac_b)
+
+
+def pack_rgb(pixels: numpy.ndarray) -> numpy.ndarray:
+    '''Packs the RGB of (pixels, 4) 8 bit colors stored as 0-1 floats into one uint32 per pixel'''
+    rgb = (pixels[:, :3] * 255 + 0.5).astype(numpy.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+def saturate_palette(slice_image: numpy.ndarray, lut_pixels: numpy.ndarray, lut_cube: numpy.ndarray = None, max_colors = PALETTE_MAX_COLORS) -> bool:
+    '''Saturates a (rows, columns, 4) array of 8 bit pixels in place by saturating each unique color once and scattering the results back.
+    Gives the same result as the per pixel path. Returns False without changing anything if the image has too many colors'''
+    pixels = slice_image.reshape(-1, 4)
+    step = max(1, len(pixels) // PALETTE_SAMPLE_SIZE)
+    palette = numpy.unique(pack_rgb(pixels[::step]))
+    if len(palette) > PALETTE_SAMPLE_COLORS:
+        return False
+    #find every pixel in the sampled palette. Searching a few thousand sorted colors is a lot cheaper than sorting the whole image
+    packed = pack_rgb(pixels)
+    inverse = numpy.searchsorted(palette, packed)
+    missing = palette[numpy.minimum(inverse, len(palette) - 1)] != packed
+    if missing.any():
+        #the sample didn't see every color, so add the missing ones and search again
+        palette = numpy.union1d(palette, packed[missing])
+        if len(palette) > max_colors:
+            return False
+        inverse = numpy.searchsorted(palette, packed)
+    del packed, missing
+    #take each color from the image itself so the input to the LUT is exactly the same as the per pixel path
+    first_index = numpy.empty(len(palette), dtype=numpy.intp)
+    first_index[inverse] = numpy.arange(len(pixels))
+    colors = pixels[first_index].reshape(1, -1, 4)
+    if lut_cube is not None:
+        apply_lut_cube(lut_cube, colors)
+    else:
+        saturate_pixels_strip(lut_pixels, colors)
+    pixels[:, :3] = numpy.take(colors[0, :, :3], inverse, axis=0)
+    return True
+
+
+def saturate_pixels(slice_image: numpy.ndarray, lut_pixels: numpy.ndarray, lut_cube: numpy.ndarray = None, lut_table: numpy.ndarray = None, is_8bit = True):
+    '''Saturates a (rows, columns, 4) pixel array in place with the fastest LUT available.
+    The 24 bit table is only used for 8 bit images, the cube is used if there is no table, and the LUT strip is used if neither are available.
+    8 bit images with only a few colors saturate each color once instead of each pixel'''
+    if lut_table is not None and is_8bit:
+        apply_lut_table(lut_table, slice_image)
+    elif is_8bit and saturate_palette(slice_image, lut_pixels, lut_cube):
+        pass
+    elif lut_cube is not None:
+        apply_lut_cube(lut_cube, slice_image)
+    else:
+        saturate_pixels_strip(lut_pixels, slice_image)
+
+
+# %% Shader colors
+# Every row is one color, so all of the shader colors of a character can be converted in one pass.
+# The dark color math runs in float64 like the python float4 code it replaced, so the results are the same.
+# The scalar float4 code is kept as a reference in benchmarks/colorscience_benchmark.py
+
+def srgb_to_linear(srgb: numpy.ndarray) -> numpy.ndarray:
+    '''After the older gpu code uses the texture lookup the colorspace is converted from srgb to linear, so replicate that behavior here'''
+    return numpy.where(
+        srgb <= 0.04045,
+        srgb / 12.92,
+        numpy.power((srgb + 0.055) / 1.055, 2.4))
+
+
+def saturate_colors(colors: numpy.ndarray, lut_pixels: numpy.ndarray) -> numpy.ndarray:
+    '''The Secret Sauce for shader colors. Accepts an (N, 3 or 4) array of 0-1 float colors and returns an (N, 4) float32 array of saturated linear colors.
+    Unlike textures, the LUT result is converted from srgb to linear and the alpha is always 1'''
+    image_pixels = numpy.ones((1, len(colors), 4), dtype=np_number_precision)
+    image_pixels[0, :, :3] = colors[:, :3]
+
+    # Find the XY coordinates of the LUT image needed to saturate each color
+    coord = image_pixels[:, :, :3] * coord_scale + coord_offset
+    coord_frac, coord_floor = numpy.modf(coord)
+    coord_bot = coord[:, :, :2] + coord_floor[:, :, 2:3] * texel_height_X0
+    coord_top = numpy.clip(coord_bot + texel_height_X0, 0, 1)
+
+    lutcol_bot = srgb_to_linear(bilinear_interpolation(lut_pixels, coord_bot))
+    lutcol_top = srgb_to_linear(bilinear_interpolation(lut_pixels, coord_top))
+    lut_colors = lutcol_bot * (1 - coord_frac[:, :, 2:3]) + lutcol_top * coord_frac[:, :, 2:3]
+    image_pixels[:, :, :3] = lut_colors[:, :, :3]
+    return image_pixels[0]
+
+
+def frac(value: numpy.ndarray) -> numpy.ndarray:
+    return value - numpy.floor(value)
+
+
+def map_values_main(x: numpy.ndarray, y: numpy.ndarray, z: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    '''mapvaluesmain function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPDiffuse.cginc
+    Takes the rgb channels of N colors and returns the rgb channels of the shading adjustment'''
+    t30 = numpy.where(y >= z, 1.0, 0.0)
+    t1x = t30 * (y - z) + z
+    t1y = t30 * (z - y) + y
+    t1z = t30 * -1.0 + 0.666666687
+    t1w = t30 * 1.0 + -1.0
+    t30 = numpy.where(x >= t1x, 1.0, 0.0)
+    t2x = (-t1x) + x
+    t2y = (-t1y) + t1y
+    t2z = (-t1z) + t1w
+    t2w = (-x) + t1x
+    t1x = t30 * t2x + t1x
+    t1y = t30 * t2y + t1y
+    t1z = t30 * t2z + t1z
+    t1w = t30 * t2w + x
+    t30 = numpy.minimum(t1y, t1w)
+    t30 = (-t30) + t1x
+    t2x = t30 * 6.0 + 1.00000001e-10
+    t11 = (-t1y) + t1w
+    t11 = t11 / t2x
+    t11 = t11 + t1z
+    t1x = t1x + 1.00000001e-10
+    t30 = t30 / t1x
+    t30 = t30 * 0.660000026
+    channels = []
+    for offset in (-0.0799999982, -0.413333356, 0.25333333):
+        t2 = frac(numpy.abs(t11) + offset)
+        t2 = (-t2) * 2.0 + 1.0
+        t2 = numpy.clip(numpy.abs(t2) * 3.0 + -1.0, 0, 1)
+        t2 = t2 + -1.0
+        channels.append(t30 * t2 + 1.0)
+    return tuple(channels)
+
+
+def shade_adjust_item(x: numpy.ndarray, y: numpy.ndarray, z: numpy.ndarray, shadow_x: numpy.ndarray, shadow_y: numpy.ndarray, shadow_z: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    '''shadeadjust function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/KKPItemDiffuse.cginc
+    Takes the rgb channels of N colors and their shadow colors and returns the rgb channels of the shading adjustment'''
+    t1x = y * shadow_y
+    t1y = z * shadow_z
+    t1w = x * shadow_x
+    t3x = y * shadow_y + (-t1y)
+    t3y = z * shadow_z + (-t1x)
+    t30 = numpy.where(t1x >= t1y, 1.0, 0.0)
+    t2x = t30 * t3x + t1y
+    t2y = t30 * t3y + t1x
+    t2z = t30 * 1.0 + -1.0
+    t2w = t30 * -1 + 0.666666687
+    t30 = numpy.where(t1w >= t2x, 1.0, 0.0)
+    t1x, t1y, t1z = t2x, t2y, t2w
+    t2x = (-t1x) + t1w
+    t2y = (-t1y) + t1y
+    t2z = (-t1z) + t2z
+    t2w = (-t1w) + t1x
+    t1x = t30 * t2x + t1x
+    t1y = t30 * t2y + t1y
+    t1z = t30 * t2z + t1z
+    t1w = t30 * t2w + t1w
+    t30 = numpy.minimum(t1y, t1w)
+    t30 = (-t30) + t1x
+    t2x = t30 * 6.0 + 1.00000001e-10
+    t11 = (-t1y) + t1w
+    t11 = t11 / t2x
+    t11 = t11 + t1z
+    t1x = t1x + 1.00000001e-10
+    t30 = t30 / t1x
+    t30 = t30 * 0.5
+    channels = []
+    for offset in (0.0, -0.333333343, 0.333333343):
+        t1 = frac(offset + numpy.abs(t11))
+        t1 = (-t1) * 2 + 1
+        t1 = numpy.clip(numpy.abs(t1) * 3 + (-1), 0, 1)
+        t1 = t1 + (-1)
+        channels.append(t30 * t1 + 1)
+    return tuple(channels)
+
+
+def apply_shading_adjustment(shading_adjustment: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]) -> numpy.ndarray:
+    '''The part of the skin and clothes shaders that turns the shading adjustment into the shadow multiplier. Returns an (N, 3) array'''
+    shading_adjustment = numpy.stack(shading_adjustment, axis=1)
+    diffuse_shaded = shading_adjustment * 0.899999976 - 0.5
+    diffuse_shaded = -diffuse_shaded * 2 + 1
+    comp_test = 0.555555582 < shading_adjustment
+    shading_adjustment = shading_adjustment * 1.79999995
+    diffuse_shaded = -diffuse_shaded * 0.7225 + 1 #invertfinalambient shadow is a constant 0.7225, so don't calc it
+    return numpy.clip(numpy.where(comp_test, diffuse_shaded, shading_adjustment), 0, 1)
+
+
+def clothes_dark_colors(colors: numpy.ndarray, shadow_colors: numpy.ndarray) -> numpy.ndarray:
+    '''Takes (N, 3 or 4) 1.0 max colors and their (N, 3 or 4) shadow colors and returns (N, 3) 1.0 max dark colors.
+    clothes is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/MainItemPlus.shader'''
+    colors = numpy.asarray(colors, dtype=numpy.float64)
+    shadow_colors = numpy.asarray(shadow_colors, dtype=numpy.float64)
+    shading_adjustment = apply_shading_adjustment(shade_adjust_item(colors[:, 0], colors[:, 1], colors[:, 2], shadow_colors[:, 0], shadow_colors[:, 1], shadow_colors[:, 2]))
+    # lightCol is constant [1.0656, 1.0656, 1.0656, 1] calculated from the custom ambient of [0.666, 0.666, 0.666, 1] and sun light color [0.666, 0.666, 0.666, 1]
+    return colors[:, :3] * shading_adjustment * 1.0656
+
+
+def skin_dark_colors(colors: numpy.ndarray) -> numpy.ndarray:
+    '''Takes (N, 3 or 4) 1.0 max colors and returns (N, 3) 1.0 max dark colors. skin is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPSkinFrag.cginc'''
+    colors = numpy.asarray(colors, dtype=numpy.float64)
+    shading_adjustment = apply_shading_adjustment(map_values_main(colors[:, 0], colors[:, 1], colors[:, 2]))
+    #result is slightly off but it looks consistently off so add a fudge factor
+    return colors[:, :3] * shading_adjustment * 1.0656 + numpy.array([0.02, 0.05, 0])
+
+
+# %% Dark textures
+# This is the clothes shader from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/MainItemPlus.shader
+# stripped down to the shadow portion, see clothes_dark_colors.
+# It works on one channel at a time in small blocks of pixels with preallocated buffers instead of building whole image temporaries.
+# Every step is the same float operation in the same order as the original kernel (kept in benchmarks/colorscience_benchmark.py),
+# including the float64 promotion the original got from multiplying by an int array, so the output is bit identical
+
+#pixels darkened at once. The scratch buffers take about 100 bytes per pixel
+DARK_BLOCK_PIXELS = 1 << 16
+#offsets of the hue of each channel in ShadeAdjustItem. The last one is for the alpha channel, which the original kernel darkened too
+DARK_HUE_OFFSETS = (0.0, -0.333333343, 0.333333343, 1.0)
+#float32 constants of the original kernel as the float64 values they were promoted to
+DARK_TWO_THIRDS = float(np_number_precision(0.666666687))
+DARK_AMBIENT = float(np_number_precision(1.0656))
+
+
+def create_dark_scratch(size: int = DARK_BLOCK_PIXELS) -> dict:
+    '''Allocates the buffers darken_pixels needs for a block of size pixels'''
+    return {
+        'float32': [numpy.empty(size, dtype=np_number_precision) for _ in range(4)],
+        'float64': [numpy.empty(size, dtype=numpy.float64) for _ in range(11)],
+        'mask': numpy.empty(size, dtype=bool),
+    }
+
+
+def __darken_block__(pixels: numpy.ndarray, shadow_color: numpy.ndarray, scratch: dict):
+    '''Darkens an (N, 4) block of pixels in place. N can't be larger than the scratch buffers'''
+    size = len(pixels)
+    red, green, blue, difference = (buffer[:size] for buffer in scratch['float32'])
+    green_first, red_first, x, y, z, w, red_wide, t30, t11, shade, shaded = (buffer[:size] for buffer in scratch['float64'])
+    mask = scratch['mask'][:size]
+
+    #ShadeAdjustItem, start at line 63. The color is multiplied by the shadow color in float32
+    numpy.multiply(pixels[:, 0], shadow_color[0], out=red)
+    numpy.multiply(pixels[:, 1], shadow_color[1], out=green)
+    numpy.multiply(pixels[:, 2], shadow_color[2], out=blue)
+    #t2 = t30 * t3 + t2 where t30 is 1 if green >= blue
+    numpy.greater_equal(green, blue, out=green_first)
+    numpy.subtract(green, blue, out=difference)
+    numpy.multiply(green_first, difference, out=x)
+    x += blue
+    numpy.subtract(blue, green, out=difference)
+    numpy.multiply(green_first, difference, out=y)
+    y += green
+    numpy.subtract(green_first, 1.0, out=z)
+    numpy.subtract(DARK_TWO_THIRDS, green_first, out=w)
+    #t1 = t30 * (t2 - t1) + t1 where t30 is 1 if red >= green
+    numpy.greater_equal(red, green, out=red_first)
+    red_wide[...] = red
+    numpy.subtract(red_wide, x, out=t30)
+    t30 *= red_first
+    t30 += x
+    numpy.subtract(x, red_wide, out=shade)
+    shade *= red_first
+    red_wide += shade
+    x[...] = t30
+    numpy.subtract(y, y, out=shade)
+    shade *= red_first
+    y += shade
+    z -= w
+    z *= red_first
+    z += w
+    #hue and saturation of the shaded color
+    numpy.minimum(y, red_wide, out=t30)
+    numpy.subtract(x, t30, out=t30)
+    numpy.multiply(t30, 6, out=shade)
+    shade += 1.00000001e-10
+    numpy.subtract(red_wide, y, out=t11)
+    t11 /= shade
+    t11 += z
+    numpy.absolute(t11, out=t11)
+    x += 1.00000001e-10
+    t30 /= x
+    t30 *= 0.5
+
+    for channel, offset in enumerate(DARK_HUE_OFFSETS):
+        numpy.add(t11, offset, out=shade) #90
+        numpy.floor(shade, out=shaded)
+        shade -= shaded
+        shade *= -2
+        shade += 1
+        numpy.absolute(shade, out=shade)
+        shade *= 3
+        shade -= 1
+        numpy.clip(shade, 0, 1, out=shade)
+        shade -= 1 #95
+        shade *= t30
+        shade += 1 #96
+
+        #skip to line 352
+        numpy.multiply(shade, 0.899999976, out=shaded)
+        shaded -= 0.5
+        shaded *= -2
+        shaded += 1
+        shaded *= -0.7225 #invertfinalambient shadow is a constant 0.7225, so don't calc it
+        shaded += 1
+        numpy.less(0.555555582, shade, out=mask)
+        shade *= 1.79999995
+        if channel < 3:
+            numpy.copyto(shade, shaded, where=mask)
+        numpy.clip(shade, 0, 1, out=shade) #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
+
+        # lightCol is constant [1.0656, 1.0656, 1.0656, 1] calculated from the custom ambient of [0.666, 0.666, 0.666, 1] and sun light color [0.666, 0.666, 0.666, 1],
+        # so ambientCol always results in lightCol after the max function
+        shade *= pixels[:, channel]
+        if channel < 3:
+            shade *= DARK_AMBIENT
+        pixels[:, channel] = shade
+
+
+def darken_pixels(slice_image: numpy.ndarray, shadow_color: dict, scratch: dict = None):
+    '''Turns a (rows, columns, 4) or (N, 4) array of maintex pixels into the pixels of the dark maintex in place,
+    using the shadow color dict of the material. Pass the same scratch buffers to every call from one thread to avoid allocating them again'''
+    pixels = slice_image.reshape(-1, 4)
+    shadow_color = numpy.asarray([shadow_color['r'], shadow_color['g'], shadow_color['b'], 1], dtype=np_number_precision)
+    if scratch is None:
+        scratch = create_dark_scratch(min(len(pixels), DARK_BLOCK_PIXELS))
+    block_pixels = len(scratch['mask'])
+    for start in range(0, len(pixels), block_pixels):
+        __darken_block__(pixels[start:start + block_pixels], shadow_color, scratch)
+
+
+def darken_saturated(slice_image: numpy.ndarray, dark_image: numpy.ndarray, shadow_color: dict, linear = False):
+    '''Fills the (rows, columns, 4) dark_image with the dark version of the saturated slice_image.
+    The saturated pixels are rounded to the 8 bit values Blender reads back from the saved _ST texture first,
+    so the result is the same as darkening the _ST texture after it was loaded'''
+    pngio.as_saved(slice_image, linear, out=dark_image)
+    darken_pixels(dark_image, shadow_color)
+
+
+# %% Process pool workers
+# Worker processes can't import the addon package because it imports bpy,
+# so they import this file as a top level module and only use the functions below
+
+#LUT arrays attached by this worker process. Maps 'strip', 'cube' or 'table' to (shared memory block, read only numpy view)
+worker_luts = {}
+
+
+def create_shared_array(shape: tuple, dtype) -> tuple[shared_memory.SharedMemory, numpy.ndarray]:
+    '''Creates a new shared memory block big enough for an array of this shape. Returns the block and a numpy view of it'''
+    block = shared_memory.SharedMemory(create=True, size=max(int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize, 1))
+    return block, numpy.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def share_array(array: numpy.ndarray) -> tuple[shared_memory.SharedMemory, numpy.ndarray]:
+    '''Copies the array into a new shared memory block. Returns the block and a numpy view of it'''
+    block, view = create_shared_array(array.shape, array.dtype)
+    view[...] = array
+    return block, view
+
+
+def attach_shared_array(name: str, shape: tuple, dtype) -> tuple[shared_memory.SharedMemory, numpy.ndarray]:
+    '''Attaches to a shared memory block created by another process. Returns the block and a numpy view of it'''
+    block = shared_memory.SharedMemory(name=name)
+    return block, numpy.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def init_saturation_worker(shared_luts: dict):
+    '''Process pool initializer. shared_luts maps 'strip', 'cube' or 'table' to the (block name, shape, dtype) of a LUT shared by the main process'''
+    for key, (name, shape, dtype) in shared_luts.items():
+        block, view = attach_shared_array(name, shape, dtype)
+        view.flags.writeable = False
+        worker_luts[key] = (block, view)
+
+
+def saturate_shared_rows(name: str, shape: tuple, start_row: int, end_row: int, is_8bit = True, dark_name: str = None, shadow_color: dict = None) -> tuple[int, int, int, int]:
+    '''Process pool task. Saturates rows start_row to end_row of the (height, width, 4) image stored in the shared memory block in place.
+    If dark_name is given, the same rows of the (height, width, 4) array in that block are filled with the dark version of the saturated rows.
+    Returns the process id, thread id and the perf_counter_ns start and end times so the main process can trace the batch'''
+    start = time.perf_counter_ns()
+    block, image_pixels = attach_shared_array(name, shape, np_number_precision)
+    dark_block = dark_pixels = None
+    try:
+        saturate_pixels(
+            image_pixels[start_row:end_row],
+            worker_luts['strip'][1],
+            worker_luts['cube'][1] if 'cube' in worker_luts else None,
+            worker_luts['table'][1] if 'table' in worker_luts else None,
+            is_8bit)
+        if dark_name:
+            dark_block, dark_pixels = attach_shared_array(dark_name, (shape[0], shape[1], 4), np_number_precision)
+            darken_saturated(image_pixels[start_row:end_row], dark_pixels[start_row:end_row], shadow_color, not is_8bit)
+    finally:
+        #the views have to be released before the blocks can be closed
+        del image_pixels, dark_pixels
+        block.close()
+        if dark_block:
+            dark_block.close()
+    return os.getpid(), threading.get_native_id(), start, time.perf_counter_ns()
+
+
+def darken_shared_rows(name: str, shape: tuple, start_row: int, end_row: int, shadow_color: dict) -> tuple[int, int, int, int]:
+    '''Process pool task. Turns rows start_row to end_row of the (height, width, 4) maintex stored in the shared memory block into the dark maintex in place.
+    Returns the process id, thread id and the perf_counter_ns start and end times so the main process can trace the batch'''
+    start = time.perf_counter_ns()
+    block, image_pixels = attach_shared_array(name, shape, np_number_precision)
+    try:
+        darken_pixels(image_pixels[start_row:end_row], shadow_color)
+    finally:
+        del image_pixels
+        block.close()
+    return os.getpid(), threading.get_native_id(), start, time.perf_counter_ns()
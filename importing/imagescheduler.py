@@ -0,0 +1,62 @@
+'''
+Decides how many images can be saturated at the same time.
+Each image is admitted by an estimate of how much memory it will use instead of a fixed image count,
+so a lot of small textures can be processed together while large ones wait for memory to be freed.
+This file does not use bpy so it can be imported anywhere.
+'''
+
+import threading
+from .pngio import read_png_header
+
+#bytes per pixel for the float32 RGBA copy of the image that is saturated
+FLOAT_PIXEL_BYTES = 16
+#the saturation engines make a few float32 temporaries for every row in a batch
+BATCH_SCRATCH_FACTOR = 4
+
+class ImageScheduler:
+    '''Admits images against a memory budget in bytes'''
+    def __init__(self, budget_mb: int, batch_rows: int):
+        self.budget = budget_mb * 1024 * 1024
+        self.batch_rows = batch_rows
+        self.in_use = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def estimate(self, width: int, height: int, bit_depth: int = 8, dark = False) -> int:
+        '''Estimates the peak bytes used while an image with this size is loaded, saturated and saved.
+        If dark is True, the dark version of the image is made and saved at the same time'''
+        pixels = width * height
+        #Blender keeps 8 bit images as bytes and 16 bit images as floats
+        blender_bytes = pixels * (4 if bit_depth <= 8 else FLOAT_PIXEL_BYTES)
+        #the float32 copy that is saturated, the temporary float array Blender makes when the pixels are read or written,
+        #and the buffer Blender makes when saving the image
+        output_bytes = pixels * FLOAT_PIXEL_BYTES * 2 + pixels * 4
+        scratch_bytes = min(height, self.batch_rows) * width * FLOAT_PIXEL_BYTES * BATCH_SCRATCH_FACTOR
+        #the float32 dark copy and the buffer for saving it
+        dark_bytes = pixels * (FLOAT_PIXEL_BYTES + 4) if dark else 0
+        return blender_bytes + output_bytes + scratch_bytes + dark_bytes
+
+    def estimate_file(self, path, dark = False) -> int:
+        '''Estimates the peak bytes for a PNG file by reading its header.
+        Files that can't be read are given the whole budget so they are processed alone'''
+        try:
+            width, height, bit_depth, channels = read_png_header(path)
+        except (OSError, ValueError):
+            return self.budget
+        return self.estimate(width, height, bit_depth, dark)
+
+    def try_admit(self, cost: int) -> bool:
+        '''Reserves cost bytes if they fit in the budget. An image is always admitted when nothing else is in flight,
+        so an image larger than the budget still gets processed on its own'''
+        with self.lock:
+            if self.in_flight and self.in_use + cost > self.budget:
+                return False
+            self.in_use += cost
+            self.in_flight += 1
+            return True
+
+    def release(self, cost: int):
+        '''Frees the bytes reserved by try_admit'''
+        with self.lock:
+            self.in_use -= cost
+            self.in_flight -= 1
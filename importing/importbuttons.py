@@ -8,7 +8,7 @@ This file performs the following operations
 .   Invokes the other import operations based on what options were chosen on the panel
 '''
 
-import bpy, os, datetime
+import bpy, os
 
 from ..interface.dictionary_en import t
 from .. import common as c
@@ -22,6 +22,7 @@ class kkbp_import(bpy.types.Operator):
     filepath : bpy.props.StringProperty(maxlen=1024, default='', options={'HIDDEN'})
     filter_glob : bpy.props.StringProperty(default='*.pmx', options={'HIDDEN'})
     
+    @c.traced('kkbp_import')
     def execute(self, context):
         #do this thing because cats does it
         if hasattr(bpy.context.scene, 'layers'):
@@ -49,7 +50,8 @@ class kkbp_import(bpy.types.Operator):
         #delete the cached files if the option is enabled
         if bpy.context.scene.kkbp.delete_cache and c.get_import_path():
             c.kklog('Clearing the cache folder...')
-            for cache_folder in ['atlas_files', 'baked_files', 'dark_files', 'saturated_files']:
+            c.json_file_manager.clear_cache()
+            for cache_folder in ['atlas_files', 'baked_files', 'dark_files', 'saturated_files', 'traces']:
                 try:
                     for f in os.listdir(os.path.join(c.get_import_path(), cache_folder)):
                         try:
@@ -110,13 +112,15 @@ class kkbp_import(bpy.types.Operator):
             function()
         c.toggle_console()
         bpy.context.scene.kkbp.plugin_state = 'imported'
-        c.kklog('KKBP import finished in {} minutes'.format(round(((datetime.datetime.now().minute * 60 + datetime.datetime.now().second + datetime.datetime.now().microsecond / 1e6) - bpy.context.scene.kkbp.total_timer) / 60, 2)))
+        c.kklog('KKBP import finished in {} minutes'.format(round(c.tracer.elapsed() / 60, 2)))
+        c.kkbp_logger.flush()
         return {'FINISHED'}
         
     def invoke(self, context, event):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
 
+    @c.traced('import_pmx_models')
     def import_pmx_models(self):
         c.kklog('Importing pmx files with mmdtools...')
         
@@ -155,6 +159,8 @@ class kkbp_import(bpy.types.Operator):
                     bpy.context.view_layer.objects.active.children[0].children[0]['body'] = True
                     bpy.context.view_layer.objects.active.children[0].name = 'Armature ' + c.get_name()
                     bpy.context.view_layer.objects.active.children[0]['armature'] = True
+                c.object_registry.add(bpy.context.view_layer.objects.active.children[0])
+                c.object_registry.add(bpy.context.view_layer.objects.active.children[0].children[0])
                 #get rid of the text files the mmd tools addon generates
                 if bpy.data.texts.get('Model'):
                     bpy.data.texts.remove(bpy.data.texts['Model'])
@@ -51,6 +51,7 @@ class modify_armature(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.traced('modify_armature')
     def execute(self, context):
         try:
             
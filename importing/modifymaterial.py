@@ -20,9 +20,15 @@
 # Dark color conversion code taken from Xukmi https://github.com/xukmi/KKShadersPlus/tree/main/Shaders
 
 
-import bpy, os, numpy, math, time, concurrent.futures, threading, queue
+import bpy, os, sys, numpy, math, time, importlib, contextlib, multiprocessing, concurrent.futures, threading, queue, collections
 from pathlib import Path
 from .. import common as c
+from . import colorscience
+from .texturecache import texture_cache
+from .texturestore import texture_store
+from .pixelbuffer import pixel_buffers, read_pixels, write_pixels
+from .imagescheduler import ImageScheduler
+from . import pngio
 
 class modify_material(bpy.types.Operator):
     bl_idname = "kkbp.modifymaterial"
@@ -40,12 +46,18 @@ class modify_material(bpy.types.Operator):
     kkbp_package_name = __package__[:__package__.rindex('.')]
     max_thread_num = bpy.context.preferences.addons[kkbp_package_name].preferences.max_thread_num
 
+    # A saturates images on a pool of threads.
+    # B saturates images on a pool of processes. The images and the LUT are placed in shared memory so nothing is copied to the workers.
+    # Processes don't fight over python's GIL, so this scales better on CPUs with a lot of cores
+    saturation_backend = bpy.context.preferences.addons[kkbp_package_name].preferences.saturation_backend
+
     # this is related to memory usage.
-    # Actually it's not perfect because the size of each image varies.
-    # If loading four 4096 * 4096, the peak memory usage could reach 16000MB.
+    # Images are loaded only while the estimated memory of every image in processing fits in this budget (in MB).
+    # The estimate is made from the PNG header before the image is loaded, so a lot of small images can be processed at once
+    # while a 4096 * 4096 image has to wait for memory to be freed.
     # If the user doesn't have this much available memory, the program will crash.
     # In that case, the user should lower the value
-    max_image_num = bpy.context.preferences.addons[kkbp_package_name].preferences.max_image_num
+    image_memory_budget = bpy.context.preferences.addons[kkbp_package_name].preferences.image_memory_budget
 
     # this is related to cpu and memory usage.
     # This is the number of rows of pixels to process in one batch (images are saturated in batches).
@@ -53,15 +65,48 @@ class modify_material(bpy.types.Operator):
     # For a 1024 * 1024, a batch is 512 * 1024.But for 2048 * 2048, a batch is 512 * 2048
     batch_rows = bpy.context.preferences.addons[kkbp_package_name].preferences.batch_rows
 
+    # A uses the LUT strip directly (two bilinear lookups per pixel)
+    # B uses a LUT cube built from the strip and cached in the lut_cache folder (one trilinear lookup per pixel). It's off by up to about 3/255, so it's opt in
+    # C uses a table of every 8 bit color built from the strip and memory mapped from the lut_cache folder (one gather per pixel). This is the default
+    saturation_engine = bpy.context.preferences.addons[kkbp_package_name].preferences.saturation_engine
+    lut_cache_dir = os.path.join(os.path.dirname(__file__), 'lut_cache')
+
+    # Saturated and dark textures are cached by content in this folder so they can be shared by every character.
+    # The oldest textures are deleted when the folder grows larger than texture_cache_size (in MB)
+    use_texture_cache = bpy.context.preferences.addons[kkbp_package_name].preferences.use_texture_cache
+    texture_cache_dir = bpy.context.preferences.addons[kkbp_package_name].preferences.texture_cache_dir
+    texture_cache_size = bpy.context.preferences.addons[kkbp_package_name].preferences.texture_cache_size
+
+    # A packs the textures into the .blend file when it's saved.
+    # B keeps the textures outside of the .blend file in the texture store, see texturestore.py
+    texture_storage = bpy.context.preferences.addons[kkbp_package_name].preferences.texture_storage
+
     # constants for later
     lut_pixels = None
-    coord_scale = None
-    coord_offset = None
-    texel_height_X0 = None
-    # used to protect the data_queue
+    lut_cube = None
+    lut_table = None
+    lut_digest = ''
+    # used to protect the remaining batch count of each image
     queue_lock = threading.Lock()
+    # the workers send ('saturated', image index) and ('saved', image index) events to the main loop through this queue
     data_queue = queue.Queue()
-
+    # ids of the dark maintex images load_images saved next to the saturated images, and the shadow color they were made with
+    fused_dark_textures = {}
+    # every png in the import folder by file name. get_image loads them from here the first time a material uses them
+    texture_files = {}
+    # file name: file name of the first texture with the same contents. get_image loads the first texture instead
+    texture_aliases = {}
+    # hash of a file: name of the image get_image loaded from it
+    loaded_textures = {}
+    # names of the dark images create_dark_textures made or loaded
+    dark_textures = set()
+    # (pool, worker module, shared memory blocks holding the LUTs) of saturation backend B.
+    # load_images and create_dark_textures share it, so the workers are only spawned once per import. execute shuts it down
+    process_pool = None
+    # these folders don't hold textures that are linked by name. The dark textures are loaded by load_darktex
+    skipped_texture_folders = ('dark_files', 'baked_files', 'atlas_files')
+
+    @c.traced('modify_material')
     def execute(self, context):
         try:
 
@@ -93,19 +138,32 @@ class modify_material(bpy.types.Operator):
             self.set_color_management()
 
             c.clean_orphaned_data()
+            self.store_textures()
             return {'FINISHED'}
         except Exception as error:
             c.handle_error(self, error)
             return {"CANCELLED"}
+        finally:
+            self.close_process_pool()
 
     def init_prefab_data(self):
         '''Initialize constants for saturating textures'''
-        modify_material.lut_pixels = numpy.array(bpy.data.images['Lut_TimeDay.png'].pixels[:],dtype=modify_material.np_number_precision).reshape(bpy.data.images['Lut_TimeDay.png'].size[1], bpy.data.images['Lut_TimeDay.png'].size[0], 4)
-        #constants to ensure bot and top are within the 32 x 1024 dimensions of the lut
-        modify_material.coord_scale = numpy.array([0.0302734375, 0.96875, 31.0],dtype=modify_material.np_number_precision)
-        modify_material.coord_offset = numpy.array([0.5 / 1024, 0.5 / 32, 0.0], dtype=modify_material.np_number_precision)
-        modify_material.texel_height_X0 = numpy.array([1 / 32, 0], dtype=modify_material.np_number_precision)
-        pass
+        modify_material.lut_pixels = read_pixels(bpy.data.images['Lut_TimeDay.png'])
+        modify_material.lut_digest = colorscience.lut_digest(modify_material.lut_pixels)
+        modify_material.lut_cube = None
+        modify_material.lut_table = None
+        if modify_material.saturation_engine == 'B':
+            modify_material.lut_cube = colorscience.load_lut_cube(modify_material.lut_pixels, modify_material.lut_cache_dir)
+        elif modify_material.saturation_engine == 'C':
+            c.kklog('Loading the 24 bit LUT table. This can take a while the first time...')
+            modify_material.lut_table = colorscience.load_lut_table(modify_material.lut_pixels, modify_material.lut_cache_dir)
+
+        if modify_material.use_texture_cache:
+            cache_dir = bpy.path.abspath(modify_material.texture_cache_dir) if modify_material.texture_cache_dir else bpy.utils.user_resource('DATAFILES', path='kkbp_texture_cache')
+            texture_cache.open(cache_dir, modify_material.texture_cache_size)
+            if bpy.context.scene.kkbp.delete_cache:
+                c.kklog('Clearing the texture cache...')
+                texture_cache.clear()
 
     # %% Main functions            
     def remove_unused_material_slots(self):
@@ -219,6 +277,7 @@ class modify_material(bpy.types.Operator):
                     template['id'] = original_material
                     template['bake'] = True
                     template.name = bpy.data.materials[template_name].name + ' ' + c_name
+                    c.material_registry.add(template, 'body')
                     c.get_body().material_slots[original_material].material = template
                     template_group = template.node_tree.nodes['textures'].node_tree.copy()
                     template_group.name = 'Tex ' + original_material + ' ' + c_name
@@ -266,6 +325,7 @@ class modify_material(bpy.types.Operator):
                 else:
                     template['id'] = original_name
                 template.name = 'KK ' + original_name + ' ' + c_name
+                c.material_registry.add(template, 'hair')
                 material_slot.material = bpy.data.materials[template.name]
 
                 template_group = template.node_tree.nodes['textures'].node_tree.copy()
@@ -301,6 +361,7 @@ class modify_material(bpy.types.Operator):
                 else:
                     template['id'] = original_name
                 template.name = 'KK ' + original_name + ' ' + c_name
+                c.material_registry.add(template, 'outfit')
                 material_slot.material = bpy.data.materials[template.name]
 
                 template_group = template.node_tree.nodes['textures'].node_tree.copy()
@@ -396,6 +457,7 @@ class modify_material(bpy.types.Operator):
                         eliminate(node)
         c.print_timer('remove_duplicate_node_groups')
 
+    @c.track_numpy_memory('load_images')
     def load_images(self):
         c.switch(c.get_body(), 'object')
 
@@ -406,51 +468,152 @@ class modify_material(bpy.types.Operator):
 
         fileList = Path(bpy.context.scene.kkbp.import_dir).rglob('*.png')
         files = [file for file in fileList if file.is_file() and "_MT" in file.name]
-        unloaded = unprocessed = len(files) # unloaded: unloaded images to saturate, unprocessed: unfinished images that still need to be saturated
-        last_miss_time = time.time()  # last time of accessing queue
-        current_image_num = 0  # current num of concurrent processing images
+        # the dark version of each maintex is made from the saturated pixels in the same batches, so the saturated image doesn't have to be loaded again for it
+        dark_colors = self.get_dark_texture_colors()
+        self.fused_dark_textures = {}
+        # textures with the same contents are only saturated once. Files with the same bytes are found before anything is loaded.
+        # If the texture cache is on, files with different bytes but the same pixels are also found with the cache key once their pixels are loaded
+        modify_material.texture_aliases = {}
+        originals = {}
+        unique_files = [file for file in files if not self.is_duplicate(file.name.replace('_MT', '_ST'), texture_store.file_digest(str(file)), self.get_texture_shadow(file, dark_colors), originals)]
+        if len(unique_files) < len(files):
+            c.kklog('Found {} textures that are copies of other textures. They will only be saturated once'.format(len(files) - len(unique_files)))
+        files = unique_files
+        unloaded = unprocessed = len(files) # unloaded: unloaded images to saturate, unprocessed: unfinished images that still need to be saturated and saved
+        darks = [self.get_dark_texture(file, dark_colors) for file in files]
+        scheduler = ImageScheduler(self.image_memory_budget, self.batch_rows)
+        costs = [scheduler.estimate_file(file, dark is not None) for file, dark in zip(files, darks)]  # estimated memory of each image, read from the PNG headers
         futures = []
         record = {}  # as each image is separated to several batches, this is to record each image's base info
+        self.data_queue = queue.Queue()  # start with an empty queue in case a previous import failed halfway
+
+        use_processes = self.saturation_backend == 'B'
+        if use_processes:
+            # the pool stays open for create_dark_textures, so leaving the with block below doesn't shut it down
+            executor, worker, _ = self.open_process_pool()
+            pool_context = contextlib.nullcontext()
+        else:
+            executor = pool_context = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num)
+        # finished images are encoded to PNG on their own threads so the main thread can keep loading images
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(4, self.max_thread_num // 2)))
+        write_png = c.traced('write_png')(pngio.write_png)
+
+        def save_textures(save_path, image_pixels, is_float, dark):
+            '''Runs on a writer thread. Saves the saturated image and its dark version if it has one'''
+            write_png(save_path, image_pixels, is_float)
+            if dark:
+                os.makedirs(os.path.dirname(dark[3]), exist_ok=True)
+                write_png(dark[3], dark[0])
+
+        def batch_done(future, index):
+            '''Runs on the thread that finished the batch. Lets the main loop know when every batch of an image is done'''
+            failed = future.cancelled() or future.exception() is not None
+            if use_processes and not failed:
+                pid, tid, start, end = future.result()
+                c.tracer.add_span('saturate_rows', start, end, pid, tid, 'saturation worker {}'.format(pid))
+            with self.queue_lock:
+                if failed and not record[index][9]:
+                    record[index][9] = 'cancelled' if future.cancelled() else str(future.exception())
+                record[index][0] -= 1
+                if record[index][0] == 0:
+                    self.data_queue.put(('saturated', index))
+
+        def saved(future, index):
+            '''Runs on the writer thread that saved the image. Records the error if saving failed and lets the main loop know'''
+            if future.exception() is not None:
+                record[index][9] = str(future.exception())
+            self.data_queue.put(('saved', index))
+
+        def release_record(index):
+            '''Drops every reference to the pixels of a finished image so the memory (or shared memory block) can be reused'''
+            result = record.pop(index)
+            if (block := result[5]):
+                result[3] = None
+                block.close()
+                block.unlink()
+            else:
+                pixel_buffers.release(result[3])
+                result[3] = None
+            if (dark := result[8]):
+                if (dark_block := dark[1]):
+                    dark[0] = None
+                    dark_block.close()
+                    dark_block.unlink()
+                else:
+                    pixel_buffers.release(dark[0])
+                    dark[0] = None
+            scheduler.release(result[7])
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num) as executor:
+        with pool_context, writer:
             # the to-output data occupies a lot of memory, so we should save them timely before loading more images
-            while unloaded > 0 or unprocessed > 0:
-                if (current_time := time.time()) - last_miss_time > 0.3:  # accessing queue every 0.3s, because queue is empty most of the time, so is no need to access it every loop
-                    with self.queue_lock:
-                        try:
-                            while True: # fetching all data from queue if not empty
-                                result = self.data_queue.get(timeout=0.1)
-                                (result := record[result])[0] -= 1  # data in tuple: (current_image's batch num, name that the image to be saved with, image, image_data in numpy array, start time to process this image)
-                                # record[result][0] -= 1
-                                if result[0] == 0:
-                                    image = result[2]
-                                    image_pixels = result[3]
-                                    image.pixels.foreach_set(image_pixels.ravel())
-                                    image.save_render(os.path.join(bpy.context.scene.kkbp.import_dir, "saturated_files", result[1]))
-
-                                    del image_pixels
-                                    unprocessed -= 1
-                                    current_image_num -= 1
-                                    c.kklog(f'Saturating image {result[1]} takes {round(time.time() - result[4], 1)}s')
-                        except queue.Empty:
-                            last_miss_time = current_time
-                # if there has unloaded images and current num of image in processing is smaller than the max value, then load a image and submit it.This prevent loading too many images, which pushes memory usage to a high level
-                if unloaded > 0 and current_image_num < self.max_image_num:
+            while unprocessed > 0:
+                # while there are unloaded images and the next image fits in the memory budget, load a image and submit it. This prevents loading too many images, which pushes memory usage to a high level
+                while unloaded > 0 and scheduler.try_admit(costs[unloaded - 1]):
                     unloaded -= 1
-                    # skip this file if it has already been converted
-                    if os.path.isfile(os.path.join(bpy.context.scene.kkbp.import_dir, 'saturated_files', (save_file_name := files[unloaded].name.replace('_MT', '_ST')))):
-                        c.kklog('File already saturated. Skipping {}'.format(files[unloaded].name))
+                    save_file_name = files[unloaded].name.replace('_MT', '_ST')
+                    save_path = os.path.join(bpy.context.scene.kkbp.import_dir, 'saturated_files', save_file_name)
+                    # skip this file if it has already been converted. The texture cache checks the pixels instead of the name
+                    if not self.use_texture_cache and os.path.isfile(save_path):
+                        c.kklog('File already saturated. Skipping {}'.format(files[unloaded].name), 'debug')
                         unprocessed -= 1
+                        scheduler.release(costs[unloaded])
                         continue
 
-                    current_image_num += 1
                     # Load image
                     start_time = time.time()
                     image = bpy.data.images.load(str(files[unloaded]))
-
-                    # Submit task
                     width, height = image.size
-                    image_pixels = numpy.array(image.pixels[:], dtype=modify_material.np_number_precision).reshape(height, width, 4)
+                    is_float = image.is_float
+                    if use_processes:
+                        block, image_pixels = worker.create_shared_array((height, width, image.channels), modify_material.np_number_precision)
+                        read_pixels(image, out = image_pixels)
+                    else:
+                        block = None
+                        image_pixels = read_pixels(image, pool = pixel_buffers)
+                    # the pixels are saved straight from the numpy array, so Blender's copy of the image isn't needed anymore
+                    bpy.data.images.remove(image)
+
+                    # skip the image if an image with the same pixels was already loaded.
+                    # Otherwise reuse the saturated version of these exact pixels if it was made before, even if it was for a different character.
+                    # Hashing every pixel takes a while, so it's only done if the texture cache needs the key anyway
+                    dark = darks[unloaded]
+                    cache_key = None
+                    skip = False
+                    if self.use_texture_cache:
+                        cache_key = texture_cache.make_key('saturated', colorscience.SATURATION_VERSION, image_pixels, self.lut_digest, self.saturation_engine, is_float)
+                        if (skip := self.is_duplicate(save_file_name, cache_key, self.get_texture_shadow(files[unloaded], dark_colors), originals)):
+                            c.kklog('Skipping {}, it has the same pixels as {}'.format(save_file_name, self.texture_aliases.get(save_file_name)), 'debug')
+                        elif (skip := texture_cache.get(cache_key, save_path)):
+                            c.kklog('Loaded saturated image from the texture cache: {}'.format(files[unloaded].name), 'debug')
+                            # the dark version is cached with a key made from the saturated key. If it's missing, create_dark_textures makes it
+                            if dark and texture_cache.get(texture_cache.make_key('dark', colorscience.DARK_VERSION, cache_key, dark[2]), dark[1]):
+                                self.fused_dark_textures[dark[0]] = dark[2]
+                    if skip:
+                        if block:
+                            del image_pixels
+                            block.close()
+                            block.unlink()
+                        else:
+                            pixel_buffers.release(image_pixels)
+                            del image_pixels
+                        unprocessed -= 1
+                        scheduler.release(costs[unloaded])
+                        continue
+
+                    # the dark pixels are always RGBA, like the saturated image Blender would load from the saved PNG
+                    # data in list: (dark pixels in numpy array, shared memory block or None, texture id, file path to save to, texture cache key or None)
+                    dark_pixels = None
+                    if dark:
+                        if use_processes:
+                            dark_block, dark_pixels = worker.create_shared_array((height, width, 4), modify_material.np_number_precision)
+                        else:
+                            dark_block, dark_pixels = None, pixel_buffers.acquire(width * height * 4).reshape(height, width, 4)
+                        dark_key = texture_cache.make_key('dark', colorscience.DARK_VERSION, cache_key, dark[2]) if cache_key else None
+                        dark = [dark_pixels, dark_block, dark[0], dark[1], dark_key]
+
+                    # data in list: (current_image's remaining batch num, name that the image to be saved with, image is float, image_data in numpy array, start time to process this image, shared memory block or None, texture cache key or None, estimated memory, dark data or None, error of the first failed batch or None, futures of the batches and the writer)
+                    # it has to exist before the first batch is submitted, because the batch can finish right away
+                    record[unloaded] = [math.ceil(height / self.batch_rows), save_file_name, is_float, image_pixels, start_time, block, cache_key, costs[unloaded], dark, None, []]
 
                     # separating an image to several batches to make full use of CPU
                     start_row = 0
@@ -459,29 +622,72 @@ class modify_material(bpy.types.Operator):
                         if end_row > height:
                             end_row = height
 
-                        future = executor.submit(
-                            self.saturate_texture,
-                            unloaded,
-                            image_pixels[start_row:end_row - 1]
-                        )
+                        if use_processes:
+                            future = executor.submit(
+                                worker.saturate_shared_rows,
+                                block.name,
+                                image_pixels.shape,
+                                start_row,
+                                end_row,
+                                not is_float,
+                                dark[1].name if dark else None,
+                                darks[unloaded][2] if dark else None
+                            )
+                        else:
+                            future = executor.submit(
+                                self.saturate_texture,
+                                image_pixels[start_row:end_row],
+                                not is_float,
+                                dark_pixels[start_row:end_row] if dark else None,
+                                darks[unloaded][2] if dark else None
+                            )
+                        # let the main loop know when the image is done, even if this batch failed. A failed image is never saved
+                        future.add_done_callback(lambda future, index = unloaded: batch_done(future, index))
                         start_row = end_row
 
                         futures.append(future)
+                        record[unloaded][10].append(future)
+                    del image_pixels, dark_pixels
 
-                    record[unloaded] = [math.ceil(height / self.batch_rows), save_file_name, image, image_pixels, start_time]
-
-
-            bpy.data.use_autopack = True  # enable autopack on file save
+                if unprocessed == 0:
+                    break
 
-            # Load all textures
-            fileList = Path(bpy.context.scene.kkbp.import_dir).rglob('*.png')
-            files = [file for file in fileList if file.is_file()]
-            for image_file in files:
-                bpy.ops.image.open(filepath=str(image_file), use_udim_detecting=False)
-                try:
-                    bpy.data.images[image_file.name].pack()
-                except:
-                    c.kklog('This image was not automatically loaded in because its filename exceeds 64 characters: ' + image_file.name, type = 'error')
+                # sleep until a worker finishes saturating or saving an image
+                event, index = self.data_queue.get()
+                result = record[index]
+                if event == 'saturated' and result[9]:
+                    # the pixels are only partly saturated, so they are neither saved nor put in the texture cache where every later import would reuse them
+                    c.kklog('Failed to saturate {}: {}'.format(result[1], result[9]), 'error')
+                    release_record(index)
+                    unprocessed -= 1
+                elif event == 'saturated':
+                    save_path = os.path.join(bpy.context.scene.kkbp.import_dir, 'saturated_files', result[1])
+                    future = writer.submit(save_textures, save_path, result[3], result[2], result[8])
+                    result[10].append(future)
+                    future.add_done_callback(lambda future, index = index: saved(future, index))
+                    futures.append(future)
+                elif result[9]:
+                    # write_png replaces the file only once it's complete, but the dark version may be missing, so nothing is cached or recorded
+                    c.kklog('Failed to save {}: {}'.format(result[1], result[9]), 'error')
+                    release_record(index)
+                    unprocessed -= 1
+                else:
+                    save_path = os.path.join(bpy.context.scene.kkbp.import_dir, 'saturated_files', result[1])
+                    if result[6] and os.path.isfile(save_path):
+                        texture_cache.put(result[6], save_path, result[10], result[1])
+                    if (dark := result[8]) and os.path.isfile(dark[3]):
+                        self.fused_dark_textures[dark[2]] = darks[index][2]
+                        if dark[4]:
+                            texture_cache.put(dark[4], dark[3], result[10], os.path.basename(dark[3]))
+                    release_record(index)
+                    unprocessed -= 1
+                    c.kklog(f'Saturating image {result[1]} takes {round(time.time() - result[4], 1)}s', 'debug')
+
+            # pack the textures the character uses when the file is saved, or leave them for store_textures
+            bpy.data.use_autopack = self.texture_storage == 'A'
+
+            # find every texture, but only load the ones link_textures_for_* puts into a material
+            self.index_textures()
 
             # Monitor completion
             for future in concurrent.futures.as_completed(futures):
@@ -490,33 +696,140 @@ class modify_material(bpy.types.Operator):
                 except Exception as e:
                     c.kklog(f'Processing failed: {str(e)}')
 
+        pixel_buffers.clear()
         c.print_timer('load_images')
 
-    def saturate_texture(self, index, slice_image):
-        '''The Secret Sauce. Accepts a bpy image and saturates it to match the in-game look.'''
-        # Find the XY coordinates of the LUT image needed to saturate each pixel
-        coord = slice_image[:, :, :3] * self.coord_scale + self.coord_offset
-        coord_frac, coord_floor = numpy.modf(coord)
-        coord_frac_z = coord_frac[:, :, 2:3]
-        del coord_frac  # free temporary variables after they're used
-        coord_bot = coord[:, :, :2] + coord_floor[:, :, 2:3] * self.texel_height_X0
-        del coord
-        del coord_floor
-
-        #use those XY coordinates to find the saturated version of the color from the LUT image
-        lutcol_bot = self.__bilinear_interpolation__(self.lut_pixels, coord_bot)
-
-        lut_colors = lutcol_bot * (1 - coord_frac_z)
-        del lutcol_bot
-        coord_top = numpy.clip(coord_bot + self.texel_height_X0, 0, 1)
-        lutcol_top = self.__bilinear_interpolation__(self.lut_pixels, coord_top)
-        lut_colors += lutcol_top * coord_frac_z
-        del lutcol_top
-        del coord_top
-        slice_image[:, :, :3] = lut_colors[:,:,:3]
-
-        with self.queue_lock:
-            self.data_queue.put(index)
+    def open_process_pool(self) -> tuple[concurrent.futures.ProcessPoolExecutor, object, list]:
+        '''Returns the process pool of this import, worker module and LUT blocks, and creates them the first time'''
+        if self.process_pool is None:
+            self.process_pool = self.create_process_pool()
+        return self.process_pool
+
+    def close_process_pool(self):
+        '''Shuts down the process pool of this import if one was created and frees the LUTs it shared'''
+        if self.process_pool is None:
+            return
+        executor, _, lut_blocks = self.process_pool
+        self.process_pool = None
+        executor.shutdown()
+        for block in lut_blocks:
+            block.close()
+            block.unlink()
+
+    def create_process_pool(self):
+        '''Creates the process pool used to saturate and darken images and shares the LUTs with it.
+        Returns the pool, the worker module and the shared memory blocks holding the LUTs'''
+        # The workers import colorscience as a top level module, so the folder needs to be on the path.
+        # The path is copied to the workers when they start
+        file_dir = os.path.dirname(os.path.abspath(__file__))
+        if file_dir not in sys.path:
+            sys.path.append(file_dir)
+        worker = importlib.import_module('colorscience')
+
+        shared_luts = {}
+        blocks = []
+        for key, lut in (('strip', self.lut_pixels), ('cube', self.lut_cube), ('table', self.lut_table)):
+            if lut is not None:
+                block, view = worker.share_array(lut)
+                shared_luts[key] = (block.name, view.shape, view.dtype.str)
+                blocks.append(block)
+                del view
+
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_thread_num,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=worker.init_saturation_worker,
+            initargs=(shared_luts,))
+        return executor, worker, blocks
+
+    @c.traced('saturate_rows')
+    def saturate_texture(self, slice_image, is_8bit = True, dark_slice = None, shadow_color: dict = None):
+        '''The Secret Sauce. Accepts a slice of an image and saturates it to match the in-game look.
+        If dark_slice is given, it is filled with the dark version of the saturated slice'''
+        colorscience.saturate_pixels(slice_image, self.lut_pixels, self.lut_cube, self.lut_table, is_8bit)
+        if dark_slice is not None:
+            colorscience.darken_saturated(slice_image, dark_slice, shadow_color, not is_8bit)
+
+    def get_dark_texture_colors(self) -> dict[str, dict]:
+        '''Returns the shadow color of every material id that gets a dark maintex in create_dark_textures'''
+        #the tongue uses its color mask as the maintex on purpose, so it never gets a dark maintex
+        tongue = set(c.get_material_names('o_tang'))
+        dark_colors = {}
+        for material in c.get_body_materials() + c.get_hair_materials() + c.get_outfit_materials():
+            if material.node_tree.nodes.get('textures') and material.node_tree.nodes['textures'].node_tree.nodes.get('_ST_DT.png'):
+                if material.get('id') and material['id'] not in tongue:
+                    dark_colors[material['id']] = c.json_file_manager.get_shadow_color(material.name)
+        return dark_colors
+
+    @staticmethod
+    def get_texture_shadow(file: Path, dark_colors: dict) -> dict:
+        '''Returns the shadow color of the dark maintex made from this _MT file, or None if it doesn't get one'''
+        return dark_colors.get(file.name[:-len('_MT_CT.png')]) if file.name.endswith('_MT_CT.png') else None
+
+    def is_duplicate(self, name: str, digest: str, shadow_color: dict, originals: dict) -> bool:
+        '''Returns True and makes get_image load the original texture instead of name if a texture with the same digest was seen before.
+        Otherwise records name as the original texture for digest. A texture that gets a dark version
+        can only be a copy of a texture with the same shadow color, because the dark version is shared too'''
+        original = originals.get((digest, repr(shadow_color))) if shadow_color else originals.get(digest)
+        if original is None:
+            originals.setdefault(digest, name)
+            originals[(digest, repr(shadow_color))] = name
+            return False
+        if original != name:
+            modify_material.texture_aliases[name] = original
+        return True
+
+    def get_dark_texture(self, file: Path, dark_colors: dict) -> tuple[str, str, dict]:
+        '''Returns the (texture id, file path, shadow color) of the dark maintex made from this _MT file,
+        or None if it doesn't get one or the dark maintex already exists'''
+        if not file.name.endswith('_MT_CT.png') or (texture_id := file.name[:-len('_MT_CT.png')]) not in dark_colors:
+            return None
+        dark_path = os.path.join(bpy.context.scene.kkbp.import_dir, 'dark_files', texture_id + '_ST_DT.png')
+        if not self.use_texture_cache and os.path.isfile(dark_path):
+            return None
+        return texture_id, dark_path, dark_colors[texture_id]
+
+    def index_textures(self):
+        '''Finds every png in the import folder by file name without loading it'''
+        import_dir = Path(bpy.context.scene.kkbp.import_dir)
+        modify_material.texture_files = {}
+        modify_material.loaded_textures = {}
+        for file in import_dir.rglob('*.png'):
+            if file.is_file() and not any(folder in self.skipped_texture_folders for folder in file.relative_to(import_dir).parts[:-1]):
+                #if two files have the same name, blender used to give the name to the first one it loaded
+                modify_material.texture_files.setdefault(file.name, file)
+        c.kklog('Found {} textures in the import folder'.format(len(modify_material.texture_files)), 'debug')
+
+    def get_image(self, image_name: str) -> bpy.types.Image:
+        '''Returns the image with this file name. It's loaded from the import folder the first time it's used.
+        Textures with the same contents are loaded as one image. Returns None if there is no such image'''
+        image_name = self.texture_aliases.get(image_name, image_name)
+        if image := bpy.data.images.get(image_name):
+            return image
+        if not (file := self.texture_files.get(image_name)):
+            return None
+        digest = texture_store.file_digest(str(file))
+        if (original := self.loaded_textures.get(digest)) and (image := bpy.data.images.get(original)):
+            modify_material.texture_aliases[image_name] = original
+            return image
+        #check_existing returns the image that was already loaded from this file, even if it was renamed. Only an image made here can be removed
+        image_count = len(bpy.data.images)
+        image = bpy.data.images.load(str(file), check_existing=True)
+        if image.name != image_name and len(bpy.data.images) > image_count:
+            if len(image_name.encode()) > 63:
+                c.kklog('This image was not automatically loaded in because its filename exceeds 64 characters: ' + image_name, type = 'error')
+            else:
+                c.kklog('This image was not automatically loaded in because Blender named it {} instead: {}'.format(image.name, image_name), type = 'error')
+            bpy.data.images.remove(image)
+            return None
+        modify_material.loaded_textures[digest] = image.name
+        return image
+
+    @staticmethod
+    @c.traced('darken_rows')
+    def darken_texture(slice_image, shadow_color: dict):
+        '''Accepts a slice of a maintex and turns it into the same slice of the dark maintex'''
+        colorscience.darken_pixels(slice_image, shadow_color)
 
     def link_textures_for_face_body(self):
         '''Load all body textures into their texture slots'''
@@ -540,16 +853,11 @@ class modify_material(bpy.types.Operator):
         self.set_uv_type('Body', 'nippleuv', 'uv_nipple_and_shine', group= 'texturesnsfw')
         self.set_uv_type('Body', 'underuv', 'uv_underhair', group= 'texturesnsfw')
         #find the appropriate alpha mask
-        alpha_mask = None
-        if bpy.data.images.get('_AM.png'):
-            alpha_mask = bpy.data.images.get('_AM.png')
-        elif bpy.data.images.get('_AM_00.png'):
-            alpha_mask = bpy.data.images.get('_AM_00.png')
-        else:
+        alpha_mask = self.get_image('_AM.png') or self.get_image('_AM_00.png')
+        if not alpha_mask:
             #check the other alpha mask numbers
-            for image in bpy.data.images:
-                if '_m_body_AM_' in image.name and image.name[-6:-4].isnumeric():
-                    alpha_mask = image
+            for image_name in sorted(self.texture_files):
+                if '_m_body_AM_' in image_name and image_name[-6:-4].isnumeric() and (alpha_mask := self.get_image(image_name)):
                     break
         #if there was an alpha mask detected, load it in
         if alpha_mask:
@@ -663,7 +971,7 @@ class modify_material(bpy.types.Operator):
                 #If there's an AnotherRamp (AR) texture present, the material is likely supposed to be metallic on the red parts of the detail mask
                 #I don't have a template for this, so the material will just look pure white. Turn off the shine intensity to avoid this
                 image_name = genMat.material['id'] + '_AR.png'
-                if bpy.data.images.get(image_name):
+                if image_name in self.texture_files or bpy.data.images.get(image_name):
                     genMat.material.node_tree.nodes['light'].inputs['Detail intensity (shine)'].default_value = 0
                     genMat.material.node_tree.nodes['dark' ].inputs['Detail intensity (shine)'].default_value = 0
 
@@ -740,6 +1048,7 @@ class modify_material(bpy.types.Operator):
 
         c.print_timer('link_textures_for_tongue_tear_gag')
 
+    @c.track_numpy_memory('create_dark_textures')
     def create_dark_textures(self):
         """
         Creates dark versions of textures for body, hair, and outfit materials.
@@ -748,10 +1057,13 @@ class modify_material(bpy.types.Operator):
         it checks if the material has a 'textures' node and if it contains a '_ST_DT.png' texture.
         If the texture is not a placeholder, it creates a dark version of the texture using the
         shadow color specific to the material and assigns it to the '_ST_DT.png' texture node.
+        Materials that share a texture and shadow color share one dark texture, and several textures are darkened at once.
         """
         materials = c.get_body_materials()
         materials.extend(c.get_hair_materials())
         materials.extend(c.get_outfit_materials())
+        # gather every (maintex, shadow color) pair first. data in list: (maintex, shadow color, made by load_images, materials using it)
+        pairs = {}
         for material in materials:
             if material.node_tree.nodes.get('textures'):
                 if material.node_tree.nodes['textures'].node_tree.nodes.get('_ST_DT.png'):
@@ -759,8 +1071,61 @@ class modify_material(bpy.types.Operator):
                     #if this isn't a placeholder image, create a dark version of it
                     if maintex.name != 'Template: Placeholder' and maintex.name != 'cf_m_tang_CM.png':
                         shadow_color = c.json_file_manager.get_shadow_color(material.name)
-                        darktex = self.create_darktex(maintex, shadow_color)
-                        material.node_tree.nodes['textures'].node_tree.nodes['_ST_DT.png'].image = darktex
+                        #the dark version may have been saved by load_images already, also if this material uses a copy of that texture
+                        fused = maintex.name.endswith('_ST_CT.png') and repr(self.fused_dark_textures.get(maintex.name[:-len('_ST_CT.png')])) == repr(shadow_color)
+                        pairs.setdefault((maintex.name, repr(shadow_color)), [maintex, shadow_color, fused, []])[3].append(material)
+
+        modify_material.dark_textures = set()
+
+        def assign(pair: list, darktex: bpy.types.Image):
+            modify_material.dark_textures.add(darktex.name)
+            for material in pair[3]:
+                material.node_tree.nodes['textures'].node_tree.nodes['_ST_DT.png'].image = darktex
+
+        # each image is darkened in batches of rows on the same kind of pool the images were saturated on.
+        # The batches of several images are in flight at once as long as their pixels fit in the image memory budget,
+        # and only reading the pixels and making the bpy images happens on this thread
+        if self.saturation_backend == 'B':
+            # the same pool load_images saturated the images on
+            executor, worker, _ = self.open_process_pool()
+            pool_context = contextlib.nullcontext()
+        else:
+            executor, worker = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_thread_num), None
+            pool_context = executor
+        scheduler = ImageScheduler(self.image_memory_budget, self.batch_rows)
+        jobs = collections.deque()  # data in tuple: (pair, job from start_darktex, estimated memory)
+
+        def finish_oldest():
+            pair, job, cost = jobs.popleft()
+            try:
+                assign(pair, self.finish_darktex(job))
+            finally:
+                scheduler.release(cost)
+
+        with pool_context:
+            try:
+                for pair in pairs.values():
+                    maintex, shadow_color, fused, _ = pair
+                    if fused:
+                        assign(pair, self.load_darktex(maintex))
+                        continue
+                    cost = scheduler.estimate(maintex.size[0], maintex.size[1])
+                    while not scheduler.try_admit(cost):
+                        finish_oldest()
+                    darktex, job = self.start_darktex(maintex, shadow_color, executor, worker)
+                    if darktex:
+                        assign(pair, darktex)
+                        scheduler.release(cost)
+                    else:
+                        jobs.append((pair, job, cost))
+                while jobs:
+                    finish_oldest()
+            finally:
+                #free the pixels of every job that didn't finish because of an error
+                for pair, job, cost in jobs:
+                    concurrent.futures.wait(job['futures'])
+                    self.release_darktex(job)
+        pixel_buffers.clear()
         c.print_timer('create_dark_textures')
 
     def import_and_setup_smooth_normals(self):
@@ -1010,8 +1375,11 @@ class modify_material(bpy.types.Operator):
 
 
     def load_json_colors(self):
-        self.update_shaders('light') # Set light colors
-        self.update_shaders('dark') # Set dark colors
+        #queue the light and dark colors, then saturate all of them at once
+        color_batch = []
+        self.update_shaders('light', color_batch) # Set light colors
+        self.update_shaders('dark', color_batch) # Set dark colors
+        self.apply_color_batch(color_batch)
         c.print_timer('load_json_colors')
 
     def set_color_management(self):
@@ -1020,18 +1388,33 @@ class modify_material(bpy.types.Operator):
             bpy.data.scenes[0].eevee.use_shadows = False
         c.print_timer('set_color_management')
 
+    def store_textures(self):
+        '''Moves the textures this import loaded or made into the texture store if the textures are kept outside of the .blend file.
+        Images from other characters or that the user loaded are left alone'''
+        if self.texture_storage == 'B':
+            names = set(self.loaded_textures.values()) | set(self.texture_aliases.values()) | self.dark_textures
+            for name in names:
+                if (image := bpy.data.images.get(name)) and image.users:
+                    texture_store.store_image(image)
+        c.print_timer('store_textures')
+
     # %% Supporting functions
     @staticmethod
     def apply_texture_data_to_image(mat: str, image: str, node:str, group = 'textures'):
         '''Sets offset and scale of an image node using the TextureData.json '''
-        json_tex_data = c.json_file_manager.get_json_file('KK_TextureData.json')
-        texture_data = [t for t in json_tex_data if t["textureName"] == image]
-        if texture_data and bpy.data.materials.get(mat):
+        if bpy.data.materials.get(mat):
+            modify_material.apply_texture_data_to_node(bpy.data.materials[mat].node_tree.nodes[group].node_tree.nodes[node], image)
+
+    @staticmethod
+    def apply_texture_data_to_node(image_node: bpy.types.Node, image: str):
+        '''Sets offset and scale of an image node object using the TextureData.json '''
+        if texture_data := c.json_file_manager.get_texture_data(image):
             #Apply Offset and Scale
-            bpy.data.materials[mat].node_tree.nodes[group].node_tree.nodes[node].texture_mapping.translation[0] = texture_data[0]["offset"]["x"]
-            bpy.data.materials[mat].node_tree.nodes[group].node_tree.nodes[node].texture_mapping.translation[1] = texture_data[0]["offset"]["y"]
-            bpy.data.materials[mat].node_tree.nodes[group].node_tree.nodes[node].texture_mapping.scale[0] = texture_data[0]["scale"]["x"]
-            bpy.data.materials[mat].node_tree.nodes[group].node_tree.nodes[node].texture_mapping.scale[1] = texture_data[0]["scale"]["y"]
+            texture_mapping = image_node.texture_mapping
+            texture_mapping.translation[0] = texture_data["offset"]["x"]
+            texture_mapping.translation[1] = texture_data["offset"]["y"]
+            texture_mapping.scale[0] = texture_data["scale"]["x"]
+            texture_mapping.scale[1] = texture_data["scale"]["y"]
 
     def image_load(self, material_name: str, image_suffix = '', image_override = None, node_override = None, group_override = None):
         '''Automatically load image into mat's texture slot'''
@@ -1041,12 +1424,13 @@ class modify_material(bpy.types.Operator):
         #get the image name using the id and the suffix
         image_name = image_override if image_override else material['id'] + image_suffix
         #then load the image into the texture slot
-        if bpy.data.images.get(image_name):
+        if image := self.get_image(image_name):
             node = node_override if node_override else image_name.replace(material['id'], '')
             group = group_override if group_override else 'textures'
-            bpy.data.materials[material_name].node_tree.nodes[group].node_tree.nodes[node].image = bpy.data.images[image_name]
+            image_node = material.node_tree.nodes[group].node_tree.nodes[node]
+            image_node.image = image
             #also apply scaling and offset data to the image
-            self.apply_texture_data_to_image(material_name, image_name, node, group)
+            self.apply_texture_data_to_node(image_node, image_name)
         else:
             c.kklog('File wasnt found, skipping: ' + image_name)
 
@@ -1054,79 +1438,43 @@ class modify_material(bpy.types.Operator):
     def set_uv_type(mat: str, uvnode: str, uv_name: str, group = 'textures'):
         bpy.data.materials['KK ' + mat + ' ' + c.get_name()].node_tree.nodes[group].node_tree.nodes['pos'].node_tree.nodes[uvnode].uv_map = uv_name
 
-    @staticmethod
-    def __bilinear_interpolation__(lut_pixels, coords):
-        h, w, _ = lut_pixels.shape
-        x = coords[:, :, 0] * (w - 1)
-        # Fudge x coordinates based on x position. subtract -0.5 if at x position 0 and add 0.5 if at x position 1024 of the LUT.
-        # this helps with some kind of overflow / underflow issue where it reads from the next LUT square when it's not supposed to
-        x = x + (x / 1024 - 0.5)
-        y = coords[:, :, 1] * (h - 1)
-        # Get integer and fractional parts of each coordinate.
-        # Also make sure each coordinate is clipped to the LUT image bounds
-        x0 = numpy.clip(numpy.floor(x).astype(int), 0, w - 1)
-        x1 = numpy.clip(x0 + 1, 0, w - 1)
-        y0 = numpy.clip(numpy.floor(y).astype(int), 0, h - 1)
-        y1 = numpy.clip(y0 + 1, 0, h - 1)
-        x_frac = x - x0
-        y_frac = y - y0
-        # Get the pixel values at four corners of this coordinate
-        f00 = lut_pixels[y0, x0]
-        f01 = lut_pixels[y1, x0]
-        f10 = lut_pixels[y0, x1]
-        f11 = lut_pixels[y1, x1]
-        del x0
-        del x1
-        del y0
-        del y1
-        # Perform the bilinear interpolation using the fractional part of each coordinate
-        # This will ensure the LUT can provide the correct color every single time, even if that color isn't found in the LUT itself
-        # If this isn't performed, the resulting image will look very blocky because it will snap to colors only found in the LUT.
-        lut_col_bot = f00 * (1 - y_frac)[:, :, numpy.newaxis] + f01 * y_frac[:, :, numpy.newaxis]
-        lut_col_top = f10 * (1 - y_frac)[:, :, numpy.newaxis] + f11 * y_frac[:, :, numpy.newaxis]
-        interpolated_colors = lut_col_bot * (1 - x_frac)[:, :, numpy.newaxis] + lut_col_top * x_frac[:, :, numpy.newaxis]
-        return interpolated_colors
-
     def saturate_color(self, color: float, light_pass = 'light', shadow_color = {'r':0.764, 'g':0.880, 'b':1}) -> dict[str, float]:
         '''The Secret Sauce. Accepts a 0-1 float rgba color dict, saturates it to match the in-game look 
         and returns it in the form of a 0-1 float rgba array'''
-
-        #fix the color if it does not have an alpha
-        color['a'] = color.get('a', 1)
-
-        #make the color a dark color if the light_pass is set to dark
-        color = color if light_pass == 'light' else self.clothes_dark_color(color, shadow_color)
-        width, height = 1,1
-
-        # Load image and LUT image pixels into array
-        image_pixels = numpy.array([color['r'], color['g'], color['b'], 1],dtype=modify_material.np_number_precision).reshape(height, width, 4)
-
-        # Find the XY coordinates of the LUT image needed to saturate each pixel
-        coord = image_pixels[:, :, :3] * self.coord_scale + self.coord_offset
-        coord_frac, coord_floor = numpy.modf(coord)
-        coord_bot = coord[:, :, :2] + numpy.tile(coord_floor[:, :, 2].reshape(height, width, 1), (1, 1, 2)) * self.texel_height_X0
-        coord_top = numpy.clip(coord_bot + self.texel_height_X0, 0, 1)
-
-        lutcol_bot = self.__bilinear_interpolation__(self.lut_pixels, coord_bot)
-        lutcol_top = self.__bilinear_interpolation__(self.lut_pixels, coord_top)
-        #After the older gpu code uses the texture lookup the colorspace is converted from srgb to linear,
-        # so replicate that behavior here.
-        def srgb_to_linear(srgb):
-            linear_rgb = numpy.where(
-                srgb <= 0.04045,
-                srgb / 12.92,
-                numpy.power((srgb + 0.055) / 1.055, 2.4))
-            return linear_rgb
-        lutcol_bot = srgb_to_linear(lutcol_bot)
-        lutcol_top = srgb_to_linear(lutcol_top)
-        lut_colors = lutcol_bot * (1 - coord_frac[:, :, 2].reshape(height, width, 1)) + lutcol_top * coord_frac[:, :, 2].reshape(height, width, 1)
-        image_pixels[:, :, :3] = lut_colors[:,:,:3]
-
-        return image_pixels.flatten().tolist()[0:4]
-
-
-    def update_shaders(self, light_pass: str):
-        '''Set the colors for everything. This is run once for the light colors and again for the dark colors'''
+        color_batch = []
+        self.queue_color(color_batch, None, color, light_pass, shadow_color)
+        return self.saturate_color_batch(color_batch)[0]
+
+    def queue_color(self, color_batch: list, socket, color: dict, light_pass = 'light', shadow_color = {'r':0.764, 'g':0.880, 'b':1}):
+        '''Adds a color to color_batch so it can be saturated later with every other color.
+        light_pass can be 'light', 'dark' to use the dark clothes color or 'skin' to use the dark skin color.
+        The result is assigned to socket.default_value by apply_color_batch'''
+        color_batch.append((socket, color, light_pass, shadow_color))
+
+    def saturate_color_batch(self, color_batch: list) -> list[list[float]]:
+        '''Saturates every color in color_batch in a single numpy pass and returns them as 0-1 float rgba arrays'''
+        colors = numpy.array([[color['r'], color['g'], color['b']] for socket, color, light_pass, shadow_color in color_batch], dtype=numpy.float64)
+        light_passes = numpy.array([light_pass for socket, color, light_pass, shadow_color in color_batch])
+        #make the colors dark colors if the light_pass is set to dark
+        if (dark := light_passes == 'dark').any():
+            shadow_colors = numpy.array([[shadow_color['r'], shadow_color['g'], shadow_color['b']] for socket, color, light_pass, shadow_color in color_batch], dtype=numpy.float64)
+            colors[dark] = colorscience.clothes_dark_colors(colors[dark], shadow_colors[dark])
+        if (skin := light_passes == 'skin').any():
+            colors[skin] = colorscience.skin_dark_colors(colors[skin])
+        return colorscience.saturate_colors(colors, self.lut_pixels).tolist()
+
+    def apply_color_batch(self, color_batch: list):
+        '''Saturates every color queued with queue_color and assigns them to their sockets'''
+        if not color_batch:
+            return
+        for (socket, color, light_pass, shadow_color), result in zip(color_batch, self.saturate_color_batch(color_batch)):
+            socket.default_value = result
+
+    def update_shaders(self, light_pass: str, color_batch: list = None):
+        '''Set the colors for everything. This is run once for the light colors and again for the dark colors.
+        The saturated colors are queued in color_batch. If color_batch isn't given, they are assigned before this returns'''
+        assign_colors = color_batch is None
+        color_batch = [] if assign_colors else color_batch
         #set the tongue colors if it exists
         #if c.get_material_names('o_tang') and (tongue := c.get_tongue()):
         if c.get_material_names('o_tang') and (tongue := c.get_tongue()):
@@ -1135,30 +1483,28 @@ class modify_material(bpy.types.Operator):
             shader_inputs['Detail intensity (green)'].default_value = 0.01
             shader_inputs['Color mask (base)'].default_value = [1, 1, 1, 1]
             mat_name = tongue.material_slots[0].name
-            shader_inputs['Color mask (red)'].default_value =   self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
-            shader_inputs['Color mask (green)'].default_value = self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color2 "), light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
-            shader_inputs['Color mask (blue)'].default_value =  self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color3 "), light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+            self.queue_color(color_batch, shader_inputs['Color mask (red)'], c.json_file_manager.get_color(mat_name, "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+            self.queue_color(color_batch, shader_inputs['Color mask (green)'], c.json_file_manager.get_color(mat_name, "_Color2 "), light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+            self.queue_color(color_batch, shader_inputs['Color mask (blue)'], c.json_file_manager.get_color(mat_name, "_Color3 "), light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
 
         #set all of the hair colors
-        hair_materials = [m for m in bpy.data.materials if m.get('hair') == True and m.get('name') == c.get_name()]
+        hair_materials = c.get_hair_materials()
         for hair_material in hair_materials:
             shader_inputs = hair_material.node_tree.nodes[light_pass].inputs
-            shader_inputs['Hair color'].default_value         = self.saturate_color(c.json_file_manager.get_color(hair_material.name, "_Color " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
-            shader_inputs['Color mask (root)'].default_value  = self.saturate_color(c.json_file_manager.get_color(hair_material.name, "_Color2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
-            shader_inputs['Color mask (tip)'].default_value = self.saturate_color(c.json_file_manager.get_color(hair_material.name, "_Color3 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
+            self.queue_color(color_batch, shader_inputs['Hair color'], c.json_file_manager.get_color(hair_material.name, "_Color " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
+            self.queue_color(color_batch, shader_inputs['Color mask (root)'], c.json_file_manager.get_color(hair_material.name, "_Color2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
+            self.queue_color(color_batch, shader_inputs['Color mask (tip)'], c.json_file_manager.get_color(hair_material.name, "_Color3 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(hair_material.name))
 
         #set body colors
         if c.get_body():
             if c.get_material_names('o_body_a'):
                 shader_inputs = c.get_body().material_slots['KK Body ' + c.get_name()].material.node_tree.nodes[light_pass].inputs
                 mat_name = 'KK Body ' + c.get_name()
-                if light_pass == 'light':
-                    shader_inputs['Skin color'].default_value = self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color "), light_pass = 'light')
-                else:
-                    shader_inputs['Skin color'].default_value = self.saturate_color(self.skin_dark_color(c.json_file_manager.get_color(mat_name, "_Color ")), light_pass = 'light')
-                shader_inputs['Detail color'].default_value =               self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color2 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
-                shader_inputs['Line mask color'].default_value =            self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color2 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name)) #use same color for both detail and line
-                shader_inputs['Nail color (multiplied)'].default_value =    self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color5 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                #the dark skin color uses the skin shader instead of the clothes shader
+                self.queue_color(color_batch, shader_inputs['Skin color'], c.json_file_manager.get_color(mat_name, "_Color "), 'light' if light_pass == 'light' else 'skin')
+                self.queue_color(color_batch, shader_inputs['Detail color'], c.json_file_manager.get_color(mat_name, "_Color2 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                self.queue_color(color_batch, shader_inputs['Line mask color'], c.json_file_manager.get_color(mat_name, "_Color2 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name)) #use same color for both detail and line
+                self.queue_color(color_batch, shader_inputs['Nail color (multiplied)'], c.json_file_manager.get_color(mat_name, "_Color5 " ),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
                 if not bpy.context.scene.kkbp.sfw_mode:
                     shader_inputs['Underhair color'].default_value =        [0, 0, 0, 1]
                     # shader_inputs['Nipple base'].default_value =            [1.0, 0.48, 0.48, 1.0] #these don't seem to be the correct colors. Just use hardcoded colors in .blend file
@@ -1172,401 +1518,154 @@ class modify_material(bpy.types.Operator):
                 #setup the face material
                 mat_name = 'KK Face ' + c.get_name()
                 shader_inputs = c.get_body().material_slots[mat_name].material.node_tree.nodes[light_pass].inputs
-                shader_inputs['Skin color'].default_value =             c.get_body().material_slots['KK Body ' + c.get_name()].material.node_tree.nodes[light_pass].inputs['Skin color'].default_value
-                shader_inputs['Detail color'].default_value =      self.saturate_color(c.json_file_manager.get_color('KK Body ' + c.get_name(), "_Color2 " ),         light_pass, shadow_color = c.json_file_manager.get_shadow_color('KK Body ' + c.get_name()))
-                shader_inputs['Light blush color'].default_value =      self.saturate_color(c.json_file_manager.get_color(mat_name, "_overcolor2 "  ),                light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
-                shader_inputs['Lipstick multiplier'].default_value =    self.saturate_color(c.json_file_manager.get_color(mat_name, "_overcolor1 "  ),                light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                #use the same skin color as the body
+                self.queue_color(color_batch, shader_inputs['Skin color'], c.json_file_manager.get_color('KK Body ' + c.get_name(), "_Color "), 'light' if light_pass == 'light' else 'skin')
+                self.queue_color(color_batch, shader_inputs['Detail color'], c.json_file_manager.get_color('KK Body ' + c.get_name(), "_Color2 " ),         light_pass, shadow_color = c.json_file_manager.get_shadow_color('KK Body ' + c.get_name()))
+                self.queue_color(color_batch, shader_inputs['Light blush color'], c.json_file_manager.get_color(mat_name, "_overcolor2 "  ),                light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                self.queue_color(color_batch, shader_inputs['Lipstick multiplier'], c.json_file_manager.get_color(mat_name, "_overcolor1 "  ),                light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
 
             #eyebrows
             if c.get_material_names('cf_O_mayuge'):
                 mat_name = 'KK Eyebrows (mayuge) ' + c.get_name()
                 shader_inputs = c.get_body().material_slots[mat_name].material.node_tree.nodes['light'].inputs
-                shader_inputs['Eyebrow color'].default_value =       self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color "))
-                shader_inputs['Eyebrow color dark'].default_value =  self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color "),  'dark' , shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                self.queue_color(color_batch, shader_inputs['Eyebrow color'], c.json_file_manager.get_color(mat_name, "_Color "))
+                self.queue_color(color_batch, shader_inputs['Eyebrow color dark'], c.json_file_manager.get_color(mat_name, "_Color "),  'dark' , shadow_color = c.json_file_manager.get_shadow_color(mat_name))
 
             #eyeline
             if c.get_material_names('cf_O_eyeline'):
                 mat_name = 'KK Eyeline up ' + c.get_name()
                 shader_inputs = c.get_body().material_slots[mat_name].material.node_tree.nodes['light'].inputs
-                shader_inputs['Eyeline fade color'].default_value = self.saturate_color(c.json_file_manager.get_color(mat_name, "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
+                self.queue_color(color_batch, shader_inputs['Eyeline fade color'], c.json_file_manager.get_color(mat_name, "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(mat_name))
                 #the below doesn't seem to be the correct color. Use the hardcoded one in the blend file for now
                 # if len(c.get_material_names('cf_O_eyeline')) > 1:
                 #     shader_inputs['Kage color'].default_value =  self.saturate_color(c.json_file_manager.get_color('KK Eyeline kage ' + c.get_name(), "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color('KK Eyeline kage ' + c.get_name()))
                 if c.get_material_names('cf_O_eyeline_low'):
                     shader_inputs = c.get_body().material_slots[mat_name].material.node_tree.nodes['light'].inputs
-                    shader_inputs['Eyeline down fade color'].default_value = self.saturate_color(c.json_file_manager.get_color('KK Eyeline down ' + c.get_name(), "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color('KK Eyeline down ' + c.get_name()))
+                    self.queue_color(color_batch, shader_inputs['Eyeline down fade color'], c.json_file_manager.get_color('KK Eyeline down ' + c.get_name(), "_Color "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color('KK Eyeline down ' + c.get_name()))
 
         #set the clothes colors
-        materials = [m for m in bpy.data.materials if m.get('outfit') == True and m.get('name') == c.get_name()]
+        materials = c.get_outfit_materials()
         for material in materials:
             shader_inputs = material.node_tree.nodes[light_pass].inputs
-            shader_inputs['Color mask (red)'].default_value =       self.saturate_color(c.json_file_manager.get_color(material.name, "_Color "),     light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-            shader_inputs['Color mask (green)'].default_value =     self.saturate_color(c.json_file_manager.get_color(material.name, "_Color2 "),    light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-            shader_inputs['Color mask (blue)'].default_value =      self.saturate_color(c.json_file_manager.get_color(material.name, "_Color3 "),    light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-            shader_inputs['Pattern color (red)'].default_value =    self.saturate_color(c.json_file_manager.get_color(material.name, "_Color1_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-            shader_inputs['Pattern color (green)'].default_value =  self.saturate_color(c.json_file_manager.get_color(material.name, "_Color2_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-            shader_inputs['Pattern color (blue)'].default_value =   self.saturate_color(c.json_file_manager.get_color(material.name, "_Color3_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
-
-    #something is wrong with this one, currently unused
-    # def hair_dark_color(self, color, shadow_color):
-    #     diffuse = float4(color[0], color[1], color[2], 1)
-    #     _ShadowColor = float4(shadow_color['r'], shadow_color['g'], shadow_color['b'], 1)
-
-    #     finalAmbientShadow = 0.7225; #constant
-    #     invertFinalAmbientShadow = finalAmbientShadow #this shouldn't be equal to this but it works so whatever
-
-    #     finalAmbientShadow = finalAmbientShadow * _ShadowColor
-    #     finalAmbientShadow += finalAmbientShadow;
-    #     shadowCol = _ShadowColor - 0.5;
-    #     shadowCol = -shadowCol * 2 + 1;
-
-    #     invertFinalAmbientShadow = -shadowCol * invertFinalAmbientShadow + 1;
-    #     shadeCheck = 0.5 < _ShadowColor;
-    #     hlslcc_movcTemp = finalAmbientShadow;
-    #     hlslcc_movcTemp.x = invertFinalAmbientShadow.x if (shadeCheck.x) else finalAmbientShadow.x; 
-    #     hlslcc_movcTemp.y = invertFinalAmbientShadow.y if (shadeCheck.y) else finalAmbientShadow.y; 
-    #     hlslcc_movcTemp.z = invertFinalAmbientShadow.z if (shadeCheck.z) else finalAmbientShadow.z; 
-    #     finalAmbientShadow = (hlslcc_movcTemp).saturate();
-    #     diffuse *= finalAmbientShadow;
-
-    #     finalDiffuse  = diffuse.saturate();
-
-    #     shading = 1 - finalAmbientShadow;
-    #     shading = 1 * shading + finalAmbientShadow;
-    #     finalDiffuse *= shading;
-    #     shading = 1.0656;
-    #     finalDiffuse *= shading;
-
-    #     return [finalDiffuse.x, finalDiffuse.y, finalDiffuse.z];
-
-    def MapValuesMain(self, color): #-> float4
-        '''mapvaluesmain function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPDiffuse.cginc'''
-        t0 = color;
-        tb30 = t0.y>=t0.z;
-        t30 = 1 if tb30 else float(0.0);
-        t1 = float4(t0.z, t0.y, t0.z, t0.w);
-        t2 = float4(t0.y - t1.x,  t0.z - t1.y);
-        t1.z = float(-1.0);
-        t1.w = float(0.666666687);
-        t2.z = float(1.0);
-        t2.w = float(-1.0);
-        t1 = float4(t30, t30, t30, t30) * float4(t2.x, t2.y, t2.w, t2.z) + float4(t1.x, t1.y, t1.w, t1.z);
-        tb30 = t0.x>=t1.x;
-        t30 = 1 if tb30 else 0.0;
-        t2.z = t1.w;
-        t1.w = t0.x;
-        t2 = float4(t1.w, t1.y, t2.z, t1.x)
-        t2 = (-t1) + t2;
-        t1 = float4(t30, t30, t30, t30) * t2 + t1;
-        t30 = min(t1.y, t1.w);
-        t30 = (-t30) + t1.x;
-        t2.x = t30 * 6.0 + 1.00000001e-10;
-        t11 = (-t1.y) + t1.w;
-        t11 = t11 / t2.x;
-        t11 = t11 + t1.z;
-        t1.x = t1.x + 1.00000001e-10;
-        t30 = t30 / t1.x;
-        t30 = t30 * 0.660000026;
-        #w component isn't used anymore so ignore
-        t2 = float4(t11, t11, t11).abs() + float4(-0.0799999982, -0.413333356, 0.25333333)
-        t2 = t2.frac()
-        t2 = (-t2) * float4(2.0, 2.0, 2.0) + float4(1.0, 1.0, 1.0);
-        t2 = t2.abs() * float4(3.0, 3.0, 3.0) + float4(-1.0, -1.0, -1.0);
-        t2 = t2.clamp()
-        t2 = t2 + float4(-1.0, -1.0, -1.0);
-        t2 = float4(t30, t30, t30) * t2 + float4(1.0, 1.0, 1.0);
-        return float4(t2.x, t2.y, t2.z, 1);
-
-    def skin_dark_color(self, color) -> dict[str, float]:
-        '''Takes a 1.0 max rgba dict and returns a 1.0 max rgba dict. skin is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Skin/KKPSkinFrag.cginc '''
-        diffuse = float4(color['r'], color['g'], color['b'], 1)
-        shadingAdjustment = self.MapValuesMain(diffuse);
-
-        diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
-        diffuseShaded = -diffuseShaded * 2 + 1;
-
-        compTest = 0.555555582 < shadingAdjustment;
-        shadingAdjustment *= 1.79999995;
-        diffuseShaded = -diffuseShaded * 0.7225 + 1;
-        hlslcc_movcTemp = shadingAdjustment;
-        hlslcc_movcTemp.x = diffuseShaded.x if (compTest.x) else shadingAdjustment.x; #370
-        hlslcc_movcTemp.y = diffuseShaded.y if (compTest.y) else shadingAdjustment.y; #371
-        hlslcc_movcTemp.z = diffuseShaded.z if (compTest.z) else shadingAdjustment.z; #372
-        shadingAdjustment = (hlslcc_movcTemp).saturate(); #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
-
-        finalDiffuse = diffuse * shadingAdjustment;
-
-        bodyShine = float4(1.0656, 1.0656, 1.0656, 1);
-        finalDiffuse *= bodyShine;
-        fudge_factor = float4(0.02, 0.05, 0, 0) #result is slightly off but it looks consistently off so add a fudge factor
-        finalDiffuse += fudge_factor
-
-        return {'r':finalDiffuse.x, 'g':finalDiffuse.y, 'b':finalDiffuse.z, 'a':1}
-
-    def ShadeAdjustItem(self, col, _ShadowColor): #-> float4
-        '''#shadeadjust function is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/KKPItemDiffuse.cginc .
-    lines with comments at the end have been translated from C# to python. lines without comments at the end have been copied verbatim from the C# source'''
-        #start at line 63
-        t0 = col
-        t1 = float4(t0.y, t0.z, None, t0.x) * float4(_ShadowColor.y, _ShadowColor.z, None, _ShadowColor.x) #line 65
-        t2 = float4(t1.y, t1.x) #66
-        t3 = float4(t0.y, t0.z) * float4(_ShadowColor.y, _ShadowColor.z) + (-float4(t2.x, t2.y)); #67
-        tb30 = t2.y >= t1.y;
-        t30 = 1 if tb30 else 0;
-        t2 = float4(t2.x, t2.y, -1.0, 0.666666687); #70-71
-        t3 = float4(t3.x, t3.y, 1.0, -1); #72-73
-        t2 = (t30) * t3 + t2;
-        tb30 = t1.w >= t2.x;
-        t30 = 1 if tb30 else float(0.0);
-        t1 = float4(t2.x, t2.y, t2.w, t1.w) #77
-        t2 = float4(t1.w, t1.y, t2.z, t1.x) #78
-        t2 = (-t1) + t2;
-        t1 = (t30) * t2 + t1;
-        t30 = min(t1.y, t1.w);
-        t30 = (-t30) + t1.x;
-        t2.x = t30 * 6.0 + 1.00000001e-10;
-        t11 = (-t1.y) + t1.w;
-        t11 = t11 / t2.x;
-        t11 = t11 + t1.z;
-        t1.x = t1.x + 1.00000001e-10;
-        t30 = t30 / t1.x;
-        t30 = t30 * 0.5;
-        #the w component of t1 is no longer used, so ignore it
-        t1 = abs((t11)) + float4(0.0, -0.333333343, 0.333333343, 1); #90
-        t1 = t1.frac(); #91
-        t1 = -t1 * 2 + 1; #92
-        t1 = t1.abs() * 3 + (-1) #93
-        t1 = t1.clamp() #94
-        t1 = t1 + (-1); #95
-        t1 = (t30) * t1 + 1; #96
-        return float4(t1.x, t1.y, t1.z, 1) #97
-
-    def clothes_dark_color(self, color: dict, shadow_color: dict) -> dict[str, float]:
-        '''Takes a 1.0 max rgba dict and returns a 1.0 max rgba dict.
-        clothes is from https://github.com/xukmi/KKShadersPlus/blob/main/Shaders/Item/MainItemPlus.shader
-        This was stripped down to just the shadow portion, and to remove all constants'''
-        ################### variable setup
-        _ambientshadowG = float4(0.15, 0.15, 0.15, 0.15) #constant from experimentation
-        diffuse = float4(color['r'],color['g'],color['b'],1) #maintex color
-        _ShadowColor = float4(shadow_color['r'],shadow_color['g'],shadow_color['b'],1) #the shadow color from material editor
-        ##########################
-
-        #start at line 344 because the other one is for outlines
-        shadingAdjustment = self.ShadeAdjustItem(diffuse, _ShadowColor)
-
-        #skip to line 352
-        diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
-        diffuseShaded = -diffuseShaded * 2 + 1;
-
-        compTest = 0.555555582 < shadingAdjustment;
-        shadingAdjustment *= 1.79999995;
-        diffuseShaded = -diffuseShaded * 0.7225 + 1; #invertfinalambient shadow is a constant 0.7225, so don't calc it
-
-        hlslcc_movcTemp = shadingAdjustment;
-        hlslcc_movcTemp.x = diffuseShaded.x if (compTest.x) else shadingAdjustment.x; #370
-        hlslcc_movcTemp.y = diffuseShaded.y if (compTest.y) else shadingAdjustment.y; #371
-        hlslcc_movcTemp.z = diffuseShaded.z if (compTest.z) else shadingAdjustment.z; #372
-        shadingAdjustment = (hlslcc_movcTemp).saturate(); #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
-
-        diffuseShadow = diffuse * shadingAdjustment;
-
-        # lightCol is constant [1.0656, 1.0656, 1.0656, 1] calculated from the custom ambient of [0.666, 0.666, 0.666, 1] and sun light color [0.666, 0.666, 0.666, 1],
-        # so ambientCol always results in lightCol after the max function
-        ambientCol = float4(1.0656, 1.0656, 1.0656, 1);
-        diffuseShadow = diffuseShadow * ambientCol;
-
-        return {'r':diffuseShadow.x, 'g':diffuseShadow.y, 'b':diffuseShadow.z, 'a':1}
+            self.queue_color(color_batch, shader_inputs['Color mask (red)'], c.json_file_manager.get_color(material.name, "_Color "),     light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+            self.queue_color(color_batch, shader_inputs['Color mask (green)'], c.json_file_manager.get_color(material.name, "_Color2 "),    light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+            self.queue_color(color_batch, shader_inputs['Color mask (blue)'], c.json_file_manager.get_color(material.name, "_Color3 "),    light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+            self.queue_color(color_batch, shader_inputs['Pattern color (red)'], c.json_file_manager.get_color(material.name, "_Color1_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+            self.queue_color(color_batch, shader_inputs['Pattern color (green)'], c.json_file_manager.get_color(material.name, "_Color2_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+            self.queue_color(color_batch, shader_inputs['Pattern color (blue)'], c.json_file_manager.get_color(material.name, "_Color3_2 "),  light_pass, shadow_color = c.json_file_manager.get_shadow_color(material.name))
+
+        if assign_colors:
+            self.apply_color_batch(color_batch)
+
+    @staticmethod
+    @c.track_numpy_memory('create_darktex')
+    def create_darktex(maintex: bpy.types.Image, shadow_color: float, executor = None, worker = None) -> bpy.types.Image:
+        '''#accepts a bpy image and creates a dark alternate using colorscience.darken_pixels. Returns a new bpy image.
+        If executor is given, the rows are darkened in batches on it. worker is the module create_process_pool returned if executor is a process pool'''
+        darktex, job = modify_material.start_darktex(maintex, shadow_color, executor, worker)
+        return darktex if darktex else modify_material.finish_darktex(job)
 
     @staticmethod
-    def create_darktex(maintex: bpy.types.Image, shadow_color: float) -> bpy.types.Image:
-        '''#accepts a bpy image and creates a dark alternate using a modified version of the darkening code above. Returns a new bpy image'''
-        if not os.path.isfile(bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'):
-            ok = time.time()
-            image_array = numpy.asarray(maintex.pixels,dtype=modify_material.np_number_precision)
-            image_length = len(image_array)
-            image_row_length = int(image_length/4)
-            image_array = image_array.reshape((image_row_length, 4))
-
-            ################### variable setup
-            _ambientshadowG = numpy.asarray([0.15, 0.15, 0.15, 0.15],dtype=modify_material.np_number_precision) #constant from experimentation
-            diffuse = image_array #maintex color
-            _ShadowColor = numpy.asarray([shadow_color['r'],shadow_color['g'],shadow_color['b'], 1],dtype=modify_material.np_number_precision) #the shadow color from material editor
-            ##########################
-
-            #start at line 344 because the other one is for outlines
-            #shadingAdjustment = ShadeAdjustItemNumpy(diffuse, _ShadowColor)
-            #start at line 63
-            x=0;y=1;z=2;w=3;
-            t0 = diffuse
-            t1 = t0[:, [y, z, z, x]] * _ShadowColor[[y,z,z,x]]
-            t2 = t1[:, [y,x]]
-            t3 = t0[:, [y,z]] * _ShadowColor[[y,z]] + (-t2)
-            tb30 = t2[:, [y]] >= t1[:, [y]]
-            t30 = tb30.astype(int)
-            t2 = numpy.hstack((t2[:, [x,y]], numpy.full((t2.shape[0], 1), -1, t2.dtype), numpy.full((t2.shape[0], 1), 0.666666687, t2.dtype)))
-            t3 = numpy.hstack((t3[:, [x,y]], numpy.full((t3.shape[0], 1),  1, t3.dtype), numpy.full((t3.shape[0], 1), -1,          t3.dtype)))
-            t2 = t30 * t3 + t2
-            tb30 = t1[:, [w]] >= t1[:, [x]]
-            t30 = tb30.astype(int)
-            t1 = numpy.hstack((t2[:, [x, y, w]], t1[:, [w]]))
-            t2 = numpy.hstack((t1[:, [w, y]], t2[:, [z]], t1[:, [x]]))
-            t2 = -t1 + t2
-            t1 = t30 * t2 + t1
-            t30 = numpy.minimum(t1[:, [y]], t1[:, [w]])
-            t30 = -t30 + t1[:, [x]]
-            t2[:, [x]] = t30 * 6 + 1.00000001e-10
-            t11 = -t1[:, [y]] + t1[:, [w]]
-            t11 = t11 / t2[:, [x]];
-            t11 = t11 + t1[:, [z]];
-            t1[:, [x]] = t1[:, [x]] + 1.00000001e-10;
-            t30 = t30 / t1[:, [x]];
-            t30 = t30 * 0.5;
-            #the w component of t1 is no longer used, so ignore it
-            t1 = numpy.absolute(t11) + numpy.asarray([0.0, -0.333333343, 0.333333343, 1]); #90
-            t1 = t1 - numpy.floor(t1)
-            t1 = -t1 * 2 + 1
-            t1 = numpy.absolute(t1) * 3 + (-1)
-            t1 = numpy.clip(t1, 0, 1)
-            t1 = t1 + (-1); #95
-            t1 = (t30) * t1 + 1; #96
-
-            shadingAdjustment = t1
-
-            #skip to line 352
-            diffuseShaded = shadingAdjustment * 0.899999976 - 0.5;
-            diffuseShaded = -diffuseShaded * 2 + 1;
-
-            compTest = 0.555555582 < shadingAdjustment;
-            shadingAdjustment *= 1.79999995;
-            diffuseShaded = -diffuseShaded * 0.7225 + 1; #invertfinalambient shadow is a constant 0.7225, so don't calc it
-
-            hlslcc_movcTemp = shadingAdjustment;
-            #reframe ifs as selects
-            hlslcc_movcTemp[:, [x]] = numpy.select(condlist=[compTest[:, [x]], numpy.invert(compTest[:, [x]])], choicelist=[diffuseShaded[:, [x]], shadingAdjustment[:, [x]]])
-            hlslcc_movcTemp[:, [y]] = numpy.select(condlist=[compTest[:, [y]], numpy.invert(compTest[:, [y]])], choicelist=[diffuseShaded[:, [y]], shadingAdjustment[:, [y]]])
-            hlslcc_movcTemp[:, [z]] = numpy.select(condlist=[compTest[:, [z]], numpy.invert(compTest[:, [z]])], choicelist=[diffuseShaded[:, [z]], shadingAdjustment[:, [z]]])
-            shadingAdjustment = numpy.clip(hlslcc_movcTemp, 0, 1) #374 the lerp result (and shadowCol) is going to be this because shadowColor's alpha is always 1 making shadowCol 1
-
-            diffuseShadow = diffuse * shadingAdjustment;
-
-            # lightCol is constant [1.0656, 1.0656, 1.0656, 1] calculated from the custom ambient of [0.666, 0.666, 0.666, 1] and sun light color [0.666, 0.666, 0.666, 1],
-            # so ambientCol always results in lightCol after the max function
-            ambientCol = numpy.asarray([1.0656, 1.0656, 1.0656, 1],dtype=modify_material.np_number_precision);
-            diffuseShadow = diffuseShadow * ambientCol;
+    def start_darktex(maintex: bpy.types.Image, shadow_color: dict, executor = None, worker = None) -> tuple[bpy.types.Image, dict]:
+        '''Reads the pixels of maintex and starts turning them into the dark maintex in place.
+        Returns (the dark image, None) if it already exists or came from the texture cache, otherwise (None, the job to pass to finish_darktex)'''
+        darktex_filepath = bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'
+        use_texture_cache = modify_material.use_texture_cache and texture_cache.is_open()
+        if not use_texture_cache and os.path.isfile(darktex_filepath):
+            return modify_material.load_darktex(maintex), None
+
+        width, height = maintex.size
+        job = {'maintex': maintex, 'start_time': time.time(), 'block': None, 'futures': [], 'cache_key': None}
+        if worker:
+            job['block'], job['pixels'] = worker.create_shared_array((height, width, maintex.channels), modify_material.np_number_precision)
+            read_pixels(maintex, out = job['pixels'])
+        else:
+            job['pixels'] = read_pixels(maintex, pool = pixel_buffers)
+
+        # reuse the dark version of these exact pixels if it was made before, even if it was for a different character
+        if use_texture_cache:
+            job['cache_key'] = texture_cache.make_key('dark', colorscience.DARK_VERSION, job['pixels'], modify_material.lut_digest, repr(shadow_color))
+            if texture_cache.get(job['cache_key'], darktex_filepath):
+                c.kklog('Loaded dark image from the texture cache: {}'.format(maintex.name), 'debug')
+                modify_material.release_darktex(job)
+                return modify_material.load_darktex(maintex), None
+
+        # the maintex pixels are turned into the dark pixels in place
+        try:
+            job['futures'] = modify_material.darken_rows(job['pixels'], job['block'], shadow_color, executor, worker)
+        except:
+            modify_material.release_darktex(job)
+            raise
+        return None, job
 
+    @staticmethod
+    def finish_darktex(job: dict) -> bpy.types.Image:
+        '''Waits for the batches of a job from start_darktex, then places the dark pixels into a new image and saves it. Returns the new bpy image'''
+        maintex = job['maintex']
+        try:
+            modify_material.wait_for_rows(job['futures'], job['block'])
             #make a new image and place the dark pixels into it
-            dark_array = diffuseShadow
             darktex = bpy.data.images.new(maintex.name[:-7] + '_DT.png', width=maintex.size[0], height=maintex.size[1], alpha = True)
             darktex.file_format = 'PNG'
-            darktex.pixels = dark_array.ravel()
-            darktex.use_fake_user = True
-            darktex_filename = maintex.filepath_raw[maintex.filepath_raw.find(maintex.name):][:-7]+ '_DT.png'
-            darktex_filepath = bpy.context.scene.kkbp.import_dir + '/dark_files/' + darktex_filename
-            darktex.filepath_raw = darktex_filepath
-            darktex.pack()
-            darktex.save()
-            c.kklog('Created dark version of {} in {} seconds'.format(darktex.name, time.time() - ok))
-            return darktex
-        else:
-            if bpy.app.version[0] == 3:
-                bpy.ops.image.open(filepath=str(bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'), use_udim_detecting=False)
+            write_pixels(darktex, job['pixels'])
+        finally:
+            modify_material.release_darktex(job)
+        darktex.use_fake_user = True
+        darktex_filename = maintex.filepath_raw[maintex.filepath_raw.find(maintex.name):][:-7]+ '_DT.png'
+        darktex_filepath = bpy.context.scene.kkbp.import_dir + '/dark_files/' + darktex_filename
+        darktex.filepath_raw = darktex_filepath
+        darktex.save()
+        if job['cache_key']:
+            texture_cache.put(job['cache_key'], darktex_filepath, job['futures'], darktex_filename)
+        c.kklog('Created dark version of {} in {} seconds'.format(darktex.name, time.time() - job['start_time']), 'debug')
+        return darktex
+
+    @staticmethod
+    def release_darktex(job: dict):
+        '''Frees the pixels of a job from start_darktex. The view has to be dropped before the shared memory block can be closed'''
+        if (block := job['block']):
+            job['pixels'] = None
+            block.close()
+            block.unlink()
+        elif job['pixels'] is not None:
+            pixel_buffers.release(job['pixels'])
+            job['pixels'] = None
+
+    @staticmethod
+    def darken_rows(image_pixels, block, shadow_color: dict, executor = None, worker = None) -> list[concurrent.futures.Future]:
+        '''Darkens a (height, width, 4) maintex in place in batches of batch_rows rows.
+        The batches are submitted to executor if it is given and their futures are returned, otherwise they run on this thread.
+        block is the shared memory block holding the pixels if executor is a process pool'''
+        height = image_pixels.shape[0]
+        futures = []
+        for start_row in range(0, height, modify_material.batch_rows):
+            end_row = min(start_row + modify_material.batch_rows, height)
+            if executor is None:
+                modify_material.darken_texture(image_pixels[start_row:end_row], shadow_color)
+            elif block:
+                futures.append(executor.submit(worker.darken_shared_rows, block.name, image_pixels.shape, start_row, end_row, shadow_color))
             else:
-                bpy.data.images.load(filepath=str(bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'))
-            darktex = bpy.data.images[maintex.name[:-6] + 'DT.png']
-            c.kklog('Loading in existing dark version of {}'.format(darktex.name))
-            try:
-                darktex.pack()
-                darktex.save()
-            except:
-                c.kklog('This image was not automatically loaded in because its name exceeds 64 characters: ' + darktex.name, type = 'error')
-            return darktex
-
-class float4:
-    '''class to mimic part of float4 class in Unity
-    multiplying things per element according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L330
-    returning things like float.XZW as [Xposition = X, Yposition = Z, Zposition = W] according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L3056
-    using the variable order x, y, z, w according to https://github.com/Unity-Technologies/Unity.Mathematics/blob/master/src/Unity.Mathematics/float4.gen.cs#L42'''
-    def __init__(self, x = None, y = None, z = None, w = None):
-        self.x = x
-        self.y = y
-        self.z = z
-        self.w = w
-    def __mul__ (self, vector):
-        #if a float4, multiply piece by piece, else multiply full vector
-        if type(vector) in [float, int]:
-            vector = float4(vector, vector, vector, vector)
-        x = self.x * vector.x if self.get('x') != None else None
-        y = self.y * vector.y if self.get('y') != None else None
-        z = self.z * vector.z if self.get('z') != None else None
-        w = self.w * vector.w if self.get('w') != None else None
-        return float4(x,y,z,w)
-    __rmul__ = __mul__
-    def __add__ (self, vector):
-        #if a float4, add piece by piece, else add full vector
-        if type(vector) in [float, int]:
-            vector = float4(vector, vector, vector, vector)
-        x = self.x + vector.x if self.get('x') != None else None
-        y = self.y + vector.y if self.get('y') != None else None
-        z = self.z + vector.z if self.get('z') != None else None
-        w = self.w + vector.w if self.get('w') != None else None
-        return float4(x,y,z,w)
-    __radd__ = __add__
-    def __sub__ (self, vector):
-        #if a float4, subtract piece by piece, else subtract full vector
-        if type(vector) in [float, int]:
-            vector = float4(vector, vector, vector, vector)
-        x = self.x - vector.x if self.get('x') != None else None
-        y = self.y - vector.y if self.get('y') != None else None
-        z = self.z - vector.z if self.get('z') != None else None
-        w = self.w - vector.w if self.get('w') != None else None
-        return float4(x,y,z,w)
-    __rsub__ = __sub__
-    def __gt__ (self, vector):
-        #if a float4, compare piece by piece, else compare full vector
-        if type(vector) in [float, int]:
-            vector = float4(vector, vector, vector, vector)
-        x = self.x > vector.x if self.get('x') != None else None
-        y = self.y > vector.y if self.get('y') != None else None
-        z = self.z > vector.z if self.get('z') != None else None
-        w = self.w > vector.w if self.get('w') != None else None
-        return float4(x,y,z,w)
-    def __neg__ (self):
-        x = -self.x if self.get('x') != None else None
-        y = -self.y if self.get('y') != None else None
-        z = -self.z if self.get('z') != None else None
-        w = -self.w if self.get('w') != None else None
-        return float4(x,y,z,w)
-    def frac(self):
-        x = self.x - math.floor (self.x) if self.get('x') != None else None
-        y = self.y - math.floor (self.y) if self.get('y') != None else None
-        z = self.z - math.floor (self.z) if self.get('z') != None else None
-        w = self.w - math.floor (self.w) if self.get('w') != None else None
-        return float4(x,y,z,w)
-    def abs(self):
-        x = abs(self.x) if self.get('x') != None else None
-        y = abs(self.y) if self.get('y') != None else None
-        z = abs(self.z) if self.get('z') != None else None
-        w = abs(self.w) if self.get('w') != None else None
-        return float4(x,y,z,w)
-    def clamp(self):
-        x = (0 if self.x < 0 else 1 if self.x > 1 else self.x) if self.get('x') != None else None
-        y = (0 if self.y < 0 else 1 if self.y > 1 else self.y) if self.get('y') != None else None
-        z = (0 if self.z < 0 else 1 if self.z > 1 else self.z) if self.get('z') != None else None
-        w = (0 if self.w < 0 else 1 if self.w > 1 else self.w) if self.get('w') != None else None
-        return float4(x,y,z,w)
-    saturate = clamp
-    def clamphalf(self):
-        x = (0 if self.x < 0 else .5 if self.x > .5 else self.x) if self.get('x') != None else None
-        y = (0 if self.y < 0 else .5 if self.y > .5 else self.y) if self.get('y') != None else None
-        z = (0 if self.z < 0 else .5 if self.z > .5 else self.z) if self.get('z') != None else None
-        w = (0 if self.w < 0 else .5 if self.w > .5 else self.w) if self.get('w') != None else None
-        return float4(x,y,z,w)
-    def get(self, var):
-        if hasattr(self, var):
-            return getattr(self, var)
-        else:
-            return None
-    def __str__(self):
-        return str([self.x, self.y, self.z, self.w])
-    __repr__ = __str__
+                futures.append(executor.submit(modify_material.darken_texture, image_pixels[start_row:end_row], shadow_color))
+        return futures
 
+    @staticmethod
+    def wait_for_rows(futures: list[concurrent.futures.Future], block = None):
+        '''Waits for the batches darken_rows submitted and raises the first error'''
+        # wait for every batch before checking for errors, so no batch is still writing when the pixels are released
+        concurrent.futures.wait(futures)
+        for future in futures:
+            result = future.result()
+            if block:
+                pid, tid, start, end = result
+                c.tracer.add_span('darken_rows', start, end, pid, tid, 'saturation worker {}'.format(pid))
+
+    @staticmethod
+    def load_darktex(maintex: bpy.types.Image) -> bpy.types.Image:
+        '''Loads the existing dark version of maintex from the dark_files folder'''
+        if bpy.app.version[0] == 3:
+            bpy.ops.image.open(filepath=str(bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'), use_udim_detecting=False)
+        else:
+            bpy.data.images.load(filepath=str(bpy.context.scene.kkbp.import_dir + '/dark_files/' + maintex.name[:-6] + 'DT.png'))
+        darktex = bpy.data.images[maintex.name[:-6] + 'DT.png']
+        c.kklog('Loading in existing dark version of {}'.format(darktex.name), 'debug')
+        return darktex
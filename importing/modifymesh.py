@@ -28,6 +28,7 @@ class modify_mesh(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
 
+    @c.traced('modify_mesh')
     def execute(self, context):
         try:
             self.rename_uv_maps()
@@ -137,6 +138,7 @@ class modify_mesh(bpy.types.Operator):
         else:
             tongue = self.separate_materials(c.get_body(), [rigged_tongue_material], 'Tongue (rigged) ' + c.get_name())
             tongue['tongue'] = True
+        c.object_registry.add(tongue)
 
         # Now remap the rigged tongue material with the original to allow the rigged tongue and the tongue on the body to share the same material
         if bpy.data.materials.get(rigged_tongue_material):
@@ -172,6 +174,7 @@ class modify_mesh(bpy.types.Operator):
                 hair_object = self.separate_materials(outfit, cur_hair_mat_list, 'Hair ' + outfit.name)
                 hair_object['hair'] = True
                 hair_object['outfit'] = False
+                c.object_registry.add(hair_object)
         c.print_timer('separate_hair')
 
     def separate_alternate_clothing(self):
@@ -209,6 +212,7 @@ class modify_mesh(bpy.types.Operator):
                     if alt_clothes:
                         alt_clothes['alt'] = True
                         alt_clothes['outfit'] = False
+                        c.object_registry.add(alt_clothes)
                         c.kklog('Separated {} alternate clothing {} automatically'.format(materials_to_separate, clothes_labels[label]))
         c.print_timer('separate_alternate_clothing')
 
@@ -262,11 +266,13 @@ class modify_mesh(bpy.types.Operator):
         if hitbox:
             hitbox['hitbox'] = True
             hitbox['body'] = False
+            c.object_registry.add(hitbox)
         for outfit in c.get_outfits():
             hitbox = self.separate_materials(outfit, hitbox_names, 'Hitboxes ' + outfit['id'] + ' ' + c.get_name())
             if hitbox:
                 hitbox['hitbox'] = True
                 hitbox['outfit'] = False
+                c.object_registry.add(hitbox)
         c.move_and_hide_collection(c.get_hitboxes(), "Hitboxes " + c.get_name())
         c.print_timer('separate_hitboxes')
 
@@ -701,6 +707,7 @@ class modify_mesh(bpy.types.Operator):
         # link shapekeys of tears to body
         tears = self.separate_materials(c.get_body(), to_merge_materials, 'Tears ' + c.get_name())
         tears['tears'] = True
+        c.object_registry.add(tears)
         bpy.ops.object.mode_set(mode='OBJECT')
         link_keys(c.get_body(), [tears])
         c.print_timer('create_tear_shapekeys')
@@ -795,6 +802,7 @@ class modify_mesh(bpy.types.Operator):
                 gag_eye = self.separate_materials(c.get_body(), gag_eye_materials, 'Gag Eyes ' + c.get_name())
                 gag_eye['gag'] = True
                 gag_eye['body'] = False
+                c.object_registry.add(gag_eye)
                 c.switch(c.get_body(), 'object')
                 link_keys(c.get_body(), [gag_eye])
 
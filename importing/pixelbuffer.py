@@ -0,0 +1,62 @@
+'''
+Reads and writes bpy image pixels through numpy buffers.
+
+Using image.pixels[:] turns every pixel channel into a python float before numpy sees it,
+which takes seconds and gigabytes of memory for a single 4096 x 4096 image.
+foreach_get / foreach_set copy straight from Blender's float buffer into a float32 numpy array instead.
+The buffers are kept in a pool so images with the same size can reuse them during an import.
+This file does not use bpy so it can be imported anywhere.
+'''
+
+import numpy, threading
+
+np_number_precision = numpy.float32
+
+class PixelBufferPool:
+    '''Keeps released float32 buffers around so they can be reused by the next image with the same size'''
+    def __init__(self, max_mb = 1024):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.buffers = {}
+        self.pooled_bytes = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, count: int) -> numpy.ndarray:
+        '''Returns a flat float32 buffer with count items. The contents are not cleared'''
+        with self.lock:
+            if (buffers := self.buffers.get(count)):
+                buffer = buffers.pop()
+                self.pooled_bytes -= buffer.nbytes
+                return buffer
+        return numpy.empty(count, dtype=np_number_precision)
+
+    def release(self, buffer: numpy.ndarray):
+        '''Gives a buffer from acquire() back to the pool. Buffers that do not fit in the pool are freed'''
+        buffer = buffer.reshape(-1)
+        with self.lock:
+            if self.pooled_bytes + buffer.nbytes > self.max_bytes:
+                return
+            self.buffers.setdefault(buffer.size, []).append(buffer)
+            self.pooled_bytes += buffer.nbytes
+
+    def clear(self):
+        '''Frees every pooled buffer'''
+        with self.lock:
+            self.buffers.clear()
+            self.pooled_bytes = 0
+
+def read_pixels(image, out: numpy.ndarray = None, pool: PixelBufferPool = None) -> numpy.ndarray:
+    '''Copies the pixels of a bpy image into a float32 array shaped (height, width, channels).
+    The array is written into out if it is given, taken from pool if that is given, or allocated otherwise.
+    Arrays taken from a pool should be given back with pool.release() when they are no longer needed'''
+    width, height = image.size
+    channels = image.channels
+    if out is None:
+        out = pool.acquire(width * height * channels) if pool else numpy.empty(width * height * channels, dtype=np_number_precision)
+    image.pixels.foreach_get(out.reshape(-1))
+    return out.reshape(height, width, channels)
+
+def write_pixels(image, pixels: numpy.ndarray):
+    '''Copies a numpy array into the pixels of a bpy image. The array must have the same number of items as the image'''
+    image.pixels.foreach_set(numpy.ascontiguousarray(pixels, dtype=np_number_precision).reshape(-1))
+
+pixel_buffers = PixelBufferPool()
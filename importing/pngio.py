@@ -0,0 +1,142 @@
+'''
+Small PNG helpers that don't need bpy.
+read_png_header only reads the IHDR chunk, so the size of a texture can be known before Blender loads it.
+read_png decodes small 8 bit PNGs like the LUT images, so scripts that run outside of Blender can use them.
+write_png saves a numpy array without going through a bpy image, so finished textures can be saved off the main thread.
+as_saved gives the pixels Blender will read back from that PNG, so work that used to reload the saved texture can use them right away.
+'''
+
+import os, struct, zlib, threading, numpy
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+#number of samples per pixel for each PNG color type
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def read_png_header(path) -> tuple[int, int, int, int]:
+    '''Returns the (width, height, bit depth, channels) of a PNG file.
+    Raises ValueError if the file is not a PNG'''
+    with open(path, 'rb') as file:
+        header = file.read(33)
+    #8 byte signature, then the IHDR chunk: 4 byte length, 4 byte type, 13 bytes of data
+    if len(header) < 33 or header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        raise ValueError('{} is not a PNG file'.format(path))
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', header[16:26])
+    return width, height, bit_depth, PNG_CHANNELS.get(color_type, 4)
+
+def read_png(path) -> numpy.ndarray:
+    '''Reads an 8 bit, non interlaced PNG into a (height, width, 4) float32 array with Blender's bottom to top row order,
+    the same values image.pixels gives for a byte image. The filters are undone one row at a time, so this is only meant for small images'''
+    with open(path, 'rb') as file:
+        data = file.read()
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError('{} is not a PNG file'.format(path))
+    position = 8
+    idat = []
+    while position < len(data):
+        length, = struct.unpack('>I', data[position:position + 4])
+        chunk_type = data[position + 4:position + 8]
+        chunk_data = data[position + 8:position + 8 + length]
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk_data)
+        elif chunk_type == b'IDAT':
+            idat.append(chunk_data)
+        elif chunk_type == b'IEND':
+            break
+        position += length + 12
+    if bit_depth != 8 or color_type not in (0, 2, 4, 6) or interlace:
+        raise ValueError('{} is not an 8 bit, non interlaced PNG without a palette'.format(path))
+    channels = PNG_CHANNELS[color_type]
+    stride = width * channels
+    raw = numpy.frombuffer(zlib.decompress(b''.join(idat)), dtype=numpy.uint8).reshape(height, stride + 1)
+    #undo the filter of each row. Math is done in int16 so nothing overflows before the final modulo
+    rows = numpy.zeros((height + 1, stride + channels), dtype=numpy.int16)
+    for row in range(height):
+        line = raw[row, 1:].astype(numpy.int16)
+        previous = rows[row, channels:]
+        current = rows[row + 1]
+        filter_type = raw[row, 0]
+        if filter_type == 0:
+            current[channels:] = line
+        elif filter_type == 2:
+            current[channels:] = (line + previous) % 256
+        else:
+            #sub, average and paeth need the decoded pixel to the left, so go one pixel at a time
+            upper = rows[row]
+            for column in range(channels, stride + channels, channels):
+                a = current[column - channels:column]
+                b = upper[column:column + channels]
+                if filter_type == 1:
+                    predictor = a
+                elif filter_type == 3:
+                    predictor = (a + b) // 2
+                else:
+                    c = upper[column - channels:column]
+                    p = a + b - c
+                    pa, pb, pc = numpy.abs(p - a), numpy.abs(p - b), numpy.abs(p - c)
+                    predictor = numpy.where((pa <= pb) & (pa <= pc), a, numpy.where(pb <= pc, b, c))
+                current[column:column + channels] = (line[column - channels:column] + predictor) % 256
+    samples = rows[1:, channels:].reshape(height, width, channels).astype(numpy.float32) * numpy.float32(1 / 255)
+    pixels = numpy.ones((height, width, 4), dtype=numpy.float32)
+    if channels <= 2:
+        pixels[:, :, :3] = samples[:, :, :1]
+    else:
+        pixels[:, :, :3] = samples[:, :, :3]
+    if channels in (2, 4):
+        pixels[:, :, 3] = samples[:, :, -1]
+    return pixels[::-1].copy()
+
+def linear_to_srgb(pixels: numpy.ndarray) -> numpy.ndarray:
+    '''Converts linear float colors to sRGB the same way Blender does when it saves a float image'''
+    return numpy.where(pixels <= 0.0031308, pixels * 12.92, 1.055 * numpy.power(numpy.maximum(pixels, 0.0031308), 1 / 2.4) - 0.055)
+
+def to_bytes(pixels: numpy.ndarray, linear = False, out: numpy.ndarray = None) -> numpy.ndarray:
+    '''Rounds a (height, width, 3 or 4) float array to the (height, width, 4) 8 bit RGBA values write_png saves.
+    The result is written into out if it is given'''
+    height, width, channels = pixels.shape
+    if out is None:
+        out = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    rgb = linear_to_srgb(pixels[:, :, :3]) if linear else pixels[:, :, :3]
+    out[:, :, :3] = (numpy.clip(rgb, 0, 1) * 255 + 0.5).astype(numpy.uint8)
+    if channels == 4:
+        out[:, :, 3] = (numpy.clip(pixels[:, :, 3], 0, 1) * 255 + 0.5).astype(numpy.uint8)
+    else:
+        out[:, :, 3] = 255
+    return out
+
+def as_saved(pixels: numpy.ndarray, linear = False, out: numpy.ndarray = None) -> numpy.ndarray:
+    '''Returns the (height, width, 4) float32 pixels Blender reads back from the PNG write_png saves for these pixels.
+    Blender turns each byte of an 8 bit image into a float by multiplying it by 1 / 255'''
+    return numpy.multiply(to_bytes(pixels, linear), numpy.float32(1 / 255), out=out, dtype=numpy.float32)
+
+def write_png(path, pixels: numpy.ndarray, linear = False, compress_level = 1):
+    '''Saves a (height, width, 4) float array with Blender's bottom to top row order as an 8 bit RGBA PNG.
+    The result matches image.save_render() with the Standard view transform, but it only uses numpy and zlib,
+    so it can run on any thread while Blender keeps working. Blender's default compression of 15% is zlib level 1.
+    The PNG is written to a temporary file next to path first, so path never holds a truncated PNG if writing fails'''
+    height, width, channels = pixels.shape
+    data = numpy.empty((height, width * 4 + 1), dtype=numpy.uint8)
+    #PNG rows go from top to bottom
+    to_bytes(pixels[::-1], linear, out = data[:, 1:].reshape(height, width, 4))
+    #use the "up" filter on every row. It's cheap with numpy and helps zlib a lot on textures
+    data[1:, 1:] = numpy.diff(data[:, 1:], axis=0)
+    data[0, 0] = 0
+    data[1:, 0] = 2
+
+    def chunk(chunk_type: bytes, chunk_data: bytes) -> bytes:
+        return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + struct.pack('>I', zlib.crc32(chunk_type + chunk_data))
+
+    temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(PNG_SIGNATURE)
+            file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+            file.write(chunk(b'IDAT', zlib.compress(data, compress_level)))
+            file.write(chunk(b'IEND', b''))
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -22,6 +22,7 @@ class post_operations(bpy.types.Operator):
     bl_description = bl_idname
     bl_options = {'REGISTER', 'UNDO'}
     
+    @c.traced('post_operations')
     def execute(self, context):
         try:
             self.hide_unused_objects()
@@ -375,6 +376,7 @@ class post_operations(bpy.types.Operator):
         rig = bpy.context.active_object
         rig['rig'] = True
         rig['name'] = c.get_name()
+        c.object_registry.add(rig)
 
         #Take the IDs from all org bones and copy them over to the generated / helper bones
         for bone in rig.data.bones:
@@ -0,0 +1,123 @@
+'''
+Content addressed cache for the saturated and dark textures the importer generates.
+
+Textures are stored by a hash of everything that affects their pixels (the source pixels, the LUT, the shadow color and the algorithm version),
+so a changed texture with an old name is never reused and identical textures under different names are only generated once.
+The cache lives in one global folder that is shared by every character. manifest.json in that folder records the size and last use of each file,
+and the least recently used files are deleted once the cache grows past its size limit.
+'''
+
+import os, json, time, shutil, hashlib, threading
+
+class TextureCache:
+    '''
+    Manages the global texture cache folder. The instance is declared at the bottom of the file
+    '''
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def open(self, directory: str, max_mb: int):
+        '''Points the cache at directory and reads its manifest. Files in the folder that are missing from the manifest are ignored'''
+        with self.lock:
+            self.directory = directory
+            self.max_bytes = max_mb * 1024 * 1024
+            self.entries = {}
+            os.makedirs(directory, exist_ok=True)
+            try:
+                with open(os.path.join(directory, self.manifest_name)) as manifest:
+                    self.entries = json.load(manifest)['entries']
+            except (OSError, ValueError, KeyError):
+                pass
+            #forget entries whose file was deleted by hand
+            self.entries = {key: entry for key, entry in self.entries.items() if os.path.isfile(self.__path__(key))}
+
+    def is_open(self) -> bool:
+        return self.directory is not None
+
+    @staticmethod
+    def make_key(kind: str, version: int, *parts) -> str:
+        '''Hashes kind, version and every part (bytes, strings or numbers) into a cache key'''
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f'{kind}:{version}'.encode())
+        for part in parts:
+            digest.update(b'|')
+            #buffers like numpy arrays are hashed directly, everything else is hashed by its repr
+            digest.update(repr(part).encode() if isinstance(part, (str, int, float, tuple, dict)) or part is None else part)
+        return f'{kind}_{digest.hexdigest()}'
+
+    def get(self, key: str, destination: str) -> bool:
+        '''Copies the cached file for key to destination. Returns False if there is no cached file'''
+        with self.lock:
+            if not self.is_open() or key not in self.entries:
+                return False
+            try:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(self.__path__(key), destination)
+            except OSError:
+                del self.entries[key]
+                return False
+            self.entries[key]['atime'] = time.time()
+            self.__save_manifest__()
+            return True
+
+    def put(self, key: str, source: str, futures: list, name = ''):
+        '''Copies source into the cache under key, then evicts the least recently used files if the cache is over its size limit.
+        futures are the jobs that made source. The cache is shared by every character, so nothing is cached unless every one of them finished without an error'''
+        if not all(future.done() and not future.cancelled() and future.exception() is None for future in futures):
+            return
+        with self.lock:
+            if not self.is_open():
+                return
+            try:
+                temp_path = self.__path__(key) + '.tmp'
+                shutil.copyfile(source, temp_path)
+                os.replace(temp_path, self.__path__(key))
+            except OSError:
+                return
+            self.entries[key] = {'size': os.path.getsize(self.__path__(key)), 'atime': time.time(), 'name': name}
+            self.__evict__()
+            self.__save_manifest__()
+
+    def clear(self):
+        '''Deletes every file in the cache'''
+        with self.lock:
+            if not self.is_open():
+                return
+            for key in list(self.entries):
+                self.__remove__(key)
+            self.__save_manifest__()
+
+    def __path__(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.png')
+
+    def __remove__(self, key: str):
+        try:
+            os.remove(self.__path__(key))
+        except OSError:
+            pass
+        del self.entries[key]
+
+    def __evict__(self):
+        total = sum(entry['size'] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['atime']):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries[key]['size']
+            self.__remove__(key)
+
+    def __save_manifest__(self):
+        manifest_path = os.path.join(self.directory, self.manifest_name)
+        try:
+            with open(manifest_path + '.tmp', 'w') as manifest:
+                json.dump({'version': 1, 'entries': self.entries}, manifest)
+            os.replace(manifest_path + '.tmp', manifest_path)
+        except OSError:
+            pass
+
+texture_cache = TextureCache()
@@ -0,0 +1,98 @@
+'''
+Content addressed folder for the textures of .blend files that don't pack their textures.
+
+Packing every texture makes the .blend file several gigabytes large, which makes saving, autosave and undo slow.
+When the texture storage setting is set to the texture store, each texture is copied into the store folder under a hash of its file
+and the image is pointed at that copy. A texture that is used by several characters or under several names is only stored once,
+and a file in the store never changes after it's written, so the .blend file can't end up pointing at a different texture.
+The paths become relative to the .blend file when it's saved, so the .blend file and the store can be moved together.
+The pack for distribution operator packs every texture back into the .blend file when it has to be shared as a single file.
+'''
+
+import bpy, os, shutil, hashlib
+
+class TextureStore:
+    '''
+    Copies textures into the texture store folder. The instance is declared at the bottom of the file
+    '''
+
+    folder_name = 'kkbp_textures'
+
+    def __init__(self):
+        self.digests = {}  # (file path, size, modification time): hash of the file, so unchanged files aren't read again
+
+    @staticmethod
+    def get_preferences():
+        return bpy.context.preferences.addons[__package__[:__package__.rindex('.')]].preferences
+
+    def get_directory(self) -> str:
+        '''Returns the store folder. If it isn't set in the preferences, it's next to the .blend file or in the import folder if the file isn't saved yet.
+        Returns an empty string if there is nowhere to put it'''
+        if directory := self.get_preferences().texture_store_dir:
+            return bpy.path.abspath(directory)
+        if bpy.data.filepath:
+            return bpy.path.abspath('//' + self.folder_name)
+        if bpy.context.scene.kkbp.import_dir:
+            return os.path.join(bpy.context.scene.kkbp.import_dir, self.folder_name)
+        return ''
+
+    def file_digest(self, path: str) -> str:
+        '''Hashes the bytes of the file at path'''
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if digest := self.digests.get(key):
+            return digest
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, 'rb') as file:
+            while chunk := file.read(1 << 20):
+                digest.update(chunk)
+        self.digests[key] = digest.hexdigest()
+        return self.digests[key]
+
+    def add(self, source: str, directory: str) -> str:
+        '''Copies the file at source into directory under the hash of its bytes and returns the path of the copy.
+        Nothing is copied if the file is already in the store'''
+        directory = os.path.abspath(directory)
+        if os.path.dirname(os.path.abspath(source)) == directory:
+            return source
+        stored_path = os.path.join(directory, self.file_digest(source) + os.path.splitext(source)[1].lower())
+        if not os.path.isfile(stored_path):
+            os.makedirs(directory, exist_ok=True)
+            shutil.copyfile(source, stored_path + '.tmp')
+            os.replace(stored_path + '.tmp', stored_path)
+        return stored_path
+
+    def store_image(self, image: bpy.types.Image):
+        '''Packs the image into the .blend file, or copies its file into the texture store and points the image at the copy
+        if the textures are kept outside of the .blend file. Images that are packed, linked from a library or not loaded from a file are left alone'''
+        if image.packed_file or image.library or image.source != 'FILE':
+            return
+        source = bpy.path.abspath(image.filepath_raw)
+        if not os.path.isfile(source):
+            return
+        if self.get_preferences().texture_storage == 'A':
+            image.pack()
+            return
+        if not (directory := self.get_directory()):
+            image.pack()
+            return
+        stored_path = self.add(source, directory)
+        if stored_path == source:
+            return
+        #the pixels are the same, so the image doesn't have to be reloaded from the new path
+        try:
+            image.filepath_raw = bpy.path.relpath(stored_path) if bpy.data.filepath else stored_path
+        except ValueError:
+            #the store is on a different drive than the .blend file
+            image.filepath_raw = stored_path
+
+    def pack_all(self) -> int:
+        '''Packs every image that is loaded from a file into the .blend file. Returns how many images were packed'''
+        packed = 0
+        for image in bpy.data.images:
+            if not image.packed_file and not image.library and image.source == 'FILE' and os.path.isfile(bpy.path.abspath(image.filepath_raw)):
+                image.pack()
+                packed += 1
+        return packed
+
+texture_store = TextureStore()
@@ -124,7 +124,7 @@ translation_dictionary = {
     'bake_mats_tt'      : "Finalize materials as .png files. These will be stored in the original .pmx folder",
 
     'delete_cache' : 'Delete cache',
-    'delete_cache_tt' : 'Enable this to delete the cache files. Cache files are generated when you import a model or finalize materials. These are stored in the pmx folder as "atlas_files", "baked_files", "dark_files" and "saturated_files". Enabling this option will delete ALL files inside of these folders',
+    'delete_cache_tt' : 'Enable this to delete the cache files. Cache files are generated when you import a model or finalize materials. These are stored in the pmx folder as "atlas_files", "baked_files", "dark_files", "saturated_files" and "traces", and the json cache of this pmx folder is in the Blender user data folder. Enabling this option will delete ALL files inside of these folders',
 
     'use_atlas' : 'Create atlas',
     'use_atlas_tt': 'Enable this to create a material atlas when finalizing materials',
@@ -144,11 +144,53 @@ translation_dictionary = {
     'reset_mats_tt' : 'Click this to reset ALL of your finalized materials back to the -ORG version. Handy if you want to refinalize everything',
     
     'max_thread_num' : 'Max threads',
-    'max_image_num' : 'Max parallel images',
+    'image_memory_budget' : 'Image memory (MB)',
     'batch_rows' : 'Rows per batch',
     'max_thread_num_tt' : 'KKBP saturates your character\'s textures during model import. This option determines how many CPU cores you want to use to perform the saturation. If you have more cores to spare, you can set it higher. Default is 8.',
-    'max_image_num_tt' : 'KKBP saturates your character\'s textures during model import. This option determines how many images can be saturated at once. This setting affects memory usage. For example, if the program loads two 4096 x 4096 images, the peak memory usage could reach 8 GB. If you don\'t have 8GB of free memory Blender could crash. Default is 2',
+    'image_memory_budget_tt' : 'KKBP saturates your character\'s textures during model import. This option determines how much memory the textures being saturated at the same time can use. The size of each texture is read before it is loaded, so a lot of small textures can be saturated at once while large ones wait for memory to be freed. A single 4096 x 4096 texture needs about 800 MB. If you don\'t have this much free memory Blender could crash. Default is 4096',
     'batch_rows_tt' : 'KKBP saturates your character\'s textures during model import. This option determines how many rows of pixels to process in one batch. For example, if this setting is set to 512 rows and the program is saturating a 1024 x 1024 image, it will be processed in two 512 x 1024 batches. Increasing this value can allow you to process the full image in a single batch, but will increase CPU and memory usage. Default is 512',
+    'sat_backend' : 'Saturation backend',
+    'sat_backend_A' : 'Threads',
+    'sat_backend_A_tt' : 'Saturate textures on several threads inside of Blender. This works well on most computers',
+    'sat_backend_B' : 'Processes',
+    'sat_backend_B_tt' : 'Saturate textures on several separate processes that share the image memory with Blender. This takes a second to start up, but scales better than threads if your CPU has a lot of cores. The number of processes is set by the Max threads option',
+    'sat_engine' : 'Saturation engine',
+    'sat_engine_A' : 'LUT strip',
+    'sat_engine_A_tt' : 'Saturate textures by reading the Koikatsu LUT image directly. This is the original method and is the slowest',
+    'sat_engine_B' : 'LUT cube',
+    'sat_engine_B_tt' : 'Saturate textures using a color cube that is generated from the Koikatsu LUT image once and saved to the addon folder. This is much faster than the LUT strip, but it is an approximation. Colors can be off by up to about 3 / 255',
+    'sat_engine_C' : 'LUT table',
+    'sat_engine_C_tt' : 'Saturate textures using a table of every possible 8 bit color that is generated from the Koikatsu LUT image once and saved to the addon folder (48 MB). The first import will take a bit longer to generate the table. After that, this is the fastest option and gives the same result as the LUT strip. 16 bit textures will fall back to the LUT strip',
+    'texture_cache' : 'Texture cache',
+    'texture_cache_tt' : 'Save every saturated and dark texture to a shared cache folder. If the same texture shows up again, even on a different character, it will be copied from the cache instead of being converted again. Enabling "Delete cache" will also clear this folder',
+    'texture_cache_size' : 'Cache size (MB)',
+    'texture_cache_size_tt' : 'The largest size the texture cache folder can grow to. The oldest textures are deleted when it gets too large',
+    'texture_cache_dir_tt' : 'The folder the texture cache is stored in. Leave blank to use the Blender user data folder',
+    'texture_storage' : 'Where the textures of your character are kept',
+    'texture_storage_A' : 'Pack textures',
+    'texture_storage_A_tt' : 'Pack the textures your character uses into the .blend file when it is saved. This makes the .blend file very large, which makes saving, autosave and undo slow',
+    'texture_storage_B' : 'Texture store',
+    'texture_storage_B_tt' : 'Keep the textures your character uses in a texture store folder outside of the .blend file. Each texture is named after a hash of its contents, so a texture that is used by several characters is only stored once. Keep the folder next to the .blend file, or use the Pack for distribution button in the Extras panel before sharing the .blend file',
+    'texture_store_dir_tt' : 'The texture store folder. Leave blank to use a kkbp_textures folder next to the .blend file, or in the export folder if the .blend file hasn\'t been saved yet',
+    'pack_for_distribution' : 'Pack textures for distribution',
+    'pack_for_distribution_tt' : 'Pack every texture into the .blend file, so it can be shared as a single file',
+    'log_level' : 'The least important messages that are written to the KKBP Log',
+    'log_level_debug' : 'Log everything',
+    'log_level_debug_tt' : 'Also log a message for every image, bone and material that is processed. This makes the log very long',
+    'log_level_info' : 'Log info',
+    'log_level_info_tt' : 'Log the progress of the import and any warnings or errors',
+    'log_level_warn' : 'Log warnings',
+    'log_level_warn_tt' : 'Only log warnings and errors',
+    'log_level_error' : 'Log errors',
+    'log_level_error_tt' : 'Only log errors',
+    'log_to_file' : 'Log to file',
+    'log_to_file_tt' : 'Also write the log to kkbp.log in the kkbp_logs folder inside of the Blender user data folder. The file is rotated when it gets larger than 5MB',
+    'save_traces' : 'Save traces',
+    'save_traces_tt' : 'Save a trace of how long each part of the import, bake or export took, and how much memory it used, to the traces folder inside of the pmx folder. The trace can be opened with https://ui.perfetto.dev',
+    'trace_count' : 'Traces to keep',
+    'trace_count_tt' : 'The number of traces to keep in the traces folder. The oldest traces are deleted when a new one is saved',
+    'trace_numpy_memory' : 'Trace texture memory',
+    'trace_numpy_memory_tt' : 'Also record the most memory the texture conversion allocated in the saved traces. This slows down the texture conversion, so only enable it to debug memory usage',
     }
 
 def t(text_entry):
@@ -144,10 +144,8 @@ translation_dictionary = {
     'reset_mats_tt' : '点击此处可将你所有已最终确定的材质重置回 -ORG 版本.如果你想重新最终化（Refinalize）所有材质，这会很方便。',
 
     'max_thread_num'    : '并行线程数量',
-    'max_image_num'     : '并行处理图片数量',
     'batch_rows'        : '每批处理的行数',
     'max_thread_num_tt' : '插件会在导入模型时调整材质饱和度。这个选项指示在该过程中并行处理的线程数量。如果你有更多的CPU核心数量，可以适当调高些。默认是8',
-    'max_image_num_tt'  : '插件会在导入模型时调整材质饱和度。这个选项指示有多少张图片会被并行处理。这个选项影响内存使用。例如，如果同时处理两张4096 x 4096大小饿图片，内存使用峰值会达到8GB.如果你没这么多内存，程序会崩溃。默认为2',
     'batch_rows_tt'     : '插件会在导入模型时调整材质饱和度。这个选项指示每个线程会处理多少行像素。例如，设置为512, 当处理一张1024 x 1024的图片时，程序会把它放到两个线程中，每个线程处理512 x 1024的数据。',
 
     }
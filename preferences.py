@@ -117,16 +117,79 @@ class KKBPPreferences(bpy.types.AddonPreferences):
         default=8,
         description=t('max_thread_num_tt'))
 
-    max_image_num: IntProperty(
-        min=1, max = 10,
-        default=2,
-        description=t('max_image_num_tt'))
+    image_memory_budget: IntProperty(
+        min=256, max = 65536,
+        default=4096,
+        description=t('image_memory_budget_tt'))
 
     batch_rows: IntProperty(
         min=256, max = 4096,
         default=512,
         description=t('batch_rows_tt'))
 
+    saturation_backend : EnumProperty(
+        items=(
+            ("A", t('sat_backend_A'), t('sat_backend_A_tt')),
+            ("B", t('sat_backend_B'), t('sat_backend_B_tt')),
+        ), name="", default="A", description=t('sat_backend'))
+
+    saturation_engine : EnumProperty(
+        items=(
+            ("A", t('sat_engine_A'), t('sat_engine_A_tt')),
+            ("B", t('sat_engine_B'), t('sat_engine_B_tt')),
+            ("C", t('sat_engine_C'), t('sat_engine_C_tt')),
+        ), name="", default="C", description=t('sat_engine'))
+
+    use_texture_cache : BoolProperty(
+    description=t('texture_cache_tt'),
+    default = True)
+
+    texture_cache_dir : StringProperty(
+        subtype='DIR_PATH',
+        default='',
+        description=t('texture_cache_dir_tt'))
+
+    texture_cache_size: IntProperty(
+        min=256, max = 65536,
+        default=4096,
+        description=t('texture_cache_size_tt'))
+
+    texture_storage : EnumProperty(
+        items=(
+            ("A", t('texture_storage_A'), t('texture_storage_A_tt')),
+            ("B", t('texture_storage_B'), t('texture_storage_B_tt')),
+        ), name="", default="A", description=t('texture_storage'))
+
+    texture_store_dir : StringProperty(
+        subtype='DIR_PATH',
+        default='',
+        description=t('texture_store_dir_tt'))
+
+    log_level : EnumProperty(
+        items=(
+            ("DEBUG", t('log_level_debug'), t('log_level_debug_tt')),
+            ("INFO", t('log_level_info'), t('log_level_info_tt')),
+            ("WARN", t('log_level_warn'), t('log_level_warn_tt')),
+            ("ERROR", t('log_level_error'), t('log_level_error_tt')),
+        ), name="", default="INFO", description=t('log_level'))
+
+    log_to_file : BoolProperty(
+    description=t('log_to_file_tt'),
+    default = False)
+
+    save_traces : BoolProperty(
+    description=t('save_traces_tt'),
+    default = False)
+
+    trace_count: IntProperty(
+        min=1, max = 1000,
+        default=10,
+        description=t('trace_count_tt'))
+
+    trace_numpy_memory : BoolProperty(
+    description=t('trace_numpy_memory_tt'),
+    default = False)
+
     def draw(self, context):
         layout = self.layout
         splitfac = 0.5
@@ -184,6 +247,30 @@ class KKBPPreferences(bpy.types.AddonPreferences):
         row = col.row(align=True)
         split = row.split(align=True, factor=0.33)
         split.prop(self, "max_thread_num", text = t('max_thread_num'))
-        split.prop(self, "max_image_num", text = t('max_image_num'))
+        split.prop(self, "image_memory_budget", text = t('image_memory_budget'))
         split.prop(self, "batch_rows", text = t('batch_rows'))
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "saturation_backend")
+        split.prop(self, "saturation_engine")
+        row = col.row(align=True)
+        split = row.split(align=True, factor=0.33)
+        split.prop(self, "use_texture_cache", toggle=True, text = t('texture_cache'))
+        split.prop(self, "texture_cache_size", text = t('texture_cache_size'))
+        split.prop(self, "texture_cache_dir", text = '')
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "texture_storage")
+        split.prop(self, "texture_store_dir", text = '')
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "log_level")
+        split.prop(self, "log_to_file", toggle=True, text = t('log_to_file'))
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "save_traces", toggle=True, text = t('save_traces'))
+        split.prop(self, "trace_count", text = t('trace_count'))
+        row = col.row(align=True)
+        split = row.split(align=True, factor=splitfac)
+        split.prop(self, "trace_numpy_memory", toggle=True, text = t('trace_numpy_memory'))
 